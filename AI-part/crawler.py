@@ -0,0 +1,298 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+import aiohttp
+
+from page_cache import PageCache, write_atomic
+
+
+def strip_fragment(url: str) -> str:
+    """URL без якоря (#...): страницы с разными якорями считаются одной."""
+    return urlparse(url)._replace(fragment='').geturl()
+
+
+class HostLimiter:
+    """Вежливость к сайту: не больше per_host одновременных запросов к хосту
+    и не меньше delay секунд между началами запросов к нему."""
+
+    def __init__(self, per_host: int, delay: float):
+        self.per_host = per_host
+        self.delay = delay
+        self._semaphores = {}
+        self._locks = {}
+        self._next_start = {}
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host)
+            self._locks[host] = asyncio.Lock()
+            self._next_start[host] = 0.0
+        return self._semaphores[host]
+
+    async def acquire(self, host: str):
+        await self._semaphore(host).acquire()
+        # Паузы между запросами выдерживаются по очереди, даже если их несколько одновременно
+        async with self._locks[host]:
+            wait = self._next_start[host] - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_start[host] = time.monotonic() + self.delay
+
+    def release(self, host: str):
+        self._semaphores[host].release()
+
+
+class Crawler:
+    """Обход сайта в ширину несколькими асинхронными загрузчиками.
+
+    extract(url, html) -> (текст страницы или None, список ссылок) - часть,
+    своя для каждого сайта; allow(url) решает, надо ли загружать ссылку.
+    Очередь - deque, посещенные - множество, так что проверка ссылки
+    занимает O(1). Соединения переиспользуются (keep-alive), к одному хосту
+    идет не больше per_host запросов одновременно и не чаще раза в delay
+    секунд.
+
+    Тексты не копятся в памяти: каждая страница сразу дописывается строкой
+    JSON в records_path в порядке обнаружения, как при обходе по одной
+    (страницы, загруженные раньше своей очереди, ждут в небольшом буфере).
+    Ссылки страницы тоже ставятся в очередь только в момент ее записи,
+    поэтому порядок и номера страниц не зависят от того, какой запрос
+    ответил раньше.
+    Раз в checkpoint_interval секунд и при прерывании очередь и посещенные
+    сохраняются в records_path + ".checkpoint"; следующий запуск продолжает
+    обход с этого места. Текстовый файл собирает assemble().
+
+    С cache (PageCache) страницы запрашиваются условно (If-None-Match,
+    If-Modified-Since): на ответ 304 или на то же тело берутся текст и
+    ссылки из кэша, а extract вызывается только для изменившихся страниц.
+    С offline=True сеть не используется вовсе: обход идет по ссылкам,
+    сохраненным в кэше.
+    """
+
+    def __init__(self, start_urls: list, extract, allow, records_path: str, concurrency: int = 8,
+                 per_host: int = 4, delay: float = 0.5, timeout: float = 15,
+                 user_agent: str = "dnd-rules-crawler", cache: PageCache = None, offline: bool = False,
+                 checkpoint_interval: float = 30):
+        if offline and cache is None:
+            raise ValueError("Для обхода без сети нужен кэш страниц")
+        self.start_urls = [strip_fragment(url) for url in start_urls]
+        self.extract = extract
+        self.allow = allow
+        self.records_path = records_path
+        self.checkpoint_path = records_path + ".checkpoint"
+        self.checkpoint_interval = checkpoint_interval
+        self.concurrency = concurrency
+        self.limiter = HostLimiter(per_host, delay)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.headers = {"User-Agent": user_agent}
+        self.frontier = deque()
+        self.seen = set()
+        self.written = 0
+        self.errors = 0
+        self.cache = cache
+        self.offline = offline
+        # Загружено и разобрано заново / ответ 304 / то же тело без 304 / взято из кэша без сети
+        self.stats = {"downloaded": 0, "not_modified": 0, "unchanged": 0, "from_cache": 0}
+        # URL, еще не записанные в records_path -> номер в порядке обнаружения
+        self._order = {}
+        self._next_order = 0
+        self._next_write = 0
+        # Обработанные страницы, которые ждут записи предыдущих: номер -> (URL, текст, ссылки)
+        self._finished = {}
+        self._records = None
+        self._checkpoint_at = 0.0
+        self._active = 0
+        self._frontier_changed = None
+
+    def add(self, url: str):
+        """Ставит ссылку в очередь, если она еще не встречалась и разрешена allow."""
+        url = strip_fragment(url)
+        if url in self.seen:
+            return
+        self.seen.add(url)
+        if not self.allow(url):
+            return
+        self._order[url] = self._next_order
+        self._next_order += 1
+        self.frontier.append(url)
+        self._frontier_changed.set()
+
+    def _open(self, restart: bool) -> bool:
+        """Открывает records_path; возвращает True, если обход продолжен с контрольной точки."""
+        if restart or not (os.path.exists(self.checkpoint_path) and os.path.exists(self.records_path)):
+            self._records = open(self.records_path, 'w', encoding='utf-8')
+            for url in self.start_urls:
+                self.add(url)
+            return False
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            state = json.load(f)
+        self.seen = set(state["seen"])
+        self._next_order = state["next_order"]
+        self._next_write = state["next_write"]
+        self.written = state["written"]
+        self.stats = state["stats"]
+        # Строки, дописанные после контрольной точки, отбрасываются: эти страницы обработаются заново
+        with open(self.records_path, 'r+b') as f:
+            f.truncate(state["records_size"])
+        self._records = open(self.records_path, 'a', encoding='utf-8')
+        for order, url in state["pending"]:
+            self._order[url] = order
+            self.frontier.append(url)
+        return True
+
+    def save_checkpoint(self):
+        self._records.flush()
+        os.fsync(self._records.fileno())
+        state = {
+            "records_size": self._records.tell(),
+            "next_order": self._next_order,
+            "next_write": self._next_write,
+            "written": self.written,
+            "stats": self.stats,
+            # Включая страницы, которые сейчас загружаются: после возобновления их загрузят снова
+            "pending": sorted((order, url) for url, order in self._order.items()),
+            "seen": sorted(self.seen),
+        }
+        write_atomic(self.checkpoint_path, json.dumps(state, ensure_ascii=False).encode('utf-8'))
+        self._checkpoint_at = time.monotonic()
+
+    def _finish(self, url: str, text, links: list):
+        """Отмечает страницу обработанной, записывает все страницы, до которых дошла очередь,
+        и ставит в очередь их ссылки."""
+        self._finished[self._order[url]] = (url, text, links)
+        while self._next_write in self._finished:
+            url, text, links = self._finished.pop(self._next_write)
+            if text:
+                record = {"n": self._next_write, "url": url, "text": text}
+                self._records.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.written += 1
+            del self._order[url]
+            self._next_write += 1
+            for link in links:
+                self.add(link)
+        self._records.flush()
+        if time.monotonic() - self._checkpoint_at >= self.checkpoint_interval:
+            self.save_checkpoint()
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, headers: dict = None):
+        """Загружает страницу с учетом ограничений хоста.
+
+        Возвращает (статус, HTML, заголовки ответа) или None при ошибке.
+        """
+        host = urlparse(url).netloc
+        await self.limiter.acquire(host)
+        try:
+            async with session.get(url, headers=headers) as response:
+                response.raise_for_status()
+                return response.status, await response.text(encoding='utf-8'), response.headers
+        except asyncio.TimeoutError:
+            print(f"Таймаут при запросе {url}")
+        except aiohttp.ClientError as e:
+            print(f"Ошибка при запросе {url}: {e}")
+        finally:
+            self.limiter.release(host)
+        self.errors += 1
+        return None
+
+    async def process(self, session: aiohttp.ClientSession, url: str):
+        """Загружает и разбирает страницу; возвращает (текст или None, ссылки)."""
+        print(f"Обрабатывается: {url}")
+        record = self.cache.get(url) if self.cache else None
+        if self.offline:
+            if record is None:
+                print(f"  -> Страницы нет в кэше: {url}")
+                return None, []
+            self.stats["from_cache"] += 1
+            text, links = record["text"], record["links"]
+        else:
+            result = await self.fetch(session, url, PageCache.validators(record) if record else None)
+            if result is None:
+                return None, []
+            status, html, headers = result
+            if status == 304:
+                self.stats["not_modified"] += 1
+                text, links = record["text"], record["links"]
+            elif record is not None and self.cache.body_hash(html) == record["body"]:
+                # Сервер не поддерживает условные запросы, но страница не изменилась;
+                # запись кэша обновляется, чтобы в ней были свежие ETag и Last-Modified
+                self.stats["unchanged"] += 1
+                text, links = record["text"], record["links"]
+                await asyncio.to_thread(self.cache.put, url, html, headers, text, links)
+            else:
+                # Разбор HTML занимает заметное время, поэтому не держит event loop
+                text, links = await asyncio.to_thread(self.extract, url, html)
+                if self.cache:
+                    await asyncio.to_thread(self.cache.put, url, html, headers, text, links)
+                self.stats["downloaded"] += 1
+        if text:
+            print(f"  -> Добавлено ~{len(text)} символов.")
+        else:
+            print(f"  -> Не найден основной контент на странице: {url}")
+        return text, links
+
+    async def _worker(self, session: aiohttp.ClientSession):
+        while True:
+            while not self.frontier:
+                if not self._active:
+                    return
+                self._frontier_changed.clear()
+                await self._frontier_changed.wait()
+            url = self.frontier.popleft()
+            self._active += 1
+            try:
+                try:
+                    text, links = await self.process(session, url)
+                except Exception as e:
+                    print(f"Неожиданная ошибка при обработке {url}: {e}")
+                    self.errors += 1
+                    text, links = None, []
+                self._finish(url, text, links)
+            finally:
+                self._active -= 1
+                # Разбудить ждущих: появились ссылки или обход закончился
+                self._frontier_changed.set()
+
+    async def _crawl(self):
+        if self.offline:
+            await asyncio.gather(*(self._worker(None) for _ in range(self.concurrency)))
+            return
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.limiter.per_host)
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                         headers=self.headers) as session:
+            await asyncio.gather(*(self._worker(session) for _ in range(self.concurrency)))
+
+    async def run(self, restart: bool = False) -> int:
+        """Обходит сайт (или продолжает прерванный обход); возвращает число записанных страниц."""
+        self._frontier_changed = asyncio.Event()
+        if self._open(restart):
+            print(f"Продолжаем прерванный обход: записано {self.written} страниц, "
+                  f"в очереди {len(self.frontier)}")
+        self._checkpoint_at = time.monotonic()
+        try:
+            await self._crawl()
+        except BaseException:
+            # Ctrl-C или сбой: сохранить место, с которого продолжить
+            self.save_checkpoint()
+            print(f"Обход прерван, следующий запуск продолжит его ({self.checkpoint_path})")
+            raise
+        finally:
+            self._records.close()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return self.written
+
+
+def assemble(records_path: str, output_path: str) -> int:
+    """Собирает тексты страниц из records_path в один файл через пустую строку; возвращает их число."""
+    pages = 0
+    with open(records_path, encoding='utf-8') as records, open(output_path, 'w', encoding='utf-8') as output:
+        for line in records:
+            if pages:
+                output.write("\n\n")
+            output.write(json.loads(line)["text"])
+            pages += 1
+    return pages
@@ -1,31 +1,33 @@
-import os
+# Синтез обучающих примеров по фрагментам правил.
+# Запросы идут параллельно (dataset_runner.py) в пределах квоты модели, временные ошибки
+# API повторяются с паузой. Готовые фрагменты записываются в манифест (OUTPUT_JSONL_FILE без
+# .jsonl + .manifest.jsonl), и повторный запуск отправляет в API только новые фрагменты,
+# фрагменты с ошибкой и фрагменты, на которые модель не дала примеров (пустой или заблокированный
+# ответ); датасет пересобирается из манифеста целиком, без дублей.
+# Запуск:
+#   GOOGLE_API_KEY=... python AI-part/creating_dataset.py --rpm 60 --concurrency 8
+#   python AI-part/creating_dataset.py --backend openai --base-url http://127.0.0.1:8090 --model fake  # см. fake_llm_server.py
+import argparse
+import asyncio
+import hashlib
 import json
-import time # Для возможных задержек между запросами
-# import openai # Заменяем на google-generativeai
-import google.generativeai as genai # Добавляем импорт Google
-
-# --- Настройка ---
-# Загрузка API ключа (лучше из переменных окружения)
-try:
-    # Настраиваем ключ API Google (убедитесь, что переменная окружения установлена)
-    google_api_key = os.getenv("GOOGLE_API_KEY")
-    if not google_api_key:
-        raise ValueError("Переменная окружения GOOGLE_API_KEY не установлена.")
-    genai.configure(api_key=google_api_key)
-except ValueError as ve:
-    print(f"Ошибка конфигурации: {ve}")
-    exit()
-except Exception as e:
-    print(f"Неожиданная ошибка при настройке Google API: {e}")
-    exit()
+import os
 
+from dataset_runner import GeminiBackend, Manifest, OpenAICompatibleBackend, Runner
 
+# --- Настройка ---
 SRD_TEXT_FILE = "tg_bot/AI-part/free_dnd_rules.txt" # Путь к файлу с текстом SRD
 OUTPUT_JSONL_FILE = "tg_bot/AI-part/dnd_dataset.jsonl"
 # LLM_MODEL_NAME = "gemini-2.5-pro-exp-03-25" # Используем модель Gemini
 LLM_MODEL_NAME = "gemini-2.0-flash"
-# --- Функция для взаимодействия с LLM ---
-def generate_examples_with_llm(text_chunk, model_name):
+# Квота модели в запросах в минуту: бесплатный уровень Gemini обычно дает до 60 (см. консоль Google AI)
+REQUESTS_PER_MINUTE = 60
+CONCURRENCY = 8 # Сколько запросов одновременно ждут ответа
+MAX_RETRIES = 5 # Повторы при превышении квоты и ошибках сервера
+MIN_CHUNK_LENGTH = 90 # Более короткие фрагменты пропускаются
+
+# --- Промпт ---
+def build_prompt(text_chunk):
     # Важно правильно составить промпт!
     prompt = f"""
     На основе следующего текста из правил Dungeons & Dragons 5e:
@@ -51,62 +53,11 @@ def generate_examples_with_llm(text_chunk, model_name):
 
     Сгенерируй только JSON-объекты, по одному на строку:
     """
+    return prompt
 
-    try:
-        # Инициализируем модель Gemini
-        model = genai.GenerativeModel(model_name)
-        # Устанавливаем параметры генерации (опционально)
-        generation_config = genai.types.GenerationConfig(
-            temperature=0.5
-        )
-        # Устанавливаем настройки безопасности (можно настроить под себя)
-        safety_settings = {
-            "HARM_CATEGORY_HARASSMENT": "BLOCK_MEDIUM_AND_ABOVE",
-            "HARM_CATEGORY_HATE_SPEECH": "BLOCK_MEDIUM_AND_ABOVE",
-            "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_MEDIUM_AND_ABOVE",
-            "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_MEDIUM_AND_ABOVE",
-        }
-
-        print(f"Отправка промпта для фрагмента: {text_chunk[:50]}...")
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-
-        # Проверяем, не был ли ответ заблокирован фильтрами безопасности
-        # Доступ к `response.text` вызовет ошибку, если кандидатов нет
-        if not response.candidates:
-            print("Предупреждение: Ответ был заблокирован фильтрами безопасности или пуст.")
-            if response.prompt_feedback:
-                 print(f"Причина блокировки: {response.prompt_feedback.block_reason}")
-            # Возвращаем пустой список, т.к. генерации не было
-            return [] # Этот return должен быть здесь
-
-        generated_text = response.text # Получаем сгенерированный текст
-
-        # Очищаем ответ от возможных Markdown-блоков
-        cleaned_text = clean_llm_response(generated_text)
-
-        # Используем splitlines() для надежного разделения строк
-        json_lines = [line.strip() for line in cleaned_text.strip().splitlines() if line.strip()]
-        valid_examples = []
-        for line in json_lines:
-            try:
-                # Проверяем, что это валидный JSON с нужными ключами
-                data = json.loads(line)
-                if "instruction" in data and "output" in data:
-                    valid_examples.append(data)
-                else:
-                    print(f"Предупреждение: Пропущен невалидный JSON или отсутствуют ключи: {line}")
-            except json.JSONDecodeError:
-                print(f"Предупреждение: Ошибка декодирования JSON: {line}")
-        return valid_examples
-
-    except Exception as e:
-        print(f"Ошибка при вызове API Gemini или обработке ответа: {e}")
-        # Можно добавить дополнительное логирование, если нужно
-        return []
+# Версия промпта - хэш его шаблона: правка промпта делает устаревшими записи манифеста,
+# и при следующем запуске фрагменты обработаются заново уже с новым промптом
+PROMPT_VERSION = hashlib.sha256(build_prompt("{text_chunk}").encode('utf-8')).hexdigest()[:12]
 
 # --- Функция для очистки ответа LLM от Markdown ---
 def clean_llm_response(text: str) -> str:
@@ -118,47 +69,164 @@ def clean_llm_response(text: str) -> str:
         text = text[:-len("```")]
     return text.strip()
 
-# --- Основная логика ---
-try:
-    with open(SRD_TEXT_FILE, 'r', encoding='utf-8') as f_in, \
-         open(OUTPUT_JSONL_FILE, 'a', encoding='utf-8') as f_out:
-
-        srd_content = f_in.read()
-
-        # Разделение текста SRD на осмысленные части (чанки)
-        # Стратегия разделения важна! Можно делить по параграфам, секциям,
-        # или по фиксированному числу символов/токенов,
-        # чтобы не превышать лимит контекста LLM.
-        # Пример: деление по пустым строкам (параграфам)
-        text_chunks = [chunk.strip() for chunk in srd_content.split('\n\n') if chunk.strip()]
-
-        print(f"Найдено {len(text_chunks)} фрагментов текста.")
-
-        for i, chunk in enumerate(text_chunks):
-            print(f"\nОбработка фрагмента {i+1}/{len(text_chunks)}...")
-            if len(chunk) < 90: # Пропускаем слишком короткие фрагменты
-                 print("Фрагмент слишком короткий, пропуск.")
-                 continue
-
-            generated_examples = generate_examples_with_llm(chunk, LLM_MODEL_NAME)
-
-            if generated_examples:
-                print(f"Сгенерировано {len(generated_examples)} валидных примеров.")
-                for example in generated_examples:
-                    # Записываем каждый JSON как отдельную строку
-                    json.dump(example, f_out, ensure_ascii=False)
-                    f_out.write('\n')
+def parse_examples(generated_text):
+    """Выбирает из ответа модели строки-JSON с ключами instruction и output."""
+    # Очищаем ответ от возможных Markdown-блоков
+    cleaned_text = clean_llm_response(generated_text)
+
+    # Используем splitlines() для надежного разделения строк
+    json_lines = [line.strip() for line in cleaned_text.strip().splitlines() if line.strip()]
+    valid_examples = []
+    for line in json_lines:
+        try:
+            # Проверяем, что это валидный JSON с нужными ключами
+            data = json.loads(line)
+            if isinstance(data, dict) and "instruction" in data and "output" in data:
+                valid_examples.append(data)
             else:
-                print("Не удалось сгенерировать примеры для этого фрагмента.")
+                print(f"Предупреждение: Пропущен невалидный JSON или отсутствуют ключи: {line}")
+        except json.JSONDecodeError:
+            print(f"Предупреждение: Ошибка декодирования JSON: {line}")
+    return valid_examples
+
+def split_chunks(srd_content):
+    """Разделение текста SRD на осмысленные части (чанки).
+
+    Стратегия разделения важна! Можно делить по параграфам, секциям,
+    или по фиксированному числу символов/токенов,
+    чтобы не превышать лимит контекста LLM.
+    Пример: деление по пустым строкам (параграфам)
+    """
+    return [chunk.strip() for chunk in srd_content.split('\n\n') if chunk.strip()]
 
-            # Небольшая задержка, чтобы не превысить лимиты API
-            # Для Gemini API лимиты могут отличаться, возможно, можно уменьшить паузу
-            # Бесплатный уровень обычно имеет лимит 60 запросов в минуту.
-            time.sleep(1.8) # Пауза в 1.5 секунды (можно подстроить)
+def make_backend(args):
+    if args.backend == "openai":
+        return OpenAICompatibleBackend(args.base_url, args.model)
+    return GeminiBackend(args.model)
 
-    print(f"\nГенерация завершена. Примеры сохранены в {OUTPUT_JSONL_FILE}")
+def write_dataset(output_path, keys, manifest):
+    """Собирает датасет из успешных записей манифеста в порядке фрагментов; возвращает число примеров.
 
-except FileNotFoundError:
-    print(f"Ошибка: Не найден файл с текстом SRD: {SRD_TEXT_FILE}")
-except Exception as e:
-    print(f"Произошла непредвиденная ошибка: {e}")
+    Файл пишется во временный и подменяется целиком, так что читатель никогда
+    не увидит наполовину записанную строку.
+    """
+    tmp_path = f"{output_path}.tmp"
+    examples = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f_out:
+        for key in keys:
+            if manifest.status(key) != "ok":
+                continue
+            for example in manifest.entries[key]["examples"]:
+                # Записываем каждый JSON как отдельную строку
+                json.dump(example, f_out, ensure_ascii=False)
+                f_out.write('\n')
+                examples += 1
+    os.replace(tmp_path, output_path)
+    return examples
+
+# --- Основная логика ---
+async def generate_dataset(args, backend, manifest, todo):
+    runner = Runner(backend, args.rpm, concurrency=args.concurrency, max_retries=args.max_retries)
+    totals = {"chunks": 0, "examples": 0, "empty": 0}
+
+    async def handle(item):
+        i, key, chunk = item
+        print(f"Отправка промпта для фрагмента {i+1}: {chunk[:50]}...")
+        try:
+            generated_text = await runner.generate(build_prompt(chunk))
+        except Exception as e:
+            # Фрагмент с ошибкой попадет в следующий запуск
+            manifest.record(key, "failed", error=str(e))
+            raise
+        generated_examples = parse_examples(generated_text)
+        totals["chunks"] += 1
+        if generated_examples:
+            manifest.record(key, "ok", generated_examples)
+            print(f"Фрагмент {i+1}: сгенерировано {len(generated_examples)} валидных примеров.")
+            totals["examples"] += len(generated_examples)
+        else:
+            # Как и ошибка, пустой ответ не считается готовым: следующий запуск спросит еще раз
+            reason = "нет валидных примеров в ответе" if generated_text.strip() else "пустой или заблокированный ответ"
+            manifest.record(key, "empty", error=reason)
+            totals["empty"] += 1
+            print(f"Не удалось сгенерировать примеры для фрагмента {i+1}: {reason}.")
+
+    try:
+        await runner.run(todo, handle)
+    finally:
+        manifest.close()
+
+    stats = runner.stats
+    print(f"\nГенерация завершена. Фрагментов обработано {totals['chunks']}, без примеров {totals['empty']}, "
+          f"с ошибкой {stats['failed']}; новых примеров {totals['examples']}; "
+          f"запросов к API {stats['requests']}, из них повторов {stats['retries']}.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтез датасета по тексту правил")
+    parser.add_argument("--input", default=SRD_TEXT_FILE)
+    parser.add_argument("--output", default=OUTPUT_JSONL_FILE)
+    parser.add_argument("--backend", choices=["gemini", "openai"], default="gemini",
+                        help="openai - любой сервер с OpenAI-совместимым API")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8090", help="Адрес сервера для --backend openai")
+    parser.add_argument("--model", default=LLM_MODEL_NAME)
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="Квота запросов в минуту")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--manifest", default=None, help="Манифест обработанных фрагментов (по умолчанию рядом с --output)")
+    args = parser.parse_args()
+    manifest_path = args.manifest or os.path.splitext(args.output)[0] + ".manifest.jsonl"
+
+    try:
+        with open(args.input, 'r', encoding='utf-8') as f_in:
+            text_chunks = split_chunks(f_in.read())
+    except FileNotFoundError:
+        print(f"Ошибка: Не найден файл с текстом SRD: {args.input}")
+        return
+    print(f"Найдено {len(text_chunks)} фрагментов текста.")
+
+    if not os.path.exists(manifest_path) and os.path.exists(args.output) and os.path.getsize(args.output):
+        # Датасет от запуска без манифеста будет пересобран, старые примеры сохраняются отдельно
+        os.replace(args.output, args.output + ".bak")
+        print(f"Датасет без манифеста перенесен в {args.output}.bak")
+    manifest = Manifest(manifest_path)
+    keys, todo, seen = [], [], set()
+    retried = {"failed": 0, "empty": 0}
+    for i, chunk in enumerate(text_chunks):
+        if len(chunk) < MIN_CHUNK_LENGTH: # Пропускаем слишком короткие фрагменты
+            continue
+        key = Manifest.key(chunk, args.model, PROMPT_VERSION)
+        if key in seen: # Повторяющийся фрагмент обрабатывается один раз
+            continue
+        seen.add(key)
+        keys.append(key)
+        status = manifest.status(key)
+        if status != "ok":
+            if status in retried:
+                retried[status] += 1
+            todo.append((i, key, chunk))
+    print(f"Промпт версии {PROMPT_VERSION}, модель {args.model}: готово {len(keys) - len(todo)} фрагментов, "
+          f"к обработке {len(todo)} (из них после ошибки {retried['failed']}, "
+          f"после ответа без примеров {retried['empty']}).")
+
+    if todo:
+        try:
+            backend = make_backend(args)
+        except ValueError as ve:
+            print(f"Ошибка конфигурации: {ve}")
+            return
+        except Exception as e:
+            print(f"Неожиданная ошибка при настройке API: {e}")
+            return
+
+        try:
+            asyncio.run(generate_dataset(args, backend, manifest, todo))
+        except KeyboardInterrupt:
+            print("\nГенерация прервана, готовые фрагменты сохранены в манифесте.")
+        except Exception as e:
+            print(f"Произошла непредвиденная ошибка: {e}")
+
+    examples = write_dataset(args.output, keys, manifest)
+    print(f"Датасет собран: {examples} примеров сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
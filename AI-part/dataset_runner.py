@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+import aiohttp
+
+
+class RetryableError(Exception):
+    """Временная ошибка API (квота, 5xx, сеть): запрос стоит повторить позже."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate_per_minute в среднем и не больше burst подряд."""
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = rate_per_minute / 60
+        self.capacity = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        # Ожидающие получают разрешения по очереди, а не все разом после паузы
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class GeminiBackend:
+    """Google Gemini через google-generativeai; модель создается один раз на весь запуск."""
+
+    def __init__(self, model_name: str, temperature: float = 0.5):
+        import google.generativeai as genai
+        from google.api_core import exceptions
+
+        google_api_key = os.getenv("GOOGLE_API_KEY")
+        if not google_api_key:
+            raise ValueError("Переменная окружения GOOGLE_API_KEY не установлена.")
+        genai.configure(api_key=google_api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self.generation_config = genai.types.GenerationConfig(temperature=temperature)
+        # Настройки безопасности (можно настроить под себя)
+        self.safety_settings = {
+            "HARM_CATEGORY_HARASSMENT": "BLOCK_MEDIUM_AND_ABOVE",
+            "HARM_CATEGORY_HATE_SPEECH": "BLOCK_MEDIUM_AND_ABOVE",
+            "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_MEDIUM_AND_ABOVE",
+            "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_MEDIUM_AND_ABOVE",
+        }
+        # Квота (429) и ошибки сервера; остальное (400, неверный ключ) повторять бесполезно
+        self.retryable = (exceptions.ResourceExhausted, exceptions.TooManyRequests, exceptions.InternalServerError,
+                          exceptions.ServiceUnavailable, exceptions.GatewayTimeout, exceptions.DeadlineExceeded)
+
+    async def generate(self, prompt: str) -> str:
+        try:
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config=self.generation_config,
+                safety_settings=self.safety_settings
+            )
+        except self.retryable as e:
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+
+        # Доступ к `response.text` вызовет ошибку, если кандидатов нет
+        if not response.candidates:
+            print("Предупреждение: Ответ был заблокирован фильтрами безопасности или пуст.")
+            if response.prompt_feedback:
+                print(f"Причина блокировки: {response.prompt_feedback.block_reason}")
+            return ""
+        return response.text
+
+    async def close(self):
+        pass
+
+
+class OpenAICompatibleBackend:
+    """Любой сервер с OpenAI-совместимым /v1/chat/completions (vLLM, llama.cpp, тестовый fake_llm_server.py).
+
+    Одна сессия aiohttp с keep-alive на весь запуск.
+    """
+
+    def __init__(self, base_url: str, model_name: str, temperature: float = 0.5, timeout: float = 120):
+        self.url = base_url.rstrip("/") + "/v1/chat/completions"
+        self.model_name = model_name
+        self.temperature = temperature
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.headers = {}
+        if os.getenv("OPENAI_API_KEY"):
+            self.headers["Authorization"] = f"Bearer {os.getenv('OPENAI_API_KEY')}"
+        self._session = None
+
+    async def generate(self, prompt: str) -> str:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self.timeout, headers=self.headers)
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature,
+        }
+        try:
+            async with self._session.post(self.url, json=payload) as response:
+                if response.status == 429 or response.status >= 500:
+                    retry_after = response.headers.get("Retry-After")
+                    raise RetryableError(f"HTTP {response.status}",
+                                         float(retry_after) if retry_after and retry_after.isdigit() else None)
+                if response.status >= 400:
+                    raise RuntimeError(f"HTTP {response.status}: {(await response.text())[:200]}")
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RetryableError(f"Ошибка соединения: {e!r}") from e
+        return data["choices"][0]["message"]["content"] or ""
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class Runner:
+    """Параллельные запросы к модели в пределах квоты.
+
+    Не больше concurrency запросов одновременно и не чаще requests_per_minute
+    (TokenBucket). Временные ошибки повторяются до max_retries раз с
+    экспоненциальной паузой со случайным разбросом, чтобы повторы разных
+    запросов не приходили одновременно; Retry-After сервера имеет приоритет.
+    """
+
+    def __init__(self, backend, requests_per_minute: float, concurrency: int = 8, max_retries: int = 5,
+                 base_delay: float = 2.0, max_delay: float = 60.0):
+        self.backend = backend
+        self.bucket = TokenBucket(requests_per_minute, burst=max(1, min(concurrency, int(requests_per_minute / 60))))
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "retries": 0, "failed": 0}
+
+    async def generate(self, prompt: str) -> str:
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            self.stats["requests"] += 1
+            try:
+                return await self.backend.generate(prompt)
+            except RetryableError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = e.retry_after or random.uniform(0.5, 1.0) * min(self.max_delay, self.base_delay * 2 ** attempt)
+                self.stats["retries"] += 1
+                print(f"Временная ошибка API ({e}), повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+
+    async def run(self, items, handle):
+        """Вызывает await handle(item) для всех items, не больше concurrency одновременно.
+
+        Ошибка одного элемента не останавливает остальные: она печатается и
+        считается в stats["failed"].
+        """
+        items = iter(items)
+
+        async def worker():
+            # Общий итератор: каждый элемент достается ровно одному обработчику
+            for item in items:
+                try:
+                    await handle(item)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    print(f"Ошибка при вызове API или обработке ответа: {e}")
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            await self.backend.close()
+
+
+class Manifest:
+    """Журнал обработанных фрагментов: по строке JSON на каждый результат.
+
+    Ключ записи - хэш текста фрагмента, имя модели и версия промпта, так
+    что смена модели или промпта делает устаревшими только записи с
+    прежними значениями. Запись хранит статус (ok; failed - ошибка API;
+    empty - ответ без примеров, в том числе заблокированный), число и сами
+    примеры. Строки только дописываются, целиком и с fsync; при повторе
+    фрагмента действует последняя строка. Оборванная при сбое последняя
+    строка отбрасывается при открытии.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self._file = None
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            print(f"Отброшена оборванная последняя строка манифеста {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete)
+        for line in data[:complete].decode('utf-8').splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Предупреждение: Пропущена поврежденная строка манифеста: {line[:80]}")
+                continue
+            self.entries[entry["key"]] = entry
+
+    @staticmethod
+    def key(chunk: str, model_name: str, prompt_version: str) -> str:
+        chunk_hash = hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+        return f"{chunk_hash}:{model_name}:{prompt_version}"
+
+    def status(self, key: str):
+        """ok, failed, empty или None, если фрагмент с такими моделью и промптом еще не обрабатывался."""
+        entry = self.entries.get(key)
+        return entry["status"] if entry else None
+
+    def record(self, key: str, status: str, examples: list = (), error: str = None):
+        entry = {"key": key, "status": status, "examples_count": len(examples), "examples": list(examples),
+                 "error": error, "time": time.time()}
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        # Одна запись - один write: строка не перемешается с соседними
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.entries[key] = entry
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
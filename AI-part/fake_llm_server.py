@@ -0,0 +1,87 @@
+# Поддельный OpenAI-совместимый сервер для проверки creating_dataset.py без расходов на API.
+# Отвечает несколькими JSON-примерами с задержкой, возвращает 429 сверх квоты запросов
+# в минуту и случайные 5xx, как настоящий API под нагрузкой, а с --empty-rate - пустые
+# ответы, как при срабатывании фильтров безопасности.
+# Запуск:
+#   python AI-part/fake_llm_server.py --port 8090 --rpm 120 --error-rate 0.05 --latency 1.5
+#   python AI-part/creating_dataset.py --backend openai --base-url http://127.0.0.1:8090 --model fake --rpm 120
+# Счетчики запросов: curl http://127.0.0.1:8090/stats
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import deque
+
+from aiohttp import web
+
+
+def make_app(rpm: int, error_rate: float, latency: float, period: float = 60,
+             empty_rate: float = 0.0) -> web.Application:
+    """Приложение сервера; квота - rpm запросов за period секунд (в тестах период короче минуты)."""
+    # Время принятых запросов за последний период
+    window = deque()
+    stats = {"requests": 0, "ok": 0, "empty": 0, "rate_limited": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+
+    async def chat_completions(request):
+        stats["requests"] += 1
+        now = time.monotonic()
+        while window and now - window[0] >= period:
+            window.popleft()
+        if len(window) >= rpm:
+            stats["rate_limited"] += 1
+            retry_after = int(period - (now - window[0])) + 1
+            return web.json_response({"error": {"message": "Quota exceeded"}}, status=429,
+                                     headers={"Retry-After": str(retry_after)})
+        window.append(now)
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response({"error": {"message": "Backend unavailable"}}, status=503)
+
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+        finally:
+            stats["in_flight"] -= 1
+        # Первая строка текста из промпта, чтобы примеры отличались
+        topic = next((line.strip() for line in prompt.split("--- ТЕКСТ НАЧАЛО ---", 1)[-1].splitlines()
+                      if line.strip()), "")[:60]
+        examples = [{"instruction": f"Вопрос {n + 1} по тексту: {topic}", "output": f"Ответ {n + 1}."}
+                    for n in range(4)]
+        content = "```json\n" + "\n".join(json.dumps(e, ensure_ascii=False) for e in examples) + "\n```"
+        if random.random() < empty_rate:
+            stats["empty"] += 1
+            content = ""
+        else:
+            stats["ok"] += 1
+        return web.json_response({"object": "chat.completion", "model": body.get("model"),
+                                  "choices": [{"index": 0, "finish_reason": "stop",
+                                               "message": {"role": "assistant", "content": content}}]})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поддельный OpenAI-совместимый сервер для creating_dataset.py")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--rpm", type=int, default=120, help="Квота запросов в минуту, сверх нее - 429")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Доля ответов 503")
+    parser.add_argument("--latency", type=float, default=1.5, help="Средняя задержка ответа, с")
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="Доля пустых (заблокированных) ответов")
+    args = parser.parse_args()
+    print(f"Поддельный сервер: http://127.0.0.1:{args.port}, квота {args.rpm} запросов в минуту")
+    web.run_app(make_app(args.rpm, args.error_rate, args.latency, empty_rate=args.empty_rate),
+                host="127.0.0.1", port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_atomic(path: str, data: bytes):
+    """Запись через временный файл: прерванный запуск не оставит половину файла.
+
+    Имя временного файла уникально (mkstemp), поэтому одновременные записи
+    одного пути из разных потоков не портят друг другу данные.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class PageCache:
+    """Кэш загруженных страниц на диске.
+
+    Тела страниц хранятся по SHA-256 содержимого (bodies/ab/abcd....html),
+    так что одинаковые страницы лежат в одном экземпляре. Для каждого URL
+    в pages/ записан JSON: хэш тела, ETag и Last-Modified для условного
+    запроса и уже извлеченные текст и ссылки, чтобы не разбирать HTML
+    заново, пока страница не изменилась.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _page_path(self, url: str) -> str:
+        key = _sha256(url.encode('utf-8'))
+        return os.path.join(self.directory, "pages", key[:2], f"{key}.json")
+
+    def _body_path(self, body_hash: str) -> str:
+        return os.path.join(self.directory, "bodies", body_hash[:2], f"{body_hash}.html")
+
+    def get(self, url: str):
+        """Запись о странице или None, если ее нет в кэше или файл поврежден."""
+        try:
+            with open(self._page_path(url), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Поврежденная запись кэша для {url}: {e}")
+            return None
+
+    @staticmethod
+    def validators(record: dict) -> dict:
+        """Заголовки условного запроса: сервер ответит 304, если страница не менялась."""
+        headers = {}
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    def body_hash(self, html: str) -> str:
+        return _sha256(html.encode('utf-8'))
+
+    def put(self, url: str, html: str, headers, text, links: list) -> dict:
+        body_hash = self.body_hash(html)
+        body_path = self._body_path(body_hash)
+        if not os.path.exists(body_path):
+            write_atomic(body_path, html.encode('utf-8'))
+        record = {
+            "url": url,
+            "body": body_hash,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "text": text,
+            "links": links,
+        }
+        write_atomic(self._page_path(url), json.dumps(record, ensure_ascii=False).encode('utf-8'))
+        return record
@@ -1,9 +1,22 @@
-import requests
-from bs4 import BeautifulSoup, NavigableString, Tag
-import time
+# Сбор правил с free-dnd.ttrpg.ru в текстовый файл.
+# Загрузка идет параллельно через crawler.py, с паузой между запросами к сайту.
+# Страницы кэшируются в CACHE_DIR: повторный запуск спрашивает сайт только об изменениях,
+# а --offline собирает файл из кэша вообще без сети. Тексты страниц пишутся в RECORDS_FILE
+# по ходу обхода; прерванный обход (Ctrl-C, сбой) следующий запуск продолжает с места остановки.
+# Запуск:
+#   python AI-part/scrape_free_dnd.py
+#   python AI-part/scrape_free_dnd.py --offline
+#   python AI-part/scrape_free_dnd.py --start-url http://127.0.0.1:8080/ --output-dir /tmp/out   # локальные страницы
+import argparse
+import asyncio
 import os
 from urllib.parse import urljoin, urlparse
 
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+from crawler import Crawler, assemble
+from page_cache import PageCache
+
 # --- Настройки ---
 # Начальные точки входа для разделов. Ссылки взяты с главной страницы сайта.
 START_URLS = [
@@ -12,16 +25,15 @@ START_URLS = [
     "https://free-dnd.ttrpg.ru/rules-glossary" # Глоссарий
 ]
 
-BASE_URL = "https://free-dnd.ttrpg.ru"
 OUTPUT_FILE = "free_dnd_rules.txt"
+RECORDS_FILE = "free_dnd_pages.jsonl" # Тексты страниц по одной строке JSON, пишутся по ходу обхода
 OUTPUT_DIR = "tg_bot/AI-part" # Папка для сохранения файла
+CACHE_DIR = "tg_bot/AI-part/page_cache/free_dnd" # Кэш страниц для повторных запусков
 # Префиксы URL для исключения из парсинга
 EXCLUDE_PREFIXES = ["/monsters", "/creatures", "/creature-stat-blocks", "/equipment", "/spells", "/downloads"]
-
-# --- Хранилища ---
-visited_urls = set()
-urls_to_visit = list(START_URLS) # Начинаем с заданных разделов
-all_text_content = [] # Список для хранения текстовых фрагментов
+CONCURRENCY = 8 # Сколько страниц загружается одновременно
+PER_HOST = 4 # Не больше одновременных запросов к сайту
+DELAY = 0.5 # Секунд между запросами к сайту; 0.5 секунды должно быть достаточно для статического сайта
 
 # --- Функции ---
 def is_excluded(path):
@@ -35,145 +47,118 @@ def is_heading_tag(tag_name):
     """Проверяет, является ли имя тега заголовком."""
     return tag_name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
 
-# --- Основная логика ---
-print(f"Начинаем парсинг с URL: {', '.join(START_URLS)}")
-print(f"Исключаем URL, начинающиеся с: {', '.join(EXCLUDE_PREFIXES)}")
-
-while urls_to_visit:
-    current_url = urls_to_visit.pop(0)
-
-    parsed_uri = urlparse(current_url)
-    # Проверяем, относится ли URL к нашему сайту
-    if not parsed_uri.netloc == urlparse(BASE_URL).netloc:
-         print(f"Пропуск URL с другого домена: {current_url}")
-         continue
-
-    # Убираем якорь для проверки посещенных и добавления в очередь
-    url_without_fragment = parsed_uri._replace(fragment='').geturl()
-
-    if url_without_fragment in visited_urls:
-        continue # Пропускаем, если уже посещали (без якоря)
-
-    # Проверяем, не относится ли URL к исключенному разделу
-    if is_excluded(parsed_uri.path):
-         print(f"Пропуск URL из исключенного раздела: {current_url}")
-         visited_urls.add(url_without_fragment)
-         continue
-
-    print(f"Обрабатывается: {current_url}")
-    visited_urls.add(url_without_fragment)
-
+def extract(url, html):
+    """Текст статьи с умными переносами и ссылки из нее: (текст или None, ссылки)."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # *** Селектор для основного контента на free-dnd.ttrpg.ru ***
+    content_area = soup.find('div', class_='p-article-content') # Основной контейнер текста статьи по скриншоту
+
+    if not content_area:
+        # Запасной вариант, если это не страница статьи, а, например, страница раздела
+        content_area = soup.find('main') or soup.find('article')
+    if not content_area:
+        return None, []
+
+    # Собираем фрагменты вместе с типом тега
+    page_fragments_with_tags = []
+    for child in content_area.children:
+        tag_name = None
+        current_text = None
+        if isinstance(child, NavigableString):
+            text = child.strip()
+            if text:
+                tag_name = 'text' # Используем 'text' для простого текста
+                current_text = text
+        elif isinstance(child, Tag):
+            # Исключаем инлайновые и другие не блочные элементы на этом уровне
+            if child.name not in ['a', 'span', 'b', 'i', 'strong', 'em', 'script', 'style', 'br', 'hr']:
+                text = child.get_text(separator=' ', strip=True)
+                text = ' '.join(text.split())
+                if text:
+                    tag_name = child.name
+                    current_text = text
+
+        if tag_name and current_text:
+            page_fragments_with_tags.append((tag_name, current_text))
+
+    # Собираем итоговый текст для страницы с умными переносами
+    page_text_builder = []
+    previous_tag_name = None
+    for i, (tag_name, text_fragment) in enumerate(page_fragments_with_tags):
+        separator = ""
+        if i > 0: # Не добавляем перенос перед первым фрагментом
+            if is_heading_tag(previous_tag_name) and not is_heading_tag(tag_name):
+                separator = "\n" # Одинарный перенос после заголовка перед НЕ заголовком
+            else:
+                separator = "\n\n" # Двойной перенос в остальных случаях
+
+        page_text_builder.append(separator)
+        page_text_builder.append(text_fragment)
+        previous_tag_name = tag_name # Обновляем предыдущий тег
+
+    # Ищем новые ссылки на страницы внутри найденного контента, а не в собранных фрагментах.
+    # Ссылки на другие сайты и исключенные разделы отсеивает allow
+    links = [urljoin(url, link['href']) for link in content_area.find_all('a', href=True)]
+    return "".join(page_text_builder) or None, links
+
+def make_allow(start_urls):
+    """Разрешает только страницы сайта из start_urls вне исключенных разделов."""
+    hosts = {urlparse(url).netloc for url in start_urls}
+
+    def allow(url):
+        parsed_uri = urlparse(url)
+        return parsed_uri.netloc in hosts and not is_excluded(parsed_uri.path)
+    return allow
+
+def save(records_path, output_dir):
+    output_path = os.path.join(output_dir, OUTPUT_FILE)
     try:
-        response = requests.get(current_url, timeout=15) # Увеличим таймаут на всякий случай
-        response.raise_for_status()
-        response.encoding = 'utf-8' # Сайт использует UTF-8
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # *** Селектор для основного контента на free-dnd.ttrpg.ru ***
-        content_area = soup.find('div', class_='p-article-content') # Основной контейнер текста статьи по скриншоту
-
-        if not content_area:
-             # Запасной вариант, если это не страница статьи, а, например, страница раздела
-             content_area = soup.find('main') or soup.find('article')
-
-        if content_area:
-            # Собираем фрагменты вместе с типом тега
-            page_fragments_with_tags = []
-            for child in content_area.children:
-                tag_name = None
-                current_text = None
-                if isinstance(child, NavigableString):
-                    text = child.strip()
-                    if text:
-                        tag_name = 'text' # Используем 'text' для простого текста
-                        current_text = text
-                elif isinstance(child, Tag):
-                    # Исключаем инлайновые и другие не блочные элементы на этом уровне
-                    if child.name not in ['a', 'span', 'b', 'i', 'strong', 'em', 'script', 'style', 'br', 'hr']:
-                         text = child.get_text(separator=' ', strip=True)
-                         text = ' '.join(text.split())
-                         if text:
-                             tag_name = child.name
-                             current_text = text
-
-                if tag_name and current_text:
-                    page_fragments_with_tags.append((tag_name, current_text))
-
-            # Собираем итоговый текст для страницы с умными переносами
-            if page_fragments_with_tags:
-                page_text_builder = []
-                previous_tag_name = None
-                for i, (tag_name, text_fragment) in enumerate(page_fragments_with_tags):
-                    separator = ""
-                    if i > 0: # Не добавляем перенос перед первым фрагментом
-                        if is_heading_tag(previous_tag_name) and not is_heading_tag(tag_name):
-                            separator = "\n" # Одинарный перенос после заголовка перед НЕ заголовком
-                        else:
-                            separator = "\n\n" # Двойной перенос в остальных случаях
-
-                    page_text_builder.append(separator)
-                    page_text_builder.append(text_fragment)
-                    previous_tag_name = tag_name # Обновляем предыдущий тег
-
-                final_page_text = "".join(page_text_builder)
-                all_text_content.append(final_page_text)
-                print(f"  -> Добавлено ~{len(final_page_text)} символов (с умными переносами).")
-
-            # Ищем новые ссылки на страницы ЭТОГО ЖЕ сайта внутри найденного контента
-            # Важно: Искать ссылки нужно в исходном content_area, а не в собранных фрагментах
-            internal_links = content_area.find_all('a', href=True) if content_area else []
-
-            for link in internal_links:
-                href = link.get('href')
-                # Преобразуем в абсолютный URL относительно текущей страницы
-                absolute_url = urljoin(current_url, href)
-                parsed_new_uri = urlparse(absolute_url)
-
-                # Проверяем, что ссылка ведет на тот же сайт
-                if parsed_new_uri.netloc == parsed_uri.netloc:
-                    # Убираем якорь
-                    url_clean = parsed_new_uri._replace(fragment='').geturl()
-
-                    # Проверяем, что не посещали, не в очереди и не исключена
-                    if url_clean not in visited_urls and \
-                       url_clean not in urls_to_visit and \
-                       not is_excluded(parsed_new_uri.path):
-
-                        urls_to_visit.append(url_clean)
-                        # print(f"    Найдена новая ссылка: {url_clean}")
-        else:
-            print(f"  -> Не найден целевой контент (`div.p-article-content` или `main`/`article`) на странице: {current_url}")
-
-        # Пауза, чтобы не перегружать сайт
-        time.sleep(0.5) # 0.5 секунды должно быть достаточно для статического сайта
-
-    except requests.exceptions.Timeout:
-        print(f"Таймаут при запросе {current_url}")
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при запросе {current_url}: {e}")
-    except Exception as e:
-        print(f"Неожиданная ошибка при обработке {current_url}: {e}")
-
-# --- Сохранение результата ---
-print(f"\nПарсинг завершен. Посещено {len(visited_urls)} уникальных URL (без якорей).")
-print(f"Собрано {len(all_text_content)} текстовых блоков со страниц.")
-
-if all_text_content:
-    # Объединяем тексты со страниц с двойным переносом строки
-    # Логика переносов внутри страницы уже обработана
-    full_text = "\n\n".join(all_text_content)
-    output_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
-
-    # Создаем директорию, если она не существует
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-    try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(full_text)
+        # Объединяем тексты со страниц с двойным переносом строки
+        # Логика переносов внутри страницы уже обработана
+        if not assemble(records_path, output_path):
+            print("Не удалось собрать текст. Проверьте начальные URL и селектор контента.")
+            return
         print(f"Текст успешно сохранен в файл: {output_path}")
         print(f"Размер файла: {os.path.getsize(output_path) / 1024:.2f} KB")
     except IOError as e:
         print(f"Ошибка при сохранении файла {output_path}: {e}")
-else:
-    print("Не удалось собрать текст. Проверьте начальные URL и селектор контента.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Сбор правил с free-dnd.ttrpg.ru")
+    parser.add_argument("--start-url", nargs="+", default=START_URLS, help="Начальные URL")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--delay", type=float, default=DELAY, help="Секунд между запросами к одному сайту")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true", help="Загрузить все страницы заново, без кэша")
+    parser.add_argument("--offline", action="store_true",
+                        help="Собрать файл из кэша без обращения к сайту")
+    parser.add_argument("--restart", action="store_true", help="Начать обход заново, а не продолжать прерванный")
+    args = parser.parse_args()
+    if args.offline and args.no_cache:
+        parser.error("--offline работает только с кэшем")
+    cache = None if args.no_cache else PageCache(args.cache_dir)
+
+    print(f"Начинаем парсинг с URL: {', '.join(args.start_url)}")
+    print(f"Исключаем URL, начинающиеся с: {', '.join(EXCLUDE_PREFIXES)}")
+    # Создаем директорию, если она не существует
+    os.makedirs(args.output_dir, exist_ok=True)
+    records_path = os.path.join(args.output_dir, RECORDS_FILE)
+    crawler = Crawler(args.start_url, extract, make_allow(args.start_url), records_path,
+                      concurrency=args.concurrency, per_host=PER_HOST, delay=args.delay, timeout=15,
+                      cache=cache, offline=args.offline)
+    try:
+        pages = asyncio.run(crawler.run(restart=args.restart))
+    except KeyboardInterrupt:
+        return
+
+    print(f"\nПарсинг завершен. Посещено {len(crawler.seen)} уникальных URL (без якорей).")
+    stats = crawler.stats
+    print(f"Загружено заново {stats['downloaded']}, не изменилось {stats['not_modified'] + stats['unchanged']}, "
+          f"из кэша без сети {stats['from_cache']}, ошибок {crawler.errors}.")
+    print(f"Собрано {pages} текстовых блоков со страниц.")
+    save(records_path, args.output_dir)
+
+if __name__ == "__main__":
+    main()
@@ -1,107 +1,105 @@
-import requests
-from bs4 import BeautifulSoup
-import time
+# Сбор SRD с longstoryshort.app в текстовый файл.
+# Загрузка идет параллельно через crawler.py, с паузой между запросами к сайту.
+# Страницы кэшируются в CACHE_DIR: повторный запуск спрашивает сайт только об изменениях,
+# а --offline собирает файл из кэша вообще без сети. Тексты страниц пишутся в RECORDS_FILE
+# по ходу обхода; прерванный обход (Ctrl-C, сбой) следующий запуск продолжает с места остановки.
+# Запуск:
+#   python AI-part/scrape_srd.py
+#   python AI-part/scrape_srd.py --offline
+#   python AI-part/scrape_srd.py --start-url http://127.0.0.1:8080/srd/races/traits/ --output-dir /tmp/out
+import argparse
+import asyncio
 import os
 from urllib.parse import urljoin, urlparse
 
+from bs4 import BeautifulSoup
+
+from crawler import Crawler, assemble
+from page_cache import PageCache
+
 # --- Настройки ---
 START_URL = "https://longstoryshort.app/srd/races/traits/" # Начальный URL (можно поменять на главный /srd/ если есть)
-BASE_URL = "https://longstoryshort.app"
 OUTPUT_FILE = "russian_srd123.txt" # Файл для сохранения текста
+RECORDS_FILE = "russian_srd_pages.jsonl" # Тексты страниц по одной строке JSON, пишутся по ходу обхода
 OUTPUT_DIR = "tg_bot/AI-part" # Папка для сохранения файла
-
-# --- Хранилища ---
-visited_urls = set()
-urls_to_visit = [START_URL]
-all_text_content = [] # Список для хранения текстовых фрагментов
-
-# --- Основная логика --- 
-print(f"Начинаем парсинг с: {START_URL}")
-
-while urls_to_visit:
-    current_url = urls_to_visit.pop(0) # Берем первый URL из очереди
-
-    if current_url in visited_urls:
-        continue # Пропускаем, если уже посещали
-
-    # Проверяем, относится ли URL к разделу /srd/
-    parsed_uri = urlparse(current_url)
-    if not parsed_uri.path.startswith('/srd/'):
-         print(f"Пропуск URL не из SRD: {current_url}")
-         visited_urls.add(current_url)
-         continue
-
-    print(f"Обрабатывается: {current_url}")
-    visited_urls.add(current_url)
-
+CACHE_DIR = "tg_bot/AI-part/page_cache/srd" # Кэш страниц для повторных запусков
+CONCURRENCY = 4 # Сколько страниц загружается одновременно
+PER_HOST = 2 # Не больше одновременных запросов к сайту
+DELAY = 1 # Секунд между запросами к сайту, чтобы не нагружать его
+
+# --- Функции ---
+def extract(url, html):
+    """Текст раздела SRD и ссылки на другие разделы: (текст или None, ссылки)."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # *** Ключевой момент: Найти правильный контейнер для основного контента ***
+    # Пример для longstoryshort.app (НАДО ПРОВЕРИТЬ через инструменты разработчика F12):
+    content_area = soup.find('section', class_='compendium-main') # Новый вариант на основе скриншота
+    if not content_area:
+        return None, []
+
+    # Извлекаем текст, очищая от лишних пробелов
+    text = content_area.get_text(separator='\n', strip=True)
+
+    # Ищем новые ссылки на страницы SRD в навигации слева и в основном контенте
+    nav_links = soup.select('nav a[href^="/srd/"]') # Ищем ссылки в <nav>, начинающиеся с /srd/
+    content_links = content_area.select('a[href^="/srd/"]')
+    # Относительные URL преобразуем в абсолютные, якоря убирает crawler
+    links = [urljoin(url, link['href']) for link in nav_links + content_links if link.get('href')]
+    return text, links
+
+def make_allow(start_url):
+    """Разрешает только раздел /srd/ того же сайта."""
+    host = urlparse(start_url).netloc
+
+    def allow(url):
+        parsed_uri = urlparse(url)
+        return parsed_uri.netloc == host and parsed_uri.path.startswith('/srd/')
+    return allow
+
+def main():
+    parser = argparse.ArgumentParser(description="Сбор SRD с longstoryshort.app")
+    parser.add_argument("--start-url", default=START_URL)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--delay", type=float, default=DELAY, help="Секунд между запросами к одному сайту")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true", help="Загрузить все страницы заново, без кэша")
+    parser.add_argument("--offline", action="store_true",
+                        help="Собрать файл из кэша без обращения к сайту")
+    parser.add_argument("--restart", action="store_true", help="Начать обход заново, а не продолжать прерванный")
+    args = parser.parse_args()
+    if args.offline and args.no_cache:
+        parser.error("--offline работает только с кэшем")
+    cache = None if args.no_cache else PageCache(args.cache_dir)
+
+    print(f"Начинаем парсинг с: {args.start_url}")
+    # Создаем директорию, если она не существует
+    os.makedirs(args.output_dir, exist_ok=True)
+    records_path = os.path.join(args.output_dir, RECORDS_FILE)
+    crawler = Crawler([args.start_url], extract, make_allow(args.start_url), records_path,
+                      concurrency=args.concurrency, per_host=PER_HOST, delay=args.delay, timeout=10,
+                      cache=cache, offline=args.offline)
     try:
-        response = requests.get(current_url, timeout=10) # Загружаем страницу
-        response.raise_for_status() # Проверяем на ошибки HTTP (4xx, 5xx)
-        response.encoding = 'utf-8' # Устанавливаем кодировку
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # *** Ключевой момент: Найти правильный контейнер для основного контента ***
-        # Нужно будет проверить HTML сайта и адаптировать селектор.
-        # Возможные варианты (нужно проверить через инструменты разработчика F12):
-        # content_area = soup.find('main') # Если есть тег <main>
-        # content_area = soup.find('div', id='content') # Если есть <div id="content">
-        # content_area = soup.find('div', class_='main-content') # Если есть <div class="main-content">
-        # Пример для longstoryshort.app (НАДО ПРОВЕРИТЬ!):
-        content_area = soup.find('section', class_='compendium-main') # Новый вариант на основе скриншота
+        asyncio.run(crawler.run(restart=args.restart))
+    except KeyboardInterrupt:
+        return
 
-        if content_area:
-            # Извлекаем текст, очищая от лишних пробелов
-            text = content_area.get_text(separator='\n', strip=True)
-            all_text_content.append(text)
-            print(f"  -> Добавлено {len(text)} символов.")
-
-            # Ищем новые ссылки на страницы SRD внутри этой страницы
-            # Ищем ссылки внутри навигации или основного контента
-            # На longstoryshort навигация слева, попробуем найти ссылки там
-            nav_links = soup.select('nav a[href^="/srd/"]') # Ищем ссылки в <nav>, начинающиеся с /srd/
-            content_links = content_area.select('a[href^="/srd/"]') # Ищем ссылки в <article>
-
-            for link in nav_links + content_links:
-                href = link.get('href')
-                if href:
-                    # Преобразуем относительные URL в абсолютные
-                    absolute_url = urljoin(BASE_URL, href)
-                    # Убираем якоря (#...)
-                    absolute_url = urlparse(absolute_url)._replace(fragment='').geturl()
-
-                    if absolute_url not in visited_urls and absolute_url not in urls_to_visit:
-                        # Добавляем только URL из раздела /srd/
-                        if urlparse(absolute_url).path.startswith('/srd/'):
-                             urls_to_visit.append(absolute_url)
-                             # print(f"    Найдена новая ссылка: {absolute_url}")
-
-        else:
-            print("  -> Не найден основной контент на странице.")
-
-        # Пауза, чтобы не нагружать сайт
-        time.sleep(1) # Ждем 1 секунду перед следующим запросом
-
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при запросе {current_url}: {e}")
-    except Exception as e:
-        print(f"Неожиданная ошибка при обработке {current_url}: {e}")
-
-# --- Сохранение результата ---
-print(f"\nПарсинг завершен. Посещено {len(visited_urls)} страниц.")
-
-if all_text_content:
-    full_text = "\n\n".join(all_text_content) # Объединяем тексты с двойным переносом строки
-    output_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
-
-    # Создаем директорию, если она не существует
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    # --- Сохранение результата ---
+    print(f"\nПарсинг завершен. Посещено {len(crawler.seen)} страниц.")
+    stats = crawler.stats
+    print(f"Загружено заново {stats['downloaded']}, не изменилось {stats['not_modified'] + stats['unchanged']}, "
+          f"из кэша без сети {stats['from_cache']}, ошибок {crawler.errors}.")
 
+    output_path = os.path.join(args.output_dir, OUTPUT_FILE)
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(full_text)
-        print(f"Текст успешно сохранен в файл: {output_path}")
+        # Объединяем тексты с двойным переносом строки
+        if assemble(records_path, output_path):
+            print(f"Текст успешно сохранен в файл: {output_path}")
+        else:
+            print("Не удалось собрать текст.")
     except IOError as e:
         print(f"Ошибка при сохранении файла {output_path}: {e}")
-else:
-    print("Не удалось собрать текст.") 
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import logging
+import random
+
+import metrics
+from config import (BATCH_WINDOW, DEFAULT_ADAPTER, HISTORY_IDLE_TTL, HISTORY_MAX_CHATS, HISTORY_TOKEN_BUDGET,
+                    INFERENCE_QUEUE_SIZE, INFERENCE_TIMEOUT, LORA_ADAPTERS, MAX_BATCH_SIZE, PROMPT_LOG_SAMPLE_RATE,
+                    SESSION_BACKEND, SESSION_DB_PATH, SESSION_FLUSH_INTERVAL)
+from conversation import ConversationStore
+from inference import GenerationRequest, InferenceWorker
+from model_loader import ModelLoader, READY
+from sessions import create_session_backend
+
+# Режим /mode, в котором бот отвечает базовой моделью без LoRA адаптеров
+BASE_MODE = "base"
+
+
+class ModelNotReady(Exception):
+    """Модель еще загружается или не загрузилась (state - состояние ModelLoader)."""
+
+    def __init__(self, state: str):
+        super().__init__(f"Модель не готова: {state}")
+        self.state = state
+
+
+class LocalBackend:
+    """Модель, история диалогов и очередь генерации в текущем процессе.
+
+    Все методы асинхронные, чтобы обработчики бота одинаково работали и с
+    этим классом, и с inference_client.RemoteBackend - тем же самым
+    LocalBackend, но в отдельном процессе inference_server.py.
+    """
+
+    def __init__(self):
+        # Модель грузится в фоне; модуль llm (torch/transformers) импортируется только там
+        self.model_loader = ModelLoader()
+        # История диалогов по чатам, ограниченная по токенам; неактивные чаты вытесняются
+        # и при перезапуске подгружаются из постоянного хранилища при первом обращении
+        self.conversation_store = ConversationStore(
+            self._tokenize_message, token_budget=HISTORY_TOKEN_BUDGET, max_chats=HISTORY_MAX_CHATS,
+            idle_ttl=HISTORY_IDLE_TTL,
+            backend=create_session_backend(SESSION_BACKEND, SESSION_DB_PATH, SESSION_FLUSH_INTERVAL,
+                                           retention=HISTORY_IDLE_TTL))
+        # Генерация выполняется батчами в отдельном потоке, чтобы не блокировать event loop
+        self.inference_worker = InferenceWorker(self._generate_batch, max_queue_size=INFERENCE_QUEUE_SIZE,
+                                                timeout=INFERENCE_TIMEOUT, max_batch_size=MAX_BATCH_SIZE,
+                                                batch_window=BATCH_WINDOW)
+
+    def _tokenize_message(self, role: str, content: str) -> list:
+        with metrics.span(metrics.tokenize_seconds):
+            return self.model_loader.llm.tokenize_message(role, content)
+
+    def _generate_batch(self, requests: list) -> list:
+        return self.model_loader.llm.generate_batch(requests)
+
+    def _llm(self):
+        if self.model_loader.state != READY:
+            raise ModelNotReady(self.model_loader.state)
+        return self.model_loader.llm
+
+    async def start(self):
+        """Запускает загрузку модели и планировщик. Вызывать из работающего event loop."""
+        self.model_loader.start()
+        self.inference_worker.start()
+
+    async def close(self):
+        self.inference_worker.shutdown()
+        # Дописываем на диск историю, еще не сброшенную фоновым потоком
+        self.conversation_store.close()
+
+    async def status(self) -> dict:
+        return {"model": self.model_loader.state, "pending": self.inference_worker.pending}
+
+    async def modes(self) -> list:
+        return [BASE_MODE, *LORA_ADAPTERS]
+
+    async def get_mode(self, chat_id) -> str:
+        # История чата (а с ней и режим) подгружается с токенизацией, нужна модель
+        self._llm()
+        return self.conversation_store.get_mode(chat_id) or DEFAULT_ADAPTER or BASE_MODE
+
+    async def set_mode(self, chat_id, mode: str):
+        if mode not in await self.modes():
+            raise ValueError(f"Неизвестный режим: {mode}")
+        self._llm()
+        self.conversation_store.set_mode(chat_id, mode)
+
+    async def chat_adapter(self, chat_id):
+        """LoRA адаптер для ответа в чате: выбранный через /mode или DEFAULT_ADAPTER; None - базовая модель."""
+        mode = await self.get_mode(chat_id)
+        if mode == BASE_MODE:
+            return None
+        if mode not in self._llm().adapters:
+            logging.warning(f"LoRA адаптер '{mode}' для чата {chat_id} не подключен, отвечаем базовой моделью.")
+            return None
+        return mode
+
+    async def append(self, chat_id, role: str, content: str):
+        """Добавляет сообщение в историю чата (она сама обрезается по бюджету токенов)."""
+        self._llm()
+        self.conversation_store.append(chat_id, role, content)
+
+    async def generate(self, chat_id, rules: list = None, standalone: bool = False, on_text=None) -> str:
+        """Генерирует ответ на последнее сообщение чата и добавляет его в историю.
+
+        rules - выдержки из правил для промпта. Для standalone (общего
+        вопроса о правилах) промпт состоит только из последнего сообщения,
+        KV-кэш чата не используется, и запрос не вытесняется следующими
+        сообщениями чата. Исключения InferenceWorker.submit пробрасываются.
+        """
+        llm = self._llm()
+        adapter = await self.chat_adapter(chat_id)
+        # --- Формирование промпта (формат Saiga) ---
+        # Промпт собирается из уже токенизированных сообщений истории
+        with metrics.span(metrics.prompt_build_seconds):
+            history = self.conversation_store.history(chat_id)
+            prompt, prompt_ids = llm.build_prompt(history[-1:] if standalone else history, rules=rules)
+        # Полный промпт большой, поэтому в лог попадает только при отладке или в выборке
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"--- Полный промпт ---\n{prompt}\n--------------------")
+        elif PROMPT_LOG_SAMPLE_RATE and random.random() < PROMPT_LOG_SAMPLE_RATE:
+            logging.info(f"--- Полный промпт (выборка) ---\n{prompt}\n--------------------")
+
+        # Промпт общего вопроса не продолжает диалог, поэтому KV-кэш чата для него не используется
+        request = GenerationRequest(prompt, token_ids=prompt_ids, chat_id=None if standalone else chat_id,
+                                    on_text=on_text, adapter=adapter)
+        # Новое сообщение чата снимет этот запрос с очереди, если генерация еще не началась
+        response = await self.inference_worker.submit(request, key=None if standalone else chat_id)
+        if response:
+            self.conversation_store.append(chat_id, "bot", response)
+        return response
+
+    async def reload_adapters(self, names: list = None) -> list:
+        llm = self._llm()
+        # Веса меняются в потоке генерации между батчами, чтобы не задеть идущую генерацию
+        return await self.inference_worker.run_exclusive(llm.reload_adapters, names)
@@ -0,0 +1,110 @@
+# Скорость генерации на CPU: float32 против динамической int8 квантизации при разном числе потоков.
+# Модель нужна без квантизации bitsandbytes, например артефакт из build_artifact.py --no-quantize.
+# Запуск из корня проекта (нужен config.json):
+#   python benchmarks/cpu_backend.py --model artifacts/saiga_dnd_cpu --threads 4 8 --batch-sizes 1 4
+#   python benchmarks/cpu_backend.py --model path/to/tiny
+import argparse
+import gc
+import io
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+import llm
+import metrics
+from conversation import Turn
+from inference import GenerationRequest
+
+QUESTIONS = [
+    "Опиши таверну, в которую мы только что вошли.",
+    "Я открываю тяжелую дверь в подземелье. Что я вижу?",
+    "Расскажи легенду о драконе, живущем в горах.",
+    "Как работает преимущество?",
+]
+
+
+def model_size_mb(model) -> float:
+    """Размер весов в памяти; квантизованные слои хранят веса вне parameters(), поэтому через state_dict."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def load(model_path: str, quantization: str):
+    llm.model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32,
+                                                     low_cpu_mem_usage=True).eval()
+    if quantization == "int8":
+        llm.model = llm.quantize_for_cpu(llm.model)
+    llm.prepare_generation()
+
+
+def make_requests(batch_size: int) -> list:
+    requests = []
+    for n in range(batch_size):
+        question = QUESTIONS[n % len(QUESTIONS)]
+        turns = [Turn("user", question, llm.tokenize_message("user", question))]
+        prompt, prompt_ids = llm.build_prompt(turns)
+        requests.append(GenerationRequest(prompt, token_ids=prompt_ids))
+    return requests
+
+
+def measure(batch_size: int, repeats: int) -> tuple:
+    """Возвращает (токенов в секунду, секунд на батч)."""
+    requests = make_requests(batch_size)
+    tokens_before = metrics.generated_tokens.value
+    started_at = time.perf_counter()
+    for _ in range(repeats):
+        llm.generate_batch(requests)
+    elapsed = time.perf_counter() - started_at
+    return (metrics.generated_tokens.value - tokens_before) / elapsed, elapsed / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация на CPU: float32 против int8")
+    parser.add_argument("--model", required=True, help="Папка модели без квантизации bitsandbytes")
+    parser.add_argument("--threads", type=int, nargs="+", default=[0],
+                        help="Числа потоков для сравнения; 0 - по числу доступных ядер")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+    # torch.ao.quantization предупреждает об устаревании при каждом вызове
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    warnings.filterwarnings("ignore", category=UserWarning, module=r"torch\.ao")
+
+    llm.tokenizer = AutoTokenizer.from_pretrained(args.model)
+    llm.tokenizer.pad_token = llm.tokenizer.eos_token
+    llm.tokenizer.padding_side = "left"
+    results = {}
+    for quantization in ("float32", "int8"):
+        load(args.model, quantization)
+        # Ответы одинаковой длины, чтобы сравнивать только скорость
+        llm.generation_profile.sampling = {"do_sample": False, "min_new_tokens": args.max_new_tokens}
+        llm.generation_profile.max_new_tokens = args.max_new_tokens
+        print(f"{quantization}: веса {model_size_mb(llm.model):.1f} МБ")
+        for threads in args.threads:
+            threads = llm.configure_cpu_threads(threads or None)
+            measure(1, 1)  # прогрев
+            for batch_size in args.batch_sizes:
+                tokens_per_second, batch_seconds = measure(batch_size, args.repeats)
+                results[quantization, threads, batch_size] = tokens_per_second
+                print(f"  потоков {threads}, батч {batch_size}: {tokens_per_second:.1f} токенов/с, "
+                      f"{batch_seconds:.2f} с на батч")
+        llm.model = None
+        gc.collect()
+
+    print("Ускорение int8 относительно float32:")
+    for (quantization, threads, batch_size), tokens_per_second in results.items():
+        if quantization == "int8":
+            print(f"  потоков {threads}, батч {batch_size}: "
+                  f"x{tokens_per_second / results['float32', threads, batch_size]:.2f}")
+
+
+if __name__ == "__main__":
+    main()
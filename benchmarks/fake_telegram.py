@@ -0,0 +1,125 @@
+# Локальная проверка режима вебхука без настоящего Telegram.
+# Скрипт поднимает поддельный Bot API (бот ходит в него через TELEGRAM_API_URL)
+# и отправляет в вебхук бота обновления с сообщениями игроков, как это делает Telegram.
+# Пример: в config.json бота
+#   "BOT_MODE": "webhook", "WEBHOOK_SECRET": "test", "TELEGRAM_API_URL": "http://127.0.0.1:8081"
+# затем в соседнем терминале:
+#   python benchmarks/fake_telegram.py --webhook http://127.0.0.1:8080/webhook --secret test --chats 20
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+
+from aiohttp import ClientSession, web
+
+# Сообщения игроков; их, make_update и percentile использует и load_test.py
+MESSAGES = [
+    "Я захожу в таверну и осматриваюсь.",
+    "Как работает преимущество?",
+    "Хочу поговорить с трактирщиком о слухах.",
+    "Атакую гоблина мечом!",
+    "Что такое спасбросок?",
+    "Ищу ловушки в коридоре.",
+]
+
+
+class FakeBotAPI:
+    """Отвечает на вызовы Bot API так, как ожидает aiogram, и запоминает ответы бота по чатам."""
+
+    def __init__(self):
+        self.calls = {}
+        self.first_reply_at = {}
+        self.last_reply_at = {}
+        self._message_ids = itertools.count(1)
+
+    def message(self, chat_id: int, text: str) -> dict:
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text,
+                "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"}}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        result = True
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            now = time.perf_counter()
+            self.first_reply_at.setdefault(chat_id, now)
+            self.last_reply_at[chat_id] = now
+            result = self.message(chat_id, params.get("text", ""))
+        return web.json_response({"ok": True, "result": result})
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": int(time.time()), "text": text,
+                        "chat": {"id": chat_id, "type": "private"},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": f"Игрок {chat_id}"}}}
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def send_updates(webhook: str, secret: str, chats: int) -> dict:
+    """Отправляет по одному сообщению от каждого чата; возвращает время отправки по чатам."""
+    sent_at, ack_latencies, statuses = {}, [], {}
+    async with ClientSession() as session:
+        async def send(update_id: int, chat_id: int):
+            update = make_update(update_id, chat_id, MESSAGES[update_id % len(MESSAGES)])
+            started_at = time.perf_counter()
+            async with session.post(webhook, json=update,
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as response:
+                await response.read()
+            ack_latencies.append(time.perf_counter() - started_at)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            sent_at[chat_id] = started_at
+
+        await asyncio.gather(*(send(i, 1000 + i) for i in range(chats)))
+    print(f"Ответы вебхука: {statuses}")
+    print(f"Подтверждение обновления: p50 {percentile(ack_latencies, 0.5) * 1000:.1f} мс, "
+          f"p95 {percentile(ack_latencies, 0.95) * 1000:.1f} мс, макс {max(ack_latencies) * 1000:.1f} мс")
+    return sent_at
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Поддельный Telegram для проверки вебхука бота")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook", help="Адрес вебхука бота")
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET бота")
+    parser.add_argument("--api-port", type=int, default=8081, help="Порт поддельного Bot API")
+    parser.add_argument("--chats", type=int, default=10, help="Сколько игроков пишут одновременно")
+    parser.add_argument("--wait", type=float, default=60, help="Сколько секунд ждать ответов бота")
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+    try:
+        sent_at = await send_updates(args.webhook, args.secret, args.chats)
+        deadline = time.perf_counter() + args.wait
+        while len(api.first_reply_at) < len(sent_at) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        # Даем боту дописать потоковые ответы
+        await asyncio.sleep(2)
+    finally:
+        await runner.cleanup()
+
+    replied = [chat_id for chat_id in sent_at if chat_id in api.first_reply_at]
+    print(f"Бот ответил в {len(replied)} из {len(sent_at)} чатов, вызовы Bot API: {api.calls}")
+    if replied:
+        first = [api.first_reply_at[chat_id] - sent_at[chat_id] for chat_id in replied]
+        last = [api.last_reply_at[chat_id] - sent_at[chat_id] for chat_id in replied]
+        print(f"Первое сообщение бота: p50 {statistics.median(first):.2f} с, макс {max(first):.2f} с; "
+              f"последняя правка: p50 {statistics.median(last):.2f} с, макс {max(last):.2f} с")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
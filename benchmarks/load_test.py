@@ -0,0 +1,221 @@
+# Нагрузочный тест обработчика сообщений без сети и без Telegram.
+# Обновления от нескольких игроков подаются прямо в Dispatcher из main.py, бот ходит
+# в поддельную сессию Bot API, а вместо Saiga отвечает заглушка с задержкой на токен
+# или любая небольшая локальная модель. История диалогов хранится только в памяти.
+# Запуск из корня проекта (нужен config.json):
+#   python benchmarks/load_test.py --players 20 --messages 3                 # заглушка, 20 мс на токен
+#   python benchmarks/load_test.py --players 8 --model path/to/tiny_model     # настоящая генерация
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import resource
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Message, Update
+
+import main
+import metrics
+from config import (BOT_TOKEN, HISTORY_IDLE_TTL, HISTORY_MAX_CHATS, HISTORY_TOKEN_BUDGET, KV_CACHE_MAX_MB,
+                    MESSAGE_COALESCE_WINDOW, STREAMING_REPLIES)
+from conversation import ConversationStore
+from fake_telegram import MESSAGES, make_update, percentile
+from model_loader import READY
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot API, которая никуда не ходит: отвечает как Telegram и запоминает время ответов."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = {}
+        # Время первой правки сообщения (первого показанного текста ответа) по чатам
+        self.first_edit_at = {}
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError("Загрузка файлов в нагрузочном тесте не поддерживается")
+
+    async def make_request(self, bot: Bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, EditMessageText):
+            self.first_edit_at.setdefault(method.chat_id, time.perf_counter())
+        if isinstance(method, (SendMessage, EditMessageText)):
+            message_id = method.message_id if isinstance(method, EditMessageText) else next(self._message_ids)
+            return Message.model_validate(
+                {"message_id": message_id, "date": int(time.time()),
+                 "chat": {"id": method.chat_id, "type": "private"}, "text": method.text,
+                 "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"}},
+                context={"bot": bot})
+        # DeleteMessage и остальные служебные вызовы
+        return True
+
+
+class StubLLM:
+    """Заглушка модуля llm: "генерирует" ответ по слову с задержкой на токен.
+
+    Батч генерируется за одно и то же время независимо от размера, как на GPU,
+    поэтому заглушка показывает эффект батчинга и накладные расходы бота.
+    """
+
+    def __init__(self, token_delay: float, prefill_delay: float, response_tokens: int):
+        self.token_delay = token_delay
+        self.prefill_delay = prefill_delay
+        self.response_tokens = response_tokens
+        self.adapters = {}
+
+    def tokenize_message(self, role: str, content: str) -> list:
+        return array("i", range(len(content.split()) + 4))
+
+    def build_prompt(self, turns: list, rules: list = None):
+        ids = []
+        for turn in turns:
+            ids.extend(turn.token_ids)
+        return "\n".join(turn.content for turn in turns), ids
+
+    def generate_batch(self, requests: list) -> list:
+        time.sleep(self.prefill_delay)
+        words = [[] for _ in requests]
+        for step in range(self.response_tokens):
+            time.sleep(self.token_delay)
+            for request, row in zip(requests, words):
+                row.append(f"слово{step}")
+                if request.on_text is not None:
+                    request.on_text(" ".join(row))
+        return [" ".join(row) for row in words]
+
+    def reload_adapters(self, names=None) -> list:
+        return []
+
+
+def load_model(model_path: str):
+    """Загружает небольшую модель без квантизации вместо Saiga (как benchmarks/prefill.py)."""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    import llm
+    from kv_cache import KVCacheStore
+
+    llm.tokenizer = AutoTokenizer.from_pretrained(model_path)
+    llm.tokenizer.pad_token = llm.tokenizer.eos_token
+    llm.tokenizer.padding_side = "left"
+    llm.model = AutoModelForCausalLM.from_pretrained(model_path).eval()
+    if KV_CACHE_MAX_MB:
+        llm.kv_cache = KVCacheStore(max_bytes=KV_CACHE_MAX_MB * 1024 * 1024)
+    llm.prepare_generation()
+    return llm
+
+
+def rss_mb() -> float:
+    """Пиковый размер процесса в памяти (ru_maxrss в Linux - в килобайтах)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_player(bot: Bot, session: FakeSession, chat_id: int, messages: int, think_time: float,
+                     update_ids, latencies: list, ttfts: list):
+    for n in range(messages):
+        text = MESSAGES[(chat_id + n) % len(MESSAGES)]
+        update = Update.model_validate(make_update(next(update_ids), chat_id, text), context={"bot": bot})
+        session.first_edit_at.pop(chat_id, None)
+        started_at = time.perf_counter()
+        await main.dp.feed_update(bot, update)
+        finished_at = time.perf_counter()
+        latencies.append(finished_at - started_at)
+        # Без потоковых ответов первый текст игрок видит только вместе с готовым ответом
+        ttfts.append(session.first_edit_at.get(chat_id, finished_at) - started_at)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def run(args):
+    backend = main.backend
+    if args.model:
+        llm = load_model(args.model)
+    else:
+        llm = StubLLM(args.token_delay, args.prefill_delay, args.response_tokens)
+    # Модель подставляется вместо фоновой загрузки, история - только в памяти
+    backend.conversation_store.close()
+    backend.conversation_store = ConversationStore(backend._tokenize_message, token_budget=HISTORY_TOKEN_BUDGET,
+                                                   max_chats=HISTORY_MAX_CHATS, idle_ttl=HISTORY_IDLE_TTL)
+    backend.model_loader.llm = llm
+    backend.model_loader.state = READY
+    backend.inference_worker.start()
+
+    session = FakeSession(args.api_latency)
+    bot = Bot(token=BOT_TOKEN, session=session)
+    update_ids = itertools.count(1)
+    latencies, ttfts = [], []
+    rss_before = rss_mb()
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_player(bot, session, 10_000 + i, args.messages, args.think_time, update_ids,
+                                          latencies, ttfts)
+                               for i in range(args.players)))
+    finally:
+        backend.inference_worker.shutdown()
+    elapsed = time.perf_counter() - started_at
+
+    print(f"Игроков: {args.players}, сообщений: {len(latencies)}, время теста {elapsed:.1f} с "
+          f"({'модель ' + args.model if args.model else f'заглушка, {args.token_delay * 1000:.0f} мс на токен'}; "
+          f"потоковые ответы {'вкл' if STREAMING_REPLIES else 'выкл'}, склейка {MESSAGE_COALESCE_WINDOW} с)")
+    print(f"Время ответа: p50 {percentile(latencies, 0.5):.2f} с, p95 {percentile(latencies, 0.95):.2f} с, "
+          f"p99 {percentile(latencies, 0.99):.2f} с, макс {max(latencies):.2f} с")
+    print(f"Первый текст ответа: p50 {percentile(ttfts, 0.5):.2f} с, p95 {percentile(ttfts, 0.95):.2f} с, "
+          f"p99 {percentile(ttfts, 0.99):.2f} с")
+    print(f"Пропускная способность: {len(latencies) / elapsed:.2f} сообщений/с")
+    print(f"Батчей: {metrics.batch_size.count}, средний размер {metrics.batch_size.mean:.1f}; "
+          f"ожидание в очереди: среднее {metrics.queue_wait_seconds.mean:.2f} с, "
+          f"макс {metrics.queue_wait_seconds.max:.2f} с")
+    if metrics.generated_tokens.value:
+        print(f"Сгенерировано токенов: {metrics.generated_tokens.value}, "
+              f"скорость последнего батча {metrics.tokens_per_second.value:.0f} токенов/с")
+    print(f"Кэш ответов: {metrics.response_cache_exact_hits.value + metrics.response_cache_similar_hits.value} "
+          f"попаданий, {metrics.response_cache_misses.value} промахов")
+    print(f"Вызовы Bot API: {session.calls}")
+    print(f"Память процесса: пик {rss_mb():.0f} МБ (до теста {rss_before:.0f} МБ)")
+    if args.model:
+        import torch
+        if torch.cuda.is_available():
+            print(f"Пик памяти GPU: {torch.cuda.max_memory_allocated() / 2 ** 20:.0f} МБ")
+    if args.max_p95 is not None and percentile(latencies, 0.95) > args.max_p95:
+        print(f"ОШИБКА: p95 времени ответа выше порога {args.max_p95} с")
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчика сообщений бота")
+    parser.add_argument("--players", type=int, default=10, help="Сколько игроков пишут одновременно")
+    parser.add_argument("--messages", type=int, default=3,
+                        help="Сколько сообщений подряд отправляет каждый игрок (следующее - после ответа); "
+                             "больше RATE_LIMIT_BURST упрется в лимит частоты")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Пауза игрока между ответом и новым сообщением, с")
+    parser.add_argument("--model", default=None, help="Папка небольшой модели вместо заглушки")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Заглушка: секунд на токен (шаг батча)")
+    parser.add_argument("--prefill-delay", type=float, default=0.05, help="Заглушка: секунд на обработку промпта")
+    parser.add_argument("--response-tokens", type=int, default=50, help="Заглушка: длина ответа в токенах")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка каждого вызова Bot API, с")
+    parser.add_argument("--verbose", action="store_true", help="Оставить логи бота на уровне INFO")
+    parser.add_argument("--max-p95", type=float, default=None,
+                        help="Завершиться с кодом 1, если p95 времени ответа выше этого порога (для CI)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
@@ -0,0 +1,91 @@
+# Замер экономии на префилле за счет предпосчитанного системного префикса.
+# Запуск из корня проекта (нужен config.json):
+#   python benchmarks/prefill.py                         # реальная модель через llm.load_llm()
+#   python benchmarks/prefill.py --model path/to/tiny    # любая небольшая модель без квантизации
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+import llm
+
+
+def load(model_path: str):
+    if not model_path:
+        llm.load_llm()
+        return
+    llm.tokenizer = AutoTokenizer.from_pretrained(model_path)
+    llm.tokenizer.pad_token = llm.tokenizer.eos_token
+    llm.tokenizer.padding_side = "left"
+    llm.model = AutoModelForCausalLM.from_pretrained(model_path).eval()
+    llm.prepare_generation()
+
+
+def build_prompt(history_turns: int) -> str:
+    parts = [llm.SYSTEM_PREFIX]
+    for turn in range(history_turns):
+        parts.append(llm.MESSAGE_TEMPLATE.format(role="user", content=f"Я осматриваю комнату номер {turn}."))
+        parts.append(llm.MESSAGE_TEMPLATE.format(role="bot", content="В углу стоит старый сундук, покрытый пылью."))
+    parts.append(llm.MESSAGE_TEMPLATE.format(role="user", content="Открываю сундук."))
+    parts.append(llm.RESPONSE_TEMPLATE)
+    return "".join(parts)
+
+
+def timed(func, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        started_at = time.perf_counter()
+        func()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        samples.append(time.perf_counter() - started_at)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Префилл с предпосчитанным системным префиксом и без него")
+    parser.add_argument("--model", help="Путь к модели вместо llm.load_llm()")
+    parser.add_argument("--history-turns", type=int, nargs="+", default=[0, 2, 5])
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    load(args.model)
+    if not llm.is_loaded():
+        sys.exit("Модель не загружена.")
+    device = llm.model.device
+    prefix_length = len(llm.system_prefix_ids)
+    print(f"Системный префикс: {prefix_length} токенов")
+
+    for history_turns in args.history_turns:
+        prompt = build_prompt(history_turns)
+
+        def full_prefill():
+            ids = llm.tokenizer(prompt, add_special_tokens=False)["input_ids"]
+            with torch.no_grad():
+                llm.model(torch.tensor([ids], device=device), use_cache=True)
+
+        def cached_prefill():
+            ids = llm.tokenize_prompt(prompt)
+            with torch.no_grad():
+                llm.model(torch.tensor([ids[prefix_length:]], device=device),
+                          past_key_values=llm.system_prefix_past[None], use_cache=True)
+
+        full_prefill()  # прогрев
+        full = timed(full_prefill, args.repeats)
+        cached = timed(cached_prefill, args.repeats)
+        total_tokens = len(llm.tokenize_prompt(prompt))
+        print(f"История {history_turns} ходов ({total_tokens} токенов): "
+              f"полный префилл {full * 1000:.1f} мс, с кэшем префикса {cached * 1000:.1f} мс, "
+              f"экономия {(1 - cached / full) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Сравнение обычной генерации и спекулятивного декодирования с моделью-черновиком.
+# Запуск из корня проекта (нужен config.json):
+#   python benchmarks/speculative.py --draft path/to/draft                       # Saiga через llm.load_llm()
+#   python benchmarks/speculative.py --model path/to/tiny --draft path/to/tiny_draft --greedy
+# Черновик должен использовать тот же токенизатор, что и основная модель. С --greedy
+# ответы обоих режимов должны совпадать токен в токен. Скрипт завершается с кодом 1,
+# если черновик был отключен из-за ошибки, не предложил ни одного токена или ответы различаются.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+import llm
+import metrics
+from conversation import Turn
+from inference import GenerationRequest
+
+QUESTIONS = [
+    "Опиши таверну, в которую мы только что вошли.",
+    "Я открываю тяжелую дверь в подземелье. Что я вижу?",
+    "Расскажи легенду о драконе, живущем в горах.",
+    "Как работает преимущество?",
+]
+
+
+def load(model_path: str):
+    if not model_path:
+        llm.load_llm()
+        return
+    llm.tokenizer = AutoTokenizer.from_pretrained(model_path)
+    llm.tokenizer.pad_token = llm.tokenizer.eos_token
+    llm.tokenizer.padding_side = "left"
+    llm.model = AutoModelForCausalLM.from_pretrained(model_path).eval()
+    llm.prepare_generation()
+
+
+def make_request(question: str) -> GenerationRequest:
+    turns = [Turn("user", question, llm.tokenize_message("user", question))]
+    prompt, prompt_ids = llm.build_prompt(turns)
+    return GenerationRequest(prompt, token_ids=prompt_ids)
+
+
+def run(requests: list, repeats: int, seed: int):
+    """Генерирует ответы по одному (как для одного активного чата); возвращает (ответы, время, токены)."""
+    responses, samples = [], []
+    tokens_before = metrics.generated_tokens.value
+    for _ in range(repeats):
+        for n, request in enumerate(requests):
+            torch.manual_seed(seed + n)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            started_at = time.perf_counter()
+            responses.append(llm.generate_batch([request])[0])
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            samples.append(time.perf_counter() - started_at)
+    return responses, samples, metrics.generated_tokens.value - tokens_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обычная генерация против спекулятивного декодирования")
+    parser.add_argument("--model", help="Путь к модели вместо llm.load_llm()")
+    parser.add_argument("--draft", help="Путь к модели-черновику (по умолчанию DRAFT_MODEL из config.json)")
+    parser.add_argument("--draft-tokens", type=int, nargs="+", default=[llm.DRAFT_TOKENS],
+                        help="Сколько токенов черновик предлагает за шаг (можно несколько значений)")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--max-new-tokens", type=int, default=llm.MAX_NEW_TOKENS)
+    parser.add_argument("--greedy", action="store_true", help="Жадная генерация, чтобы сравнить ответы")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    load(args.model)
+    if not llm.is_loaded():
+        sys.exit("Модель не загружена.")
+    draft_path = args.draft or llm.DRAFT_MODEL
+    if not draft_path or (llm.draft_model is None and not llm.load_draft_model(draft_path)):
+        sys.exit("Модель-черновик не загружена.")
+    # Черновик проверяется на каждой генерации, независимо от доли принятых
+    llm.DRAFT_MIN_ACCEPTANCE = 0.0
+    profile = llm.generation_profile
+    profile.max_new_tokens = args.max_new_tokens
+    if args.greedy:
+        profile.sampling = {"do_sample": False}
+    requests = [make_request(question) for question in QUESTIONS]
+    draft = llm.draft_model
+
+    llm.draft_model = None
+    run(requests[:1], 1, args.seed)  # прогрев
+    baseline, baseline_samples, baseline_tokens = run(requests, args.repeats, args.seed)
+    baseline_time = sum(baseline_samples)
+    print(f"Без черновика: {statistics.median(baseline_samples):.2f} с на ответ (медиана), "
+          f"{baseline_tokens / baseline_time:.1f} токенов/с")
+
+    for draft_tokens in args.draft_tokens:
+        draft.generation_config.num_assistant_tokens = draft_tokens
+        llm.draft_model = draft
+        proposed_before = metrics.draft_tokens.value
+        accepted_before = metrics.draft_accepted_tokens.value
+        responses, samples, tokens = run(requests, args.repeats, args.seed)
+        proposed = metrics.draft_tokens.value - proposed_before
+        accepted = metrics.draft_accepted_tokens.value - accepted_before
+        elapsed = sum(samples)
+        line = (f"Черновик, {draft_tokens} токенов за шаг: {statistics.median(samples):.2f} с на ответ, "
+                f"{tokens / elapsed:.1f} токенов/с, принято {accepted} из {proposed} "
+                f"({accepted / proposed if proposed else 0:.0%}), ускорение x{baseline_time / elapsed * tokens / baseline_tokens:.2f}")
+        if args.greedy:
+            line += f", ответы {'совпадают' if responses == baseline else 'РАЗЛИЧАЮТСЯ'}"
+        print(line)
+        # Без этих проверок сравнение ответов проходит и тогда, когда черновик не работал вовсе
+        if llm.draft_model is None:
+            sys.exit("ОШИБКА: генерация с черновиком упала, и он был отключен (подробности в логе).")
+        if not proposed:
+            sys.exit("ОШИБКА: черновик не предложил ни одного токена.")
+        if args.greedy and responses != baseline:
+            sys.exit("ОШИБКА: при жадной генерации ответы с черновиком отличаются от обычных.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Сборка готового чекпоинта для быстрого старта бота:
+# базовая модель + слитый LoRA адаптер D&D + 4-битная квантизация, сохраненные одной папкой.
+# load_llm() загружает этот чекпоинт напрямую, если он есть в MODEL_ARTIFACT_DIR.
+# Запуск из корня проекта:
+#   python build_artifact.py                        # Saiga + адаптер из AI-part -> MODEL_ARTIFACT_DIR
+#   python build_artifact.py --base path/to/tiny --adapter path/to/lora --no-quantize --output /tmp/artifact
+import argparse
+import gc
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import torch
+from peft import PeftModel
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+import llm
+from config import MODEL_ARTIFACT_DIR
+
+
+def content_hash(path: str) -> str:
+    """sha256 по именам и содержимому всех файлов папки (кроме манифеста)."""
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            if name == llm.ARTIFACT_MANIFEST and root == path:
+                continue
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode("utf-8") + b"\0")
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def load_model(source: str, quantize: bool):
+    if quantize:
+        return AutoModelForCausalLM.from_pretrained(source, quantization_config=llm.make_bnb_config(),
+                                                    device_map="auto", torch_dtype=torch.bfloat16,
+                                                    trust_remote_code=True)
+    return AutoModelForCausalLM.from_pretrained(source, torch_dtype="auto", trust_remote_code=True)
+
+
+def merge_adapter(base: str, adapter: str, output: str):
+    """Сливает LoRA адаптер с базовой моделью в полной точности и сохраняет результат."""
+    # Слияние делается до квантизации: 4-битные веса с адаптером слить без потерь нельзя
+    print(f"Слияние адаптера {adapter} с {base}...")
+    model = AutoModelForCausalLM.from_pretrained(base, torch_dtype=torch.bfloat16, low_cpu_mem_usage=True,
+                                                 trust_remote_code=True)
+    model = PeftModel.from_pretrained(model, adapter).merge_and_unload()
+    model.save_pretrained(output, safe_serialization=True)
+    del model
+    gc.collect()
+
+
+def build(base: str, adapter: str, quantize: bool, output: str) -> dict:
+    if adapter and not os.path.isdir(adapter):
+        print(f"Папка с адаптером не найдена: {adapter}. Собираем чекпоинт без адаптера.")
+        adapter = None
+
+    parent = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=parent) as work_dir:
+        source = base
+        if adapter:
+            source = os.path.join(work_dir, "merged")
+            merge_adapter(base, adapter, source)
+
+        print(f"Загрузка {'с квантизацией ' if quantize else ''}и сохранение чекпоинта...")
+        model = load_model(source, quantize)
+        staging = os.path.join(work_dir, "artifact")
+        model.save_pretrained(staging, safe_serialization=True)
+        AutoTokenizer.from_pretrained(base, trust_remote_code=True).save_pretrained(staging)
+        del model
+        gc.collect()
+
+        manifest = {
+            "content_hash": content_hash(staging),
+            "base_model": base,
+            "adapter": adapter,
+            "quantization": "bnb-nf4" if quantize else None,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with open(os.path.join(staging, llm.ARTIFACT_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        # Старый чекпоинт заменяется только готовым новым, чтобы бот не увидел половину файлов
+        if os.path.exists(output):
+            shutil.rmtree(output)
+        os.replace(staging, output)
+    return manifest
+
+
+def timed_load(load) -> float:
+    started_at = time.perf_counter()
+    model = load()
+    elapsed = time.perf_counter() - started_at
+    del model
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    return elapsed
+
+
+def compare_load_time(base: str, adapter: str, quantize: bool, output: str):
+    def current_path():
+        # Как load_llm без артефакта: квантизация при загрузке и слияние адаптера поверх
+        model = load_model(base, quantize)
+        if adapter and os.path.isdir(adapter):
+            model = PeftModel.from_pretrained(model, adapter).merge_and_unload()
+        return model
+
+    artifact = timed_load(lambda: AutoModelForCausalLM.from_pretrained(output, device_map="auto" if quantize else None,
+                                                                       torch_dtype="auto"))
+    baseline = timed_load(current_path)
+    print(f"Загрузка без артефакта: {baseline:.2f} с, из артефакта: {artifact:.2f} с, "
+          f"экономия {baseline - artifact:.2f} с ({(1 - artifact / baseline) * 100:.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка слитого и квантизованного чекпоинта модели")
+    parser.add_argument("--base", default=llm.base_model_name, help="Базовая модель (имя на HF Hub или путь)")
+    parser.add_argument("--adapter", default=llm.adapter_path, help="Папка LoRA адаптера; пустая строка - без адаптера")
+    parser.add_argument("--output", default=MODEL_ARTIFACT_DIR, help="Куда сохранить чекпоинт")
+    parser.add_argument("--no-quantize", action="store_true", help="Не квантизовать (например, для проверки на CPU)")
+    parser.add_argument("--skip-benchmark", action="store_true", help="Не сравнивать время загрузки")
+    args = parser.parse_args()
+
+    quantize = not args.no_quantize
+    started_at = time.perf_counter()
+    manifest = build(args.base, args.adapter, quantize, args.output)
+    print(f"Чекпоинт собран за {time.perf_counter() - started_at:.1f} с: {args.output}")
+    print(f"Хэш содержимого: {manifest['content_hash']}")
+    if not args.skip_benchmark:
+        compare_load_time(args.base, manifest["adapter"], quantize, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Сборка BM25 индекса по текстам правил для подстановки выдержек в промпт (RAG).
+# Бот загружает индекс из RULES_INDEX_DIR при первом сообщении.
+# Запуск из корня проекта:
+#   python build_rules_index.py                       # тексты из AI-part -> RULES_INDEX_DIR
+#   python build_rules_index.py --source my_rules.txt --output /tmp/rules_index
+import argparse
+import time
+
+from config import RULES_INDEX_DIR
+from rules_index import RulesIndex, build_index
+
+DEFAULT_SOURCES = [
+    "AI-part/free_dnd_rules.txt",
+    "AI-part/russian_srd_filtered.txt",
+    "AI-part/phb_text_final.txt",
+]
+# Запросы для замера скорости поиска
+SAMPLE_QUERIES = [
+    "Как работает атака с преимуществом?",
+    "Сколько хитов восстанавливает короткий отдых",
+    "заклинание огненный шар урон",
+    "Что делает состояние ошеломлённый",
+    "класс доспеха кольчуга",
+]
+
+
+def benchmark(path: str, k: int, repeats: int):
+    index = RulesIndex(path)
+    started_at = time.perf_counter()
+    index.search(SAMPLE_QUERIES[0], k)
+    print(f"Первый поиск (с загрузкой индекса): {(time.perf_counter() - started_at) * 1000:.1f} мс")
+    timings = []
+    for _ in range(repeats):
+        for query in SAMPLE_QUERIES:
+            started_at = time.perf_counter()
+            index.search(query, k)
+            timings.append(time.perf_counter() - started_at)
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1000
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+    print(f"Поиск top-{k}: p50 {p50:.2f} мс, p99 {p99:.2f} мс ({len(timings)} запросов)")
+    for score, passage in index.search(SAMPLE_QUERIES[0], k):
+        print(f"--- {score:.2f} ---\n{passage[:300]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка BM25 индекса по текстам правил D&D")
+    parser.add_argument("--source", action="append", help="Текстовый файл с правилами (можно несколько раз)")
+    parser.add_argument("--output", default=RULES_INDEX_DIR, help="Куда сохранить индекс")
+    parser.add_argument("--chunk-chars", type=int, default=800, help="Примерный размер фрагмента в символах")
+    parser.add_argument("--top-k", type=int, default=3, help="Сколько фрагментов искать при замере")
+    parser.add_argument("--repeats", type=int, default=200, help="Повторов каждого запроса при замере")
+    parser.add_argument("--skip-benchmark", action="store_true", help="Не замерять скорость поиска")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    manifest = build_index(args.source or DEFAULT_SOURCES, args.output, chunk_chars=args.chunk_chars)
+    print(f"Индекс собран за {time.perf_counter() - started_at:.1f} с: {args.output} "
+          f"({manifest['passages']} фрагментов, {len(manifest['terms'])} термов)")
+    if not args.skip_benchmark:
+        benchmark(args.output, args.top_k, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,5 +4,104 @@ import json
 with open("config.json") as file:
     data = json.load(file)
     BOT_TOKEN = data.get("BOT_TOKEN")
+    # Как получать обновления: "polling" или "webhook" (aiohttp сервер, можно запускать
+    # несколько экземпляров бота за балансировщиком)
+    BOT_MODE = data.get("BOT_MODE", "polling")
+    # Публичный адрес, на который Telegram шлет обновления (без пути); если пуст,
+    # вебхук не регистрируется при старте (например, его уже зарегистрировал другой экземпляр)
+    WEBHOOK_URL = data.get("WEBHOOK_URL")
+    WEBHOOK_PATH = data.get("WEBHOOK_PATH", "/webhook")
+    # Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_SECRET = data.get("WEBHOOK_SECRET")
+    WEBHOOK_HOST = data.get("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = data.get("WEBHOOK_PORT", 8080)
+    # Адрес Bot API, если он не стандартный (локальный сервер Bot API или тестовый fake_telegram.py)
+    TELEGRAM_API_URL = data.get("TELEGRAM_API_URL")
+    # Адрес отдельного сервера инференса (inference_server.py), например "http://127.0.0.1:8181";
+    # если не задан, модель загружается в процессе бота
+    INFERENCE_SERVER_URL = data.get("INFERENCE_SERVER_URL")
+    # Где слушает сам сервер инференса
+    INFERENCE_SERVER_HOST = data.get("INFERENCE_SERVER_HOST", "127.0.0.1")
+    INFERENCE_SERVER_PORT = data.get("INFERENCE_SERVER_PORT", 8181)
+    # Максимум запросов к LLM, ожидающих генерации (включая выполняемый)
+    INFERENCE_QUEUE_SIZE = data.get("INFERENCE_QUEUE_SIZE", 32)
+    # Сколько секунд обработчик ждет ответа модели, прежде чем сдаться
+    INFERENCE_TIMEOUT = data.get("INFERENCE_TIMEOUT", 180)
+    # Максимальный размер батча и окно (в секундах) для сбора запросов разных чатов в батч
+    MAX_BATCH_SIZE = data.get("MAX_BATCH_SIZE", 8)
+    BATCH_WINDOW = data.get("BATCH_WINDOW", 0.05)
+    # Лимит частоты сообщений одного пользователя модели (команды не считаются):
+    # RATE_LIMIT_BURST подряд, затем RATE_LIMIT_PER_MINUTE в минуту
+    RATE_LIMIT_PER_MINUTE = data.get("RATE_LIMIT_PER_MINUTE", 10)
+    RATE_LIMIT_BURST = data.get("RATE_LIMIT_BURST", 5)
+    # Сообщения чата, пришедшие с паузой меньше этой (в секундах), пока бот еще отвечает
+    # на предыдущее, получают один общий ответ; в свободный чат сообщение уходит сразу
+    MESSAGE_COALESCE_WINDOW = data.get("MESSAGE_COALESCE_WINDOW", 0.5)
+    # Показывать ответ по мере генерации, редактируя сообщение не чаще раза в STREAM_EDIT_INTERVAL секунд
+    STREAMING_REPLIES = data.get("STREAMING_REPLIES", True)
+    STREAM_EDIT_INTERVAL = data.get("STREAM_EDIT_INTERVAL", 1.0)
+    # Где выполнять модель: "cuda" (4-битная квантизация bitsandbytes), "cpu" или "auto" - GPU, если он есть
+    LLM_DEVICE = data.get("LLM_DEVICE", "auto")
+    # Квантизация на CPU: "int8" (динамическая квантизация линейных слоев) или None (float32)
+    CPU_QUANTIZATION = data.get("CPU_QUANTIZATION", "int8")
+    # Потоков для матричных операций на CPU; None - по числу доступных процессу ядер
+    CPU_THREADS = data.get("CPU_THREADS")
+    # Папка с готовым слитым и квантизованным чекпоинтом (собирается build_artifact.py)
+    MODEL_ARTIFACT_DIR = data.get("MODEL_ARTIFACT_DIR", "artifacts/saiga_dnd")
+    # Маленькая модель-черновик с тем же токенизатором для спекулятивного декодирования
+    # (папка или имя на Hugging Face Hub); None - обычная генерация
+    DRAFT_MODEL = data.get("DRAFT_MODEL")
+    # Сколько токенов черновик предлагает за шаг (дальше подстраивается по доле принятых)
+    DRAFT_TOKENS = data.get("DRAFT_TOKENS", 5)
+    # Если основная модель принимает меньшую долю токенов черновика, он только мешает
+    # и используется лишь изредка, чтобы проверить, не стало ли лучше
+    DRAFT_MIN_ACCEPTANCE = data.get("DRAFT_MIN_ACCEPTANCE", 0.3)
+    # Бюджет памяти (МБ) под KV-кэш диалогов по чатам; 0 отключает переиспользование
+    KV_CACHE_MAX_MB = data.get("KV_CACHE_MAX_MB", 2048)
+    # LoRA адаптеры поверх одной базовой модели: {"имя": "папка адаптера"}. Не подключайте
+    # адаптер, уже слитый в MODEL_ARTIFACT_DIR, - он применится дважды
+    LORA_ADAPTERS = data.get("LORA_ADAPTERS", {})
+    # Адаптер для чатов, не выбравших режим через /mode; None - базовая модель
+    DEFAULT_ADAPTER = data.get("DEFAULT_ADAPTER")
+    # Telegram id пользователей, которым доступны служебные команды (/reload_adapters)
+    ADMIN_IDS = data.get("ADMIN_IDS", [])
+    # Сколько токенов истории диалога попадает в промпт (старые сообщения отбрасываются)
+    HISTORY_TOKEN_BUDGET = data.get("HISTORY_TOKEN_BUDGET", 3072)
+    # Сколько чатов держать в памяти и через сколько секунд без сообщений забывать чат
+    HISTORY_MAX_CHATS = data.get("HISTORY_MAX_CHATS", 10000)
+    HISTORY_IDLE_TTL = data.get("HISTORY_IDLE_TTL", 7 * 24 * 3600)
+    # Папка BM25 индекса правил (собирается build_rules_index.py) и сколько найденных
+    # фрагментов подставлять в промпт; 0 отключает поиск по правилам
+    RULES_INDEX_DIR = data.get("RULES_INDEX_DIR", "artifacts/rules_index")
+    RAG_TOP_K = data.get("RAG_TOP_K", 3)
+    # Фрагменты с оценкой BM25 не выше этой в промпт не попадают. На текстах из AI-part
+    # нужный фрагмент на типичные вопросы о правилах получает от 3.7 ("что такое спасбросок" -
+    # один частый терм) до 20, поэтому порог отсекает только случайные совпадения одного слова
+    RAG_MIN_SCORE = data.get("RAG_MIN_SCORE", 3.0)
+    # Кэш ответов на общие вопросы о правилах: сколько ответов хранить (0 отключает),
+    # сколько секунд ответ считается актуальным и с какого сходства вопросы считаются одинаковыми
+    RESPONSE_CACHE_SIZE = data.get("RESPONSE_CACHE_SIZE", 1000)
+    RESPONSE_CACHE_TTL = data.get("RESPONSE_CACHE_TTL", 24 * 3600)
+    RESPONSE_CACHE_SIMILARITY = data.get("RESPONSE_CACHE_SIMILARITY", 0.75)
+    # Где хранить историю и режимы /mode между перезапусками: "sqlite" или "memory" (не сохранять)
+    SESSION_BACKEND = data.get("SESSION_BACKEND", "sqlite")
+    SESSION_DB_PATH = data.get("SESSION_DB_PATH", "sessions.db")
+    # Как часто (в секундах) накопленные сообщения пакетно записываются на диск
+    SESSION_FLUSH_INTERVAL = data.get("SESSION_FLUSH_INTERVAL", 1.0)
+    # Замеры этапов обработки сообщения (гистограммы на /metrics); выключение убирает их накладные расходы
+    METRICS_ENABLED = data.get("METRICS_ENABLED", True)
+    # Порт для /metrics, /healthz (готовность) и /livez (живость) в режиме polling;
+    # в режиме webhook они на порту вебхука
+    METRICS_PORT = data.get("METRICS_PORT")
+    # Доля промптов, которые пишутся в лог целиком (0 - только при уровне логирования DEBUG)
+    PROMPT_LOG_SAMPLE_RATE = data.get("PROMPT_LOG_SAMPLE_RATE", 0.0)
 if not BOT_TOKEN:
     raise ValueError("Something from the following list was not given: BOT_TOKEN")
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"Unknown BOT_MODE: {BOT_MODE}")
+if LLM_DEVICE not in ("auto", "cuda", "cpu"):
+    raise ValueError(f"Unknown LLM_DEVICE: {LLM_DEVICE}")
+if CPU_QUANTIZATION not in ("int8", None):
+    raise ValueError(f"Unknown CPU_QUANTIZATION: {CPU_QUANTIZATION}")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise ValueError("Something from the following list was not given: WEBHOOK_SECRET")
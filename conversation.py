@@ -0,0 +1,145 @@
+import logging
+import time
+from array import array
+from collections import OrderedDict, deque
+
+
+class Turn:
+    """Одно сообщение диалога вместе с его токенами в формате промпта Saiga."""
+    __slots__ = ("role", "content", "token_ids")
+
+    def __init__(self, role: str, content: str, token_ids: array):
+        self.role = role
+        self.content = content
+        self.token_ids = token_ids
+
+
+class _Chat:
+    __slots__ = ("turns", "tokens", "last_access", "mode")
+
+    def __init__(self):
+        self.turns = deque()
+        self.tokens = 0
+        self.last_access = time.monotonic()
+        # Режим (LoRA адаптер), выбранный в чате; None - режим по умолчанию
+        self.mode = None
+
+
+class ConversationStore:
+    """История диалогов по чатам с ограничением по токенам и вытеснением неактивных чатов.
+
+    Каждое сообщение токенизируется один раз при добавлении (функцией
+    tokenize(role, content)), дальше промпт собирается из готовых токенов.
+    История чата обрезается со старых сообщений так, чтобы суммарно в ней
+    было не больше token_budget токенов. Чаты, к которым не обращались
+    дольше idle_ttl секунд, и самые давние чаты сверх max_chats удаляются
+    из памяти.
+
+    Если задан backend (sessions.SessionBackend), каждое сообщение
+    дополнительно сохраняется в нем, а история чата, которого нет в памяти
+    (после перезапуска или вытеснения), подгружается из него при первом
+    обращении. Выбранный режим чата (set_mode) сохраняется там же и
+    переживает перезапуск и вытеснение; clear() удаляет только историю.
+    """
+
+    def __init__(self, tokenize, token_budget: int, max_chats: int, idle_ttl: float,
+                 backend=None, load_limit: int = 200):
+        self.tokenize = tokenize
+        self.token_budget = token_budget
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self.backend = backend
+        self.load_limit = load_limit
+        self._chats = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def history(self, chat_id) -> list:
+        """Сообщения чата от старых к новым (список Turn)."""
+        chat = self._touch(chat_id, create=False)
+        return list(chat.turns) if chat else []
+
+    def append(self, chat_id, role: str, content: str) -> Turn:
+        chat = self._touch(chat_id, create=True)
+        turn = self._add_turn(chat, role, content)
+        self._trim(chat_id, chat)
+        if self.backend is not None:
+            self.backend.append(chat_id, role, content)
+        return turn
+
+    def get_mode(self, chat_id):
+        chat = self._touch(chat_id, create=False)
+        return chat.mode if chat else None
+
+    def set_mode(self, chat_id, mode):
+        self._touch(chat_id, create=True).mode = mode
+        if self.backend is not None:
+            self.backend.save_mode(chat_id, mode)
+
+    def clear(self, chat_id):
+        chat = self._chats.pop(chat_id, None)
+        if chat is not None and chat.mode is not None:
+            self._chats[chat_id] = _Chat()
+            self._chats[chat_id].mode = chat.mode
+        if self.backend is not None:
+            self.backend.delete(chat_id)
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+    def _add_turn(self, chat: _Chat, role: str, content: str) -> Turn:
+        turn = Turn(role, content, array("i", self.tokenize(role, content)))
+        chat.turns.append(turn)
+        chat.tokens += len(turn.token_ids)
+        return turn
+
+    def _load(self, chat_id):
+        """Восстанавливает историю и режим чата из backend; None, если о чате ничего не сохранено."""
+        if self.backend is None:
+            return None
+        messages = self.backend.load(chat_id, self.load_limit)
+        mode = self.backend.load_mode(chat_id)
+        if not messages and mode is None:
+            return None
+        chat = _Chat()
+        chat.mode = mode
+        for role, content in messages:
+            self._add_turn(chat, role, content)
+        self._trim(chat_id, chat)
+        logging.info(f"История чата {chat_id} загружена из хранилища: {len(chat.turns)} сообщений.")
+        return chat
+
+    def _trim(self, chat_id, chat: _Chat):
+        # Последнее сообщение оставляем всегда, даже если оно одно больше бюджета
+        dropped = 0
+        while chat.tokens > self.token_budget and len(chat.turns) > 1:
+            chat.tokens -= len(chat.turns.popleft().token_ids)
+            dropped += 1
+        if dropped:
+            logging.debug(f"Из истории чата {chat_id} удалено {dropped} старых сообщений (бюджет {self.token_budget} токенов).")
+
+    def _touch(self, chat_id, create: bool):
+        now = time.monotonic()
+        self._evict(now, room=1 if create and chat_id not in self._chats else 0)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._load(chat_id)
+            if chat is None:
+                if not create:
+                    return None
+                chat = _Chat()
+            self._chats[chat_id] = chat
+        self._chats.move_to_end(chat_id)
+        chat.last_access = now
+        return chat
+
+    def _evict(self, now: float, room: int):
+        # Чаты упорядочены по времени последнего обращения, самые давние - в начале
+        while self._chats:
+            chat_id, chat = next(iter(self._chats.items()))
+            if len(self._chats) + room <= self.max_chats and now - chat.last_access < self.idle_ttl:
+                break
+            del self._chats[chat_id]
+            logging.debug(f"История чата {chat_id} вытеснена из памяти.")
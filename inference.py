@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+class InferenceQueueFull(Exception):
+    """Очередь инференса заполнена, новый запрос не принят."""
+
+
+class RequestSuperseded(Exception):
+    """Запрос снят с очереди: в том же чате пришел более новый запрос."""
+
+
+class GenerationRequest:
+    """Запрос на генерацию ответа для одного чата."""
+    __slots__ = ("prompt", "token_ids", "chat_id", "on_text", "adapter")
+
+    def __init__(self, prompt: str, token_ids: list = None, chat_id=None, on_text=None, adapter=None):
+        self.prompt = prompt
+        # Уже готовые токены промпта; если None, промпт токенизируется при генерации
+        self.token_ids = token_ids
+        # По chat_id модель находит состояние внимания прошлых ходов диалога
+        self.chat_id = chat_id
+        # on_text(text) получает уже видимую часть ответа по мере генерации
+        self.on_text = on_text
+        # Имя LoRA адаптера, которым генерировать ответ; None - базовая модель
+        self.adapter = adapter
+
+
+class _Job:
+    __slots__ = ("request", "future", "key", "enqueued_at")
+
+    def __init__(self, request: GenerationRequest, future: asyncio.Future, key=None):
+        self.request = request
+        self.future = future
+        self.key = key
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceWorker:
+    """Собирает запросы разных чатов в батчи и генерирует их в отдельном потоке.
+
+    Планировщик берет первый запрос из очереди и ждет еще не дольше
+    batch_window секунд (или пока не наберется max_batch_size), после чего
+    отправляет батч в generate_batch. Пока модель занята, новые запросы
+    копятся в очереди и уходят следующим батчем сразу после освобождения
+    модели, без ожидания окна. В батч попадают только запросы к тому же
+    LoRA адаптеру, что и первый; остальные ждут следующего батча, не теряя
+    места в очереди. Очередь ограничена: если в ней уже max_queue_size
+    запросов, submit() сразу выбрасывает InferenceQueueFull.
+
+    Запрос с ключом (обычно id чата) вытесняет из очереди еще не начатый
+    запрос с тем же ключом, и тот завершается RequestSuperseded. Поэтому у
+    каждого чата в очереди не больше одного запроса, и очередь по порядку
+    поступления обходит чаты по кругу: частые сообщения одного игрока не
+    отодвигают остальных.
+    """
+
+    def __init__(self, generate_batch, max_queue_size: int, timeout: float,
+                 max_batch_size: int = 8, batch_window: float = 0.05):
+        self.generate_batch = generate_batch
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-worker")
+        self._queue = deque()
+        self._queue_changed = asyncio.Event()
+        self._pending = 0
+        # Ключ -> еще не начатый запрос с этим ключом
+        self._queued_by_key = {}
+        self._scheduler_task = None
+
+    @property
+    def pending(self) -> int:
+        """Количество принятых запросов, еще не получивших ответ (включая генерируемые)."""
+        return self._pending
+
+    def start(self):
+        """Запускает планировщик батчей. Вызывать из работающего event loop."""
+        if self._scheduler_task is None:
+            self._scheduler_task = asyncio.create_task(self._scheduler())
+
+    async def submit(self, request: GenerationRequest, key=None) -> str:
+        """Ставит запрос в очередь и ждет ответ не дольше self.timeout секунд.
+
+        request.on_text, если задан, вызывается в event loop с уже видимой
+        частью ответа по мере генерации. Если задан key, еще не начатый
+        запрос с тем же ключом снимается с очереди (RequestSuperseded).
+        """
+        if key is not None:
+            self._supersede(key)
+        if self._pending >= self.max_queue_size:
+            raise InferenceQueueFull()
+        self._pending += 1
+        loop = asyncio.get_running_loop()
+        if request.on_text is not None:
+            # Стример вызывается из потока генерации, а колбэк живет в event loop
+            request.on_text = self._threadsafe(loop, request.on_text)
+        job = _Job(request, loop.create_future(), key)
+        if key is not None:
+            self._queued_by_key[key] = job
+        self._queue.append(job)
+        self._queue_changed.set()
+        # При таймауте future отменяется; еще не начатый запрос планировщик
+        # пропустит и не займет им место в батче
+        return await asyncio.wait_for(job.future, timeout=self.timeout)
+
+    def _supersede(self, key):
+        job = self._queued_by_key.pop(key, None)
+        if job is None:
+            return
+        self._queue.remove(job)
+        self._pending -= 1
+        if not job.future.done():
+            job.future.set_exception(RequestSuperseded())
+
+    def _forget_key(self, job: _Job):
+        # Взятый в батч запрос уже генерируется, и вытеснить его нельзя
+        if job.key is not None and self._queued_by_key.get(job.key) is job:
+            del self._queued_by_key[job.key]
+
+    @staticmethod
+    def _threadsafe(loop, callback):
+        def wrapper(text: str):
+            loop.call_soon_threadsafe(callback, text)
+        return wrapper
+
+    async def run_exclusive(self, func, *args):
+        """Выполняет func(*args) в потоке генерации между батчами и возвращает результат.
+
+        Нужно для операций, меняющих модель (например, перезагрузки
+        адаптеров): они не должны пересекаться с генерацией.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _take_matching(self, adapter, limit: int) -> list:
+        """Забирает из очереди до limit самых старых запросов к адаптеру adapter."""
+        taken, rest = [], deque()
+        for job in self._queue:
+            if len(taken) < limit and job.request.adapter == adapter:
+                taken.append(job)
+                self._forget_key(job)
+            else:
+                rest.append(job)
+        self._queue = rest
+        return taken
+
+    async def _collect_batch(self) -> list:
+        while not self._queue:
+            self._queue_changed.clear()
+            await self._queue_changed.wait()
+        batch = [self._queue.popleft()]
+        self._forget_key(batch[0])
+        adapter = batch[0].request.adapter
+        deadline = time.perf_counter() + self.batch_window
+        while True:
+            batch.extend(self._take_matching(adapter, self.max_batch_size - len(batch)))
+            remaining = deadline - time.perf_counter()
+            if len(batch) >= self.max_batch_size or remaining <= 0:
+                break
+            self._queue_changed.clear()
+            try:
+                await asyncio.wait_for(self._queue_changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _scheduler(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            # Запросы, чьи обработчики уже перестали ждать, не генерируем
+            cancelled = [job for job in batch if job.future.done()]
+            batch = [job for job in batch if not job.future.done()]
+            self._pending -= len(cancelled)
+            if not batch:
+                continue
+
+            started_at = time.perf_counter()
+            for job in batch:
+                metrics.queue_wait_seconds.observe(started_at - job.enqueued_at)
+            metrics.batch_size.observe(len(batch))
+            try:
+                requests = [job.request for job in batch]
+                results = await loop.run_in_executor(self._executor, self.generate_batch, requests)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            else:
+                for job, result in zip(batch, results):
+                    if not job.future.done():
+                        job.future.set_result(result)
+            finally:
+                self._pending -= len(batch)
+                finished_at = time.perf_counter()
+                metrics.generation_seconds.observe(finished_at - started_at)
+                logging.info(f"Инференс: батч из {len(batch)}, ожидание в очереди до "
+                             f"{started_at - min(job.enqueued_at for job in batch):.2f} с, "
+                             f"генерация {finished_at - started_at:.2f} с")
+
+    def shutdown(self):
+        if self._scheduler_task is not None:
+            self._scheduler_task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+from backend import ModelNotReady
+from inference import InferenceQueueFull, RequestSuperseded
+
+# Коды ошибок протокола inference_server.py и соответствующие исключения
+_ERRORS = {
+    "queue_full": InferenceQueueFull,
+    "timeout": asyncio.TimeoutError,
+    "superseded": RequestSuperseded,
+    "not_ready": ModelNotReady,
+    "bad_request": ValueError,
+}
+# HTTP статусы ответов с ошибкой
+ERROR_STATUSES = {"queue_full": 503, "timeout": 504, "superseded": 409, "not_ready": 503, "bad_request": 400}
+
+
+def encode_error(error: Exception) -> dict:
+    """Ошибка LocalBackend в виде JSON ответа сервера."""
+    for code, error_class in _ERRORS.items():
+        if isinstance(error, error_class):
+            data = {"error": code, "message": str(error)}
+            if isinstance(error, ModelNotReady):
+                data["state"] = error.state
+            return data
+    return {"error": "internal", "message": str(error)}
+
+
+def decode_error(data: dict) -> Exception:
+    error_class = _ERRORS.get(data["error"])
+    if error_class is ModelNotReady:
+        return ModelNotReady(data.get("state"))
+    if error_class is None:
+        return RuntimeError(f"Ошибка сервера инференса: {data.get('message')}")
+    return error_class(data.get("message"))
+
+
+class RemoteBackend:
+    """Клиент inference_server.py с тем же интерфейсом, что и backend.LocalBackend.
+
+    Модель, история диалогов и очередь генерации живут в процессе сервера,
+    поэтому бот можно перезапускать без перезагрузки модели, а несколько
+    экземпляров бота могут работать с одним сервером. Частичный текст
+    ответа приходит построчно (NDJSON) и передается в on_text.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip("/")
+        # Сервер сам ограничивает ожидание генерации; здесь - запас на сеть
+        self.timeout = ClientTimeout(total=timeout + 30)
+        self._session = None
+
+    async def start(self):
+        self._session = ClientSession(timeout=self.timeout)
+        logging.info(f"Инференс выполняется на сервере {self.url}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def _request(self, method: str, path: str, payload: dict = None) -> dict:
+        async with self._session.request(method, self.url + path, json=payload) as response:
+            data = await response.json()
+        if "error" in data:
+            raise decode_error(data)
+        return data
+
+    async def status(self) -> dict:
+        try:
+            return await self._request("GET", "/status")
+        except ClientError as e:
+            logging.warning(f"Сервер инференса {self.url} недоступен: {e}")
+            return {"model": "unavailable", "pending": 0}
+
+    async def modes(self) -> list:
+        return (await self._request("GET", "/modes"))["modes"]
+
+    async def get_mode(self, chat_id) -> str:
+        return (await self._request("GET", f"/chats/{chat_id}/mode"))["mode"]
+
+    async def set_mode(self, chat_id, mode: str):
+        await self._request("PUT", f"/chats/{chat_id}/mode", {"mode": mode})
+
+    async def chat_adapter(self, chat_id):
+        return (await self._request("GET", f"/chats/{chat_id}/adapter"))["adapter"]
+
+    async def append(self, chat_id, role: str, content: str):
+        await self._request("POST", f"/chats/{chat_id}/messages", {"role": role, "content": content})
+
+    async def generate(self, chat_id, rules: list = None, standalone: bool = False, on_text=None) -> str:
+        payload = {"rules": rules or [], "standalone": standalone, "stream": on_text is not None}
+        async with self._session.post(f"{self.url}/chats/{chat_id}/generate", json=payload) as response:
+            if on_text is None:
+                data = await response.json()
+            else:
+                data = None
+                async for line in response.content:
+                    data = json.loads(line)
+                    if "text" not in data:
+                        break
+                    on_text(data["text"])
+        if data is None:
+            raise RuntimeError("Сервер инференса оборвал ответ")
+        if "error" in data:
+            raise decode_error(data)
+        return data["response"]
+
+    async def reload_adapters(self, names: list = None) -> list:
+        return (await self._request("POST", "/adapters/reload", {"names": names}))["reloaded"]
@@ -0,0 +1,166 @@
+# Отдельный процесс инференса: модель, история диалогов и очередь генерации.
+# Бот подключается к нему, если в config.json задан INFERENCE_SERVER_URL
+# (см. inference_client.RemoteBackend), и тогда может перезапускаться без перезагрузки модели.
+# Запуск из корня проекта:
+#   python inference_server.py
+import asyncio
+import json
+import logging
+
+from aiohttp import web
+
+import metrics
+from backend import LocalBackend
+from config import INFERENCE_SERVER_HOST, INFERENCE_SERVER_PORT, METRICS_ENABLED
+from inference_client import ERROR_STATUSES, encode_error
+
+
+def error_response(error: Exception) -> web.Response:
+    data = encode_error(error)
+    if data["error"] == "internal":
+        logging.error(f"Ошибка обработки запроса к серверу инференса: {error}", exc_info=error)
+    return web.json_response(data, status=ERROR_STATUSES.get(data["error"], 500))
+
+
+async def read_json(request: web.Request, **fields) -> dict:
+    """Тело запроса - JSON объект с обязательными полями fields (имя=тип).
+
+    Некорректное тело вызывает ValueError, то есть ответ bad_request (400).
+    """
+    data = await request.json()
+    if not isinstance(data, dict):
+        raise ValueError("Тело запроса должно быть JSON объектом")
+    for name, field_type in fields.items():
+        if not isinstance(data.get(name), field_type):
+            raise ValueError(f"Поле {name} отсутствует или имеет неверный тип")
+    return data
+
+
+def create_app(backend: LocalBackend) -> web.Application:
+    routes = web.RouteTableDef()
+
+    @routes.get("/status")
+    async def status(request: web.Request) -> web.Response:
+        return web.json_response(await backend.status())
+
+    @routes.get("/metrics")
+    async def metrics_endpoint(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    @routes.get("/modes")
+    async def modes(request: web.Request) -> web.Response:
+        return web.json_response({"modes": await backend.modes()})
+
+    @routes.get("/chats/{chat_id}/mode")
+    async def get_mode(request: web.Request) -> web.Response:
+        try:
+            mode = await backend.get_mode(int(request.match_info["chat_id"]))
+        except Exception as e:
+            return error_response(e)
+        return web.json_response({"mode": mode})
+
+    @routes.put("/chats/{chat_id}/mode")
+    async def set_mode(request: web.Request) -> web.Response:
+        try:
+            data = await read_json(request, mode=str)
+            await backend.set_mode(int(request.match_info["chat_id"]), data["mode"])
+        except Exception as e:
+            return error_response(e)
+        return web.json_response({})
+
+    @routes.get("/chats/{chat_id}/adapter")
+    async def chat_adapter(request: web.Request) -> web.Response:
+        try:
+            adapter = await backend.chat_adapter(int(request.match_info["chat_id"]))
+        except Exception as e:
+            return error_response(e)
+        return web.json_response({"adapter": adapter})
+
+    @routes.post("/chats/{chat_id}/messages")
+    async def append(request: web.Request) -> web.Response:
+        try:
+            data = await read_json(request, role=str, content=str)
+            await backend.append(int(request.match_info["chat_id"]), data["role"], data["content"])
+        except Exception as e:
+            return error_response(e)
+        return web.json_response({})
+
+    @routes.post("/chats/{chat_id}/generate")
+    async def generate(request: web.Request) -> web.StreamResponse:
+        try:
+            chat_id = int(request.match_info["chat_id"])
+            data = await read_json(request)
+        except Exception as e:
+            return error_response(e)
+        if not data.get("stream"):
+            try:
+                text = await backend.generate(chat_id, rules=data.get("rules"), standalone=data.get("standalone", False))
+            except Exception as e:
+                return error_response(e)
+            return web.json_response({"response": text})
+
+        # Потоковый ответ: строки JSON {"text": ...} с видимой частью ответа,
+        # последняя строка - {"response": ...} или {"error": ...}
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        latest_text = None
+        changed = asyncio.Event()
+
+        def on_text(text: str):
+            nonlocal latest_text
+            latest_text = text
+            changed.set()
+
+        task = asyncio.create_task(backend.generate(chat_id, rules=data.get("rules"),
+                                                    standalone=data.get("standalone", False), on_text=on_text))
+        try:
+            while not task.done():
+                waiter = asyncio.create_task(changed.wait())
+                await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if changed.is_set():
+                    changed.clear()
+                    await response.write(json.dumps({"text": latest_text}, ensure_ascii=False).encode() + b"\n")
+            try:
+                result = {"response": task.result()}
+            except Exception as e:
+                result = encode_error(e)
+            await response.write(json.dumps(result, ensure_ascii=False).encode() + b"\n")
+        finally:
+            # Клиент отключился - ответ больше никому не нужен
+            if not task.done():
+                task.cancel()
+        await response.write_eof()
+        return response
+
+    @routes.post("/adapters/reload")
+    async def reload_adapters(request: web.Request) -> web.Response:
+        try:
+            data = await read_json(request)
+            reloaded = await backend.reload_adapters(data.get("names"))
+        except Exception as e:
+            return error_response(e)
+        return web.json_response({"reloaded": reloaded})
+
+    app = web.Application()
+    app.add_routes(routes)
+
+    async def on_startup(app: web.Application):
+        await backend.start()
+
+    async def on_cleanup(app: web.Application):
+        await backend.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    metrics.enabled = METRICS_ENABLED
+    web.run_app(create_app(LocalBackend()), host=INFERENCE_SERVER_HOST, port=INFERENCE_SERVER_PORT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import logging
+import threading
+from collections import OrderedDict
+
+
+def common_prefix_length(a: list, b: list) -> int:
+    """Длина общего префикса двух последовательностей токенов."""
+    limit = min(len(a), len(b))
+    i = 0
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def crop_past(past, length: int):
+    """Обрезает past_key_values (кортеж пар (key, value) по слоям) до первых length позиций."""
+    return tuple((key[:, :, :length], value[:, :, :length]) for key, value in past)
+
+
+def past_nbytes(past) -> int:
+    return sum(key.numel() * key.element_size() + value.numel() * value.element_size()
+               for key, value in past)
+
+
+class _Entry:
+    __slots__ = ("token_ids", "past", "nbytes")
+
+    def __init__(self, token_ids: list, past, nbytes: int):
+        self.token_ids = token_ids
+        self.past = past
+        self.nbytes = nbytes
+
+
+class KVCacheStore:
+    """Хранит past_key_values уже обработанного префикса диалога для каждого чата.
+
+    Ключ записи задает вызывающий код (llm использует пару (чат, адаптер)).
+    Вместе с состоянием внимания хранятся токены, для которых оно посчитано.
+    get() отдает состояние только для общего префикса сохраненных токенов и
+    нового промпта, поэтому если история была обрезана по окну и промпт
+    изменился в начале, переиспользуется лишь совпадающая часть (обычно
+    системный промпт), а не устаревшее состояние. При превышении бюджета
+    памяти вытесняются давно не использованные чаты (LRU).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, token_ids: list):
+        """Возвращает (длина переиспользуемого префикса, past_key_values) или (0, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return 0, None
+            self._entries.move_to_end(key)
+            # Хотя бы один токен промпта нужно подать в модель, чтобы получить логиты
+            length = min(common_prefix_length(entry.token_ids, token_ids), len(token_ids) - 1)
+            if length <= 0:
+                return 0, None
+            return length, crop_past(entry.past, length)
+
+    def put(self, key, token_ids: list, past):
+        nbytes = past_nbytes(past)
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = _Entry(token_ids, past, nbytes)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                evicted_key, _ = next(iter(self._entries.items()))
+                self._remove(evicted_key)
+                logging.debug(f"KV-кэш чата {evicted_key} вытеснен (LRU).")
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_matching(self, predicate):
+        """Удаляет записи, для ключа которых predicate(key) истинно."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.nbytes
@@ -0,0 +1,872 @@
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+import torch
+from peft import PeftModel
+from peft.utils import load_peft_weights
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+from huggingface_hub import login
+
+import metrics
+from torch import nn
+from config import (CPU_QUANTIZATION, CPU_THREADS, DRAFT_MIN_ACCEPTANCE, DRAFT_MODEL, DRAFT_TOKENS, KV_CACHE_MAX_MB,
+                    LLM_DEVICE, LORA_ADAPTERS, MODEL_ARTIFACT_DIR)
+from kv_cache import KVCacheStore
+
+
+# --- Авторизация в Hugging Face Hub ---
+try:
+    hf_token = os.getenv("HF_TOKEN")
+    if not hf_token:
+        logging.warning("Переменная окружения HF_TOKEN не установлена. Загрузка некоторых моделей может не работать.")
+    else:
+        login(token=hf_token)
+        logging.info("Успешная авторизация в Hugging Face Hub.")
+except Exception as e:
+    logging.error(f"Ошибка авторизации в Hugging Face Hub: {e}")
+
+# --- Конфигурация модели ---
+base_model_name = "IlyaGusev/saiga_mistral_7b_lora"
+# Используем относительный путь, предполагая запуск из корня проекта
+adapter_path = "AI-part/saiga_mistral_dnd_lora_colab"
+# Имя файла манифеста в папке готового чекпоинта
+ARTIFACT_MANIFEST = "artifact.json"
+
+# --- Формат промпта Saiga ---
+# Шаблоны из документации Saiga
+MESSAGE_TEMPLATE = "<s>{role}\n{content}</s>"
+RESPONSE_TEMPLATE = "<s>bot\n" # Маркер начала ответа бота
+SYSTEM_PROMPT = "Ты — ИИ-ассистент, который ведет игру в Dungeons & Dragons 5-й редакции. Ты - мастер этой игры, именно ты должен генерировать конкретных персонажей и конкретные ситуации. Отвечай на вопросы о правилах, самой игре, генерируй описания и помогай с игровыми ситуациями. "
+# Общее начало всех промптов
+SYSTEM_PREFIX = MESSAGE_TEMPLATE.format(role="system", content=SYSTEM_PROMPT)
+
+# Заголовок системного сообщения с найденными выдержками из правил (RAG)
+RULES_HEADER = "Выдержки из правил D&D, которые могут пригодиться для ответа:"
+
+# Строки, после которых ответ модели заканчивается (Saiga может выдавать любую из них;
+# "<s>" - начало следующего сообщения, если модель пропустила </s>)
+STOP_STRINGS = ("</s>", "<|im_end|>", "<s>")
+_STOP_PATTERN = re.compile("|".join(map(re.escape, STOP_STRINGS)))
+# Заголовки сообщений, с которых модель может начать придумывать следующую реплику диалога
+TURN_ROLES = ("user", "bot", "system")
+
+# Параметры сэмплирования ответа
+MAX_NEW_TOKENS = 350       # Максимальная длина нового текста
+SAMPLING_SETTINGS = {
+    "do_sample": True,     # Включаем сэмплирование обратно
+    "temperature": 0.7,    # Снижаем температуру еще немного
+    "top_p": 0.95,         # Возвращаем top_p
+}
+
+# Глобальные переменные для модели и токенизатора
+model = None
+tokenizer = None
+# Подключенные LoRA адаптеры: имя -> папка (заполняется в load_llm и reload_adapters)
+adapters = {}
+# Состояние внимания уже обработанных префиксов диалогов по (чат, адаптер) (создается в load_llm)
+kv_cache = None
+# Токены SYSTEM_PREFIX, общие для всех запросов, и его состояние внимания
+# для каждого адаптера (None - базовая модель); считаются в load_llm
+system_prefix_ids = None
+system_prefix_past = {}
+response_template_ids = None
+# Стоп-токены и параметры генерации (GenerationProfile), собираются один раз в load_llm
+generation_profile = None
+# Модель-черновик для спекулятивного декодирования (None - выключено) и счетчики ее
+# проходов и проходов основной модели, по которым считается доля принятых токенов
+draft_model = None
+_draft_calls = None
+_main_calls = None
+# Скользящая доля принятых токенов черновика и сколько генераций подряд он пропущен из-за низкой доли
+_draft_acceptance = None
+_draft_skipped = 0
+# При низкой доле принятых черновик пробуется снова раз в столько генераций
+DRAFT_PROBE_INTERVAL = 20
+# Можно ли токенизировать промпт по частям: каждое сообщение отдельно
+_split_tokenization = False
+# Линейные слои модели квантизованы для CPU (int8); такие слои нельзя перезагружать через load_state_dict
+_cpu_quantized = False
+
+
+def is_loaded() -> bool:
+    return model is not None and tokenizer is not None
+
+
+def make_bnb_config() -> BitsAndBytesConfig:
+    # Конфигурация для 4-битной загрузки (Возвращено)
+    return BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.bfloat16,
+        bnb_4bit_use_double_quant=False,
+    )
+
+
+def read_artifact_manifest(path: str):
+    """Манифест готового чекпоинта (build_artifact.py) или None, если чекпоинта нет."""
+    manifest_path = os.path.join(path, ARTIFACT_MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_base_model():
+    """Загружает базовую модель с квантизацией на лету (если готового артефакта нет)."""
+    logging.info(f"Загрузка базовой модели: {base_model_name}")
+    # Возвращен параметр quantization_config=bnb_config
+    # Убран параметр offload_folder
+    loaded_model = AutoModelForCausalLM.from_pretrained(
+        base_model_name,
+        quantization_config=make_bnb_config(), # <-- Возвращено
+        device_map="auto",  # Автоматический выбор устройства (GPU/CPU)
+        # offload_folder="offload", # <-- Убрано
+        trust_remote_code=True,
+        torch_dtype=torch.bfloat16 # Оставляем, т.к. используется в bnb_config
+    )
+    # LoRA адаптеры подключаются отдельно в load_llm (см. _attach_adapters)
+    return loaded_model
+
+
+def resolve_device() -> str:
+    """Устройство для модели по LLM_DEVICE: "cuda" или "cpu"."""
+    if LLM_DEVICE == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return LLM_DEVICE
+
+
+def configure_cpu_threads(threads: int = None) -> int:
+    """Задает число потоков torch для матричных операций: CPU_THREADS или все доступные процессу ядра."""
+    if threads is None:
+        threads = CPU_THREADS
+    if not threads:
+        # sched_getaffinity учитывает ограничения контейнера и taskset, cpu_count - нет
+        threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    torch.set_num_threads(threads)
+    return threads
+
+
+def _load_cpu_model(manifest):
+    """Загружает модель для CPU в float32; возвращает (модель, откуда брать токенизатор).
+
+    Готовый артефакт подходит, только если он собран без квантизации
+    (build_artifact.py --no-quantize): 4-битные веса bitsandbytes на CPU не работают.
+    """
+    if manifest and manifest.get("quantization"):
+        logging.warning(f"Артефакт {MODEL_ARTIFACT_DIR} квантизован для GPU ({manifest['quantization']}), "
+                        f"на CPU загружаем базовую модель. Соберите артефакт с --no-quantize.")
+        manifest = None
+    source = MODEL_ARTIFACT_DIR if manifest else base_model_name
+    logging.info(f"Загрузка модели для CPU: {source}")
+    loaded_model = AutoModelForCausalLM.from_pretrained(source, torch_dtype=torch.float32, low_cpu_mem_usage=True,
+                                                        trust_remote_code=True)
+    return loaded_model, source
+
+
+def quantize_for_cpu(loaded_model):
+    """Динамическая int8 квантизация линейных слоев для CPU.
+
+    Веса хранятся в int8, активации квантизуются на лету; LoRA слои адаптеров
+    остаются в float32, поэтому адаптеры продолжают переключаться.
+    """
+    names = {name for name, module in loaded_model.named_modules()
+             if type(module) is nn.Linear and "lora_" not in name}
+    return torch.ao.quantization.quantize_dynamic(loaded_model, names, dtype=torch.qint8)
+
+
+def _copy_adapter_weights(peft_model, name: str, path: str):
+    """Заново читает веса уже подключенного адаптера прямо в его параметры.
+
+    load_adapter загружает state_dict целиком, а квантизованные для CPU
+    слои этого не поддерживают.
+    """
+    params = dict(peft_model.named_parameters())
+    with torch.no_grad():
+        for key, value in load_peft_weights(path, device="cpu").items():
+            target = re.sub(r"\.(lora_[AB])\.", rf".\1.{name}.", key)
+            if target not in params or params[target].shape != value.shape:
+                raise ValueError(f"Веса адаптера '{name}' не подходят к подключенному адаптеру ({key}); "
+                                 f"перезапустите бота, чтобы подключить его заново")
+            params[target].copy_(value)
+
+
+def _attach_adapters(loaded_model, names):
+    """Подключает (или заново читает с диска) LoRA адаптеры из LORA_ADAPTERS.
+
+    Все адаптеры висят на одной базовой модели под своими именами, активный
+    выбирается перед генерацией (_use_adapter). Повторная загрузка адаптера
+    под тем же именем заменяет его веса на месте. Возвращает модель (при
+    первом адаптере она оборачивается в PeftModel) и список загруженных имен.
+    """
+    loaded = []
+    for name in names:
+        path = LORA_ADAPTERS[name]
+        if not os.path.isdir(path):
+            logging.warning(f"Папка LoRA адаптера '{name}' не найдена по пути: {path}. Адаптер пропущен.")
+            continue
+        logging.info(f"Загрузка LoRA адаптера '{name}' из: {path}")
+        if _cpu_quantized:
+            # Новый адаптер не обернуть вокруг квантизованного слоя, а подключенный можно перечитать
+            if name not in adapters:
+                logging.warning(f"LoRA адаптер '{name}' нельзя подключить к уже квантизованной модели, "
+                                f"перезапустите бота.")
+                continue
+            _copy_adapter_weights(loaded_model, name, path)
+        elif isinstance(loaded_model, PeftModel):
+            loaded_model.load_adapter(path, adapter_name=name)
+        else:
+            loaded_model = PeftModel.from_pretrained(loaded_model, path, adapter_name=name)
+        adapters[name] = path
+        loaded.append(name)
+    return loaded_model, loaded
+
+
+@contextmanager
+def _use_adapter(name):
+    """Включает адаптер name на время генерации; None - базовая модель без адаптеров."""
+    if not adapters:
+        yield
+    elif name is None:
+        with model.disable_adapter():
+            yield
+    else:
+        model.set_adapter(name)
+        yield
+
+
+# --- Функция загрузки модели ---
+def load_llm():
+    """Загружает базовую модель, LoRA адаптеры и токенизатор.
+
+    Блокирующая: from_pretrained 7B модели занимает минуты, поэтому
+    вызывается из фонового потока (см. model_loader.ModelLoader).
+    """
+    global model, tokenizer, kv_cache, _cpu_quantized
+    if is_loaded():
+        logging.info("Модель уже загружена.")
+        return
+
+    device = resolve_device()
+    logging.info(f"Начало загрузки LLM (устройство: {device})...")
+    started_at = time.perf_counter()
+    try:
+        manifest = read_artifact_manifest(MODEL_ARTIFACT_DIR) if MODEL_ARTIFACT_DIR else None
+        if device == "cpu":
+            threads = configure_cpu_threads()
+            logging.info(f"Генерация на CPU в {threads} потоков.")
+            loaded_model, tokenizer_source = _load_cpu_model(manifest)
+        elif manifest:
+            # Готовый чекпоинт уже слит с адаптером и квантизован (см. build_artifact.py),
+            # настройки квантизации берутся из его config.json
+            logging.info(f"Загрузка готового артефакта модели: {MODEL_ARTIFACT_DIR} "
+                         f"(хэш {manifest['content_hash'][:12]}, база {manifest['base_model']}, "
+                         f"адаптер {manifest['adapter'] or 'нет'})")
+            loaded_model = AutoModelForCausalLM.from_pretrained(
+                MODEL_ARTIFACT_DIR,
+                device_map="auto",
+                torch_dtype="auto"
+            )
+            tokenizer_source = MODEL_ARTIFACT_DIR
+        else:
+            logging.info(f"Артефакт модели не найден ({MODEL_ARTIFACT_DIR}), квантизуем базовую модель при загрузке.")
+            loaded_model = _load_base_model()
+            tokenizer_source = base_model_name
+        loaded_model, _ = _attach_adapters(loaded_model, list(LORA_ADAPTERS))
+        if adapters:
+            logging.info(f"Подключены LoRA адаптеры: {', '.join(adapters)}.")
+        else:
+            logging.info("LoRA адаптеры не подключены. Используется базовая модель Saiga.")
+        if device == "cpu" and CPU_QUANTIZATION == "int8":
+            loaded_model = quantize_for_cpu(loaded_model)
+            _cpu_quantized = True
+            logging.info("Линейные слои квантизованы в int8 для CPU.")
+        loaded_model.eval()
+        logging.info(f"Модель загружена за {time.perf_counter() - started_at:.1f} с.")
+
+        loaded_tokenizer = AutoTokenizer.from_pretrained(tokenizer_source, trust_remote_code=True)
+        loaded_tokenizer.pad_token = loaded_tokenizer.eos_token # Установка pad_token
+        # Для батчевой генерации decoder-only модели промпты дополняются слева,
+        # чтобы у всех строк батча ответ начинался с одной позиции
+        loaded_tokenizer.padding_side = "left"
+        logging.info("Токенизатор загружен.")
+
+        if KV_CACHE_MAX_MB:
+            kv_cache = KVCacheStore(max_bytes=KV_CACHE_MAX_MB * 1024 * 1024)
+            logging.info(f"KV-кэш диалогов включен, бюджет {KV_CACHE_MAX_MB} МБ.")
+        model, tokenizer = loaded_model, loaded_tokenizer
+        prepare_generation()
+        if DRAFT_MODEL:
+            load_draft_model(DRAFT_MODEL)
+        logging.info(f"Модель готова к генерации (загрузка заняла {time.perf_counter() - started_at:.1f} с).")
+
+    except Exception as e:
+        logging.error(f"Ошибка при загрузке LLM: {e}", exc_info=True)
+        model, tokenizer = None, None # Оставляем None в случае ошибки
+
+
+class _CallCounter:
+    """Forward hook, считающий проходы модели."""
+
+    def __init__(self, module):
+        self.calls = 0
+        module.register_forward_hook(self)
+
+    def __call__(self, module, args, output):
+        self.calls += 1
+
+
+def load_draft_model(path: str) -> bool:
+    """Подключает модель-черновик для спекулятивного декодирования.
+
+    Черновик должен использовать тот же словарь, что и основная модель
+    (предложенные токены сравниваются по id). Если загрузить его не
+    удалось, генерация остается обычной. Возвращает, подключен ли черновик.
+    """
+    global draft_model, _draft_calls, _main_calls
+    started_at = time.perf_counter()
+    try:
+        draft_tokenizer = AutoTokenizer.from_pretrained(path)
+        if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            logging.warning(f"Словарь модели-черновика {path} отличается от основной модели, "
+                            f"спекулятивное декодирование выключено.")
+            return False
+        loaded = AutoModelForCausalLM.from_pretrained(path, torch_dtype="auto").to(model.device).eval()
+    except Exception as e:
+        logging.error(f"Не удалось загрузить модель-черновик {path}, генерация без нее: {e}", exc_info=True)
+        return False
+    loaded.generation_config.num_assistant_tokens = DRAFT_TOKENS
+    _draft_calls = _CallCounter(loaded)
+    # У PeftModel проходы идут через базовую модель, она же остается при перезагрузке адаптеров
+    _main_calls = _CallCounter(model.get_base_model() if hasattr(model, "get_base_model") else model)
+    draft_model = loaded
+    logging.info(f"Модель-черновик {path} загружена за {time.perf_counter() - started_at:.1f} с, "
+                 f"{DRAFT_TOKENS} токенов за шаг.")
+    return True
+
+
+def _use_draft(batch_size: int) -> bool:
+    """Генерировать ли с черновиком. Он работает только на батче из одного запроса
+    (в большом батче декодирование и так дешевле на токен) и пропускается, пока доля
+    принятых токенов низкая."""
+    global _draft_skipped
+    if draft_model is None:
+        return False
+    if batch_size != 1:
+        metrics.speculative_fallbacks.inc()
+        return False
+    if _draft_acceptance is not None and _draft_acceptance < DRAFT_MIN_ACCEPTANCE:
+        _draft_skipped += 1
+        if _draft_skipped < DRAFT_PROBE_INTERVAL:
+            metrics.speculative_fallbacks.inc()
+            return False
+    _draft_skipped = 0
+    return True
+
+
+def _disable_draft(error: Exception):
+    global draft_model
+    draft_model = None
+    logging.error(f"Спекулятивное декодирование не удалось, черновик отключен: {error}", exc_info=error)
+
+
+def _record_draft_acceptance(main_calls: int, draft_calls: int, generated: int):
+    """Каждый проход основной модели принимает часть токенов черновика и добавляет один свой."""
+    global _draft_acceptance
+    if not draft_calls:
+        return
+    accepted = max(0, min(generated - main_calls, draft_calls))
+    metrics.draft_tokens.inc(draft_calls)
+    metrics.draft_accepted_tokens.inc(accepted)
+    acceptance = accepted / draft_calls
+    _draft_acceptance = acceptance if _draft_acceptance is None else 0.8 * _draft_acceptance + 0.2 * acceptance
+    metrics.draft_acceptance_rate.set(_draft_acceptance)
+
+
+def _prefill_system_prefix(adapter):
+    with torch.no_grad(), _use_adapter(adapter):
+        past = model(torch.tensor([system_prefix_ids], device=model.device), use_cache=True).past_key_values
+    if hasattr(past, "to_legacy_cache"):
+        past = past.to_legacy_cache()
+    system_prefix_past[adapter] = past
+
+
+def prepare_generation():
+    """Готовит все, что не зависит от запроса: профиль генерации и системный префикс."""
+    global generation_profile
+    generation_profile = GenerationProfile(tokenizer, model.device)
+    prepare_system_prefix()
+
+
+def prepare_system_prefix():
+    """Один раз токенизирует SYSTEM_PREFIX и считает для него состояние внимания.
+
+    LoRA меняет проекции ключей и значений, поэтому состояние считается
+    отдельно для базовой модели и для каждого адаптера.
+    """
+    global system_prefix_ids, response_template_ids, _split_tokenization
+    ids = tokenizer(SYSTEM_PREFIX, add_special_tokens=False)["input_ids"]
+    system_prefix_ids = ids
+    system_prefix_past.clear()
+    for adapter in [None, *adapters]:
+        _prefill_system_prefix(adapter)
+    response_template_ids = tokenizer(RESPONSE_TEMPLATE, add_special_tokens=False)["input_ids"]
+
+    # Каждое сообщение заканчивается спецтокеном </s>, поэтому обычно
+    # сообщения токенизируются независимо друг от друга. Проверяем на примере,
+    # а если токенизатор склеивает границы иначе, токенизируем промпт целиком
+    sample = [("user", "Привет!"), ("bot", "Здравствуй, путник."), ("user", "Что дальше?")]
+    whole = tokenizer(build_prompt_text(sample), add_special_tokens=False)["input_ids"]
+    split = list(ids)
+    for role, content in sample:
+        split.extend(tokenize_message(role, content))
+    split.extend(response_template_ids)
+    _split_tokenization = whole == split
+    logging.info(f"Системный префикс предпосчитан: {len(ids)} токенов, "
+                 f"раздельная токенизация {'включена' if _split_tokenization else 'выключена'}.")
+
+
+def reload_adapters(names=None) -> list:
+    """Заново читает с диска веса адаптеров names (по умолчанию всех из LORA_ADAPTERS).
+
+    Адаптер из LORA_ADAPTERS, который не удалось подключить при загрузке
+    (например, его папки еще не было), подключается. Состояние внимания
+    системного префикса пересчитывается, а KV-кэш чатов этих адаптеров
+    сбрасывается. Блокирующая и меняет веса модели, поэтому вызывается
+    только между генерациями (InferenceWorker.run_exclusive). Возвращает
+    имена перезагруженных адаптеров.
+    """
+    global model
+    names = list(LORA_ADAPTERS) if names is None else names
+    unknown = [name for name in names if name not in LORA_ADAPTERS]
+    if unknown:
+        raise ValueError(f"Адаптеры не описаны в LORA_ADAPTERS: {', '.join(unknown)}")
+    started_at = time.perf_counter()
+    model, loaded = _attach_adapters(model, names)
+    model.eval()
+    for name in loaded:
+        _prefill_system_prefix(name)
+    if kv_cache is not None:
+        kv_cache.invalidate_matching(lambda key: key[1] in loaded)
+    logging.info(f"LoRA адаптеры перезагружены за {time.perf_counter() - started_at:.1f} с: {', '.join(loaded) or 'нет'}.")
+    return loaded
+
+
+def tokenize_message(role: str, content: str) -> list:
+    """Токены одного сообщения в формате промпта Saiga."""
+    # Промпты уже содержат <s>, поэтому спецтокены не добавляем (как и pipeline)
+    return tokenizer(MESSAGE_TEMPLATE.format(role=role, content=content), add_special_tokens=False)["input_ids"]
+
+
+def build_prompt_text(messages) -> str:
+    """Собирает текст промпта из пар (роль, текст)."""
+    parts = [SYSTEM_PREFIX]
+    parts.extend(MESSAGE_TEMPLATE.format(role=role, content=content) for role, content in messages)
+    # Добавляем маркер для ответа бота
+    parts.append(RESPONSE_TEMPLATE)
+    return "".join(parts) # Соединяем без дополнительных переносов строки
+
+
+def build_prompt(turns: list, rules: list = None):
+    """Собирает промпт из ходов истории (conversation.Turn).
+
+    Возвращает (текст промпта, токены промпта). Токены склеиваются из уже
+    посчитанных токенов сообщений без повторной токенизации; если
+    раздельная токенизация не совпадает с цельной, вместо них None.
+
+    Найденные выдержки из правил (rules) добавляются системным сообщением
+    после последнего сообщения. В историю они не попадают, поэтому в
+    следующем промпте KV-кэш чата переиспользуется вплоть до этого места.
+    """
+    messages = [(turn.role, turn.content) for turn in turns]
+    rules_message = None
+    if rules:
+        rules_message = ("system", "\n\n".join([RULES_HEADER, *rules]))
+        messages.append(rules_message)
+    prompt = build_prompt_text(messages)
+    if not _split_tokenization:
+        return prompt, None
+    ids = list(system_prefix_ids)
+    for turn in turns:
+        ids.extend(turn.token_ids)
+    if rules_message is not None:
+        ids.extend(tokenize_message(*rules_message))
+    ids.extend(response_template_ids)
+    return prompt, ids
+
+
+def tokenize_prompt(prompt: str) -> list:
+    """Токенизирует промпт, не токенизируя заново общий системный префикс."""
+    if _split_tokenization and prompt.startswith(SYSTEM_PREFIX):
+        return system_prefix_ids + tokenizer(prompt[len(SYSTEM_PREFIX):], add_special_tokens=False)["input_ids"]
+    return tokenizer(prompt, add_special_tokens=False)["input_ids"]
+
+
+def clean_response(generated_response: str) -> str:
+    """Обрезает ответ модели по стоп-токенам и убирает служебные хвосты."""
+    generated_response = generated_response.strip()
+    # Логируем ответ ДО финальной очистки
+    logging.debug(f"Ответ модели до очистки спец.токенов: {generated_response}")
+
+    # --- Улучшенная очистка ответа ---
+    # 1. Убираем все после первого </s> или <|im_end|>
+    #    (Saiga может использовать и то, и другое, возьмем то, что раньше)
+    first_stop = _STOP_PATTERN.search(generated_response)
+    if first_stop is not None:
+        generated_response = generated_response[:first_stop.start()].strip()
+
+    # 2. Дополнительно убираем стандартный eos_token, если он вдруг остался
+    if tokenizer.eos_token and generated_response.endswith(tokenizer.eos_token):
+         generated_response = generated_response[:-len(tokenizer.eos_token)].strip()
+
+    # 3. Убираем слово "bot" из конца строки, если оно там есть
+    if generated_response.endswith(" bot"):
+        generated_response = generated_response[:-len(" bot")]
+
+    return generated_response
+
+
+def trim_partial_response(text: str):
+    """Возвращает (видимая часть, встречен ли стоп) для еще не законченного ответа.
+
+    Текст обрезается по первой стоп-строке. Если стопа еще нет, хвост, который
+    может оказаться началом стоп-строки (например "</" или "<|im"), и
+    недекодированные байты UTF-8 придерживаются до следующих токенов.
+    """
+    first_stop = _STOP_PATTERN.search(text)
+    if first_stop is not None:
+        return text[:first_stop.start()].strip(), True
+
+    held = 0
+    for token in STOP_STRINGS:
+        for size in range(min(len(token) - 1, len(text)), held, -1):
+            if text.endswith(token[:size]):
+                held = size
+                break
+    visible = text[:len(text) - held].rstrip("\ufffd")
+    return visible.strip(), False
+
+
+class StopOnSequences(StoppingCriteria):
+    """Останавливает строку батча, как только ее новые токены закончились одной из последовательностей."""
+
+    def __init__(self, sequences: list, prompt_length: int):
+        self.sequences = sequences
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        generated = input_ids.shape[1] - self.prompt_length
+        for sequence in self.sequences:
+            if len(sequence) <= generated:
+                done |= (input_ids[:, -len(sequence):] == sequence).all(dim=1)
+        return done
+
+
+class GenerationProfile:
+    """Все, что model.generate нужно от токенизатора, посчитанное один раз при загрузке.
+
+    Ответ заканчивается на любом из стоп-токенов (одиночные токены STOP_STRINGS
+    передаются в generate как eos_token_id) или на последовательности токенов:
+    стоп-строке, которая не является одним токеном, либо заголовке следующего
+    сообщения ("<s>bot" и т.п.). Так генерация строки прекращается сразу, а не
+    после MAX_NEW_TOKENS токенов с последующей обрезкой текста.
+    """
+
+    def __init__(self, tokenizer, device):
+        self.stop_token_ids = []
+        sequences = []
+        for stop_string in STOP_STRINGS:
+            token_id = tokenizer.convert_tokens_to_ids(stop_string)
+            # Отсутствующий в словаре токен многие токенизаторы превращают в unk, а не в ошибку
+            if token_id is not None and token_id != tokenizer.unk_token_id:
+                self.stop_token_ids.append(token_id)
+            else:
+                sequences.append(tokenizer(stop_string, add_special_tokens=False)["input_ids"])
+        for role in TURN_ROLES:
+            sequences.append(tokenizer(MESSAGE_TEMPLATE.format(role=role, content="").split("\n")[0],
+                                       add_special_tokens=False)["input_ids"])
+        if not self.stop_token_ids:
+            self.stop_token_ids.append(tokenizer.eos_token_id)
+            logging.warning(f"Стоп-токены не найдены в словаре, используем eos_token_id ({tokenizer.eos_token_id}).")
+        # Стандартный EOS ID для padding
+        self.pad_token_id = tokenizer.eos_token_id
+        if self.pad_token_id is None: # На случай если у токенизатора совсем нет eos_token
+            self.pad_token_id = tokenizer.pad_token_id
+        # Последовательности, начинающиеся со стоп-токена, уже покрыты eos_token_id
+        self.stop_sequences = [torch.tensor(ids, device=device) for ids in sequences
+                               if ids and ids[0] not in self.stop_token_ids]
+        self._stop_sequence_lists = [sequence.tolist() for sequence in self.stop_sequences]
+        self._stop_set = set(self.stop_token_ids) | {self.pad_token_id}
+        self.max_new_tokens = MAX_NEW_TOKENS
+        self.sampling = dict(SAMPLING_SETTINGS)
+        logging.info(f"Профиль генерации: стоп-токены {self.stop_token_ids}, "
+                     f"стоп-последовательностей {len(self.stop_sequences)}.")
+
+    def generate_kwargs(self, prompt_length: int) -> dict:
+        """Аргументы model.generate для входа длины prompt_length."""
+        kwargs = dict(self.sampling, max_new_tokens=self.max_new_tokens, eos_token_id=self.stop_token_ids,
+                      pad_token_id=self.pad_token_id)
+        if self.stop_sequences:
+            kwargs["stopping_criteria"] = StoppingCriteriaList([StopOnSequences(self.stop_sequences, prompt_length)])
+        return kwargs
+
+    def answer_length(self, token_ids: list):
+        """(длина ответа без стопа, длина вместе со стоп-токеном или последовательностью) для новых токенов строки."""
+        for n, token_id in enumerate(token_ids):
+            if token_id in self._stop_set:
+                return n, n + 1
+            for sequence in self._stop_sequence_lists:
+                if token_ids[n:n + len(sequence)] == sequence:
+                    return n, n + len(sequence)
+        return len(token_ids), len(token_ids)
+
+
+class BatchTextStreamer(BaseStreamer):
+    """Передает частично сгенерированный текст каждой строки батча в ее колбэк.
+
+    model.generate вызывает put() сначала с промптом, затем с новым токеном
+    для каждой строки батча на каждом шаге. Колбэк строки вызывается только
+    когда ее видимый текст изменился, и больше не вызывается после стопа.
+    """
+
+    def __init__(self, tokenizer, callbacks: list):
+        self.tokenizer = tokenizer
+        self.callbacks = callbacks
+        self.token_ids = [[] for _ in callbacks]
+        self.finished = [callback is None for callback in callbacks]
+        self.last_text = ["" for _ in callbacks]
+        self.prompt_skipped = False
+
+    def put(self, value):
+        if not self.prompt_skipped: # Первый вызов - это промпт
+            self.prompt_skipped = True
+            return
+        # Обычно приходит по токену на строку, при спекулятивном декодировании - сразу несколько
+        for i, new_ids in enumerate(value.reshape(len(self.callbacks), -1).tolist()):
+            if self.finished[i]:
+                continue
+            self.token_ids[i].extend(new_ids)
+            # Спецтокены не пропускаем, чтобы </s> и <|im_end|> были видны как стоп
+            text = self.tokenizer.decode(self.token_ids[i], skip_special_tokens=False)
+            visible, stopped = trim_partial_response(text)
+            self.finished[i] = stopped
+            if visible != self.last_text[i]:
+                self.last_text[i] = visible
+                self.callbacks[i](visible)
+
+    def end(self):
+        pass
+
+
+class GenerationTimer(BaseStreamer):
+    """Засекает появление первого нового токена, чтобы разделить время prefill и декодирования.
+
+    Вызовы put() и end() передаются дальше в streamer, если он задан.
+    """
+
+    def __init__(self, streamer=None):
+        self.streamer = streamer
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen: # Первый вызов - это промпт
+            self._prompt_seen = True
+        elif self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if self.streamer is not None:
+            self.streamer.put(value)
+
+    def end(self):
+        if self.streamer is not None:
+            self.streamer.end()
+
+
+def _record_generation_metrics(timer: GenerationTimer, finished_at: float, generated: int):
+    first_token_at = timer.first_token_at or finished_at
+    metrics.prefill_seconds.observe(first_token_at - timer.started_at)
+    metrics.decode_seconds.observe(finished_at - first_token_at)
+    metrics.generated_tokens.inc(generated)
+    if finished_at > timer.started_at:
+        metrics.tokens_per_second.set(generated / (finished_at - timer.started_at))
+    if kv_cache is not None:
+        metrics.kv_cache_bytes.set(kv_cache.total_bytes)
+    if torch.cuda.is_available():
+        metrics.gpu_memory_allocated_bytes.set(torch.cuda.memory_allocated())
+        metrics.gpu_memory_reserved_bytes.set(torch.cuda.memory_reserved())
+        metrics.gpu_memory_peak_bytes.set(torch.cuda.max_memory_allocated())
+
+
+def _left_pad_past(past, length: int, template):
+    """Дополняет past_key_values одной строки нулями слева до length позиций."""
+    padded = []
+    for layer, (template_key, template_value) in enumerate(template):
+        if past is None:
+            key = template_key.new_zeros(1, template_key.shape[1], length, template_key.shape[3])
+            value = template_value.new_zeros(1, template_value.shape[1], length, template_value.shape[3])
+        else:
+            key, value = past[layer]
+            missing = length - key.shape[2]
+            if missing:
+                key = torch.cat([key.new_zeros(1, key.shape[1], missing, key.shape[3]), key], dim=2)
+                value = torch.cat([value.new_zeros(1, value.shape[1], missing, value.shape[3]), value], dim=2)
+        padded.append((key, value))
+    return padded
+
+
+def _build_batch_inputs(token_ids: list, cached: list, pad_token_id: int):
+    """Собирает вход батча с учетом уже посчитанных префиксов.
+
+    Строка i выглядит как [паддинг | кэшированный префикс | паддинг | новые токены].
+    Паддинг закрыт маской внимания, а позиции модель считает по маске, поэтому
+    кэшированные префиксы разной длины и новые части разной длины
+    складываются в один батч. Без кэша это обычный левый паддинг.
+    """
+    cached_length = max(length for length, _ in cached)
+    delta_length = max(len(ids) - length for ids, (length, _) in zip(token_ids, cached))
+    total_length = cached_length + delta_length
+    input_ids = torch.full((len(token_ids), total_length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros_like(input_ids)
+    for i, (ids, (length, _)) in enumerate(zip(token_ids, cached)):
+        if length:
+            input_ids[i, cached_length - length:cached_length] = torch.tensor(ids[:length])
+            attention_mask[i, cached_length - length:cached_length] = 1
+        delta = ids[length:]
+        input_ids[i, total_length - len(delta):] = torch.tensor(delta)
+        attention_mask[i, total_length - len(delta):] = 1
+
+    past = None
+    if cached_length:
+        template = next(row_past for _, row_past in cached if row_past is not None)
+        rows = [_left_pad_past(row_past, cached_length, template) for _, row_past in cached]
+        past = tuple(
+            (torch.cat([row[layer][0] for row in rows]), torch.cat([row[layer][1] for row in rows]))
+            for layer in range(len(template))
+        )
+    return input_ids.to(model.device), attention_mask.to(model.device), past
+
+
+def _store_kv_caches(requests: list, token_ids: list, attention_mask, generated_rows: list, past):
+    """Сохраняет в kv_cache состояние внимания каждой строки батча без паддинга.
+
+    Кроме промпта сохраняются и сгенерированные токены строки (generated_rows,
+    до стопа включительно): следующий промпт чата начинается с этого же ответа.
+    """
+    if hasattr(past, "to_legacy_cache"):
+        past = past.to_legacy_cache()
+    prompt_length = attention_mask.shape[1]
+    # Для последнего сгенерированного токена состояние не считалось
+    generated_in_cache = past[0][0].shape[2] - prompt_length
+    for i, request in enumerate(requests):
+        if request.chat_id is None:
+            continue
+        generated = generated_rows[i][:generated_in_cache]
+        positions = torch.cat([
+            attention_mask[i].nonzero().squeeze(-1),
+            torch.arange(prompt_length, prompt_length + len(generated), device=attention_mask.device),
+        ])
+        row_past = tuple((key[i:i + 1].index_select(2, positions), value[i:i + 1].index_select(2, positions))
+                         for key, value in past)
+        kv_cache.put((request.chat_id, request.adapter), token_ids[i] + generated, row_past)
+
+
+def _cached_prefix(request, ids: list):
+    """Находит самый длинный уже посчитанный префикс промпта: из кэша чата или системный."""
+    length, past = 0, None
+    if kv_cache is not None and request.chat_id is not None:
+        length, past = kv_cache.get((request.chat_id, request.adapter), ids)
+    prefix_length = len(system_prefix_ids) if system_prefix_ids is not None else 0
+    if length < prefix_length < len(ids) and ids[:prefix_length] == system_prefix_ids:
+        length, past = prefix_length, system_prefix_past[request.adapter]
+    return length, past
+
+
+def _generate(requests: list, input_ids, attention_mask, past, adapter, speculative: bool):
+    """Один вызов model.generate; возвращает (выход, GenerationTimer или None, время окончания)."""
+    streamer = None
+    callbacks = [request.on_text for request in requests]
+    if any(callback is not None for callback in callbacks):
+        streamer = BatchTextStreamer(tokenizer, callbacks)
+    timer = None
+    if metrics.enabled:
+        streamer = timer = GenerationTimer(streamer)
+    kwargs = generation_profile.generate_kwargs(input_ids.shape[1])
+    if speculative:
+        # Черновик предлагает несколько токенов, основная модель проверяет их за один проход
+        kwargs["assistant_model"] = draft_model
+        _main_calls.calls = _draft_calls.calls = 0
+    with torch.no_grad(), _use_adapter(adapter):
+        output = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=past,
+            streamer=streamer,
+            return_dict_in_generate=True,
+            **kwargs
+        )
+    return output, timer, time.perf_counter()
+
+
+def generate_batch(requests: list) -> list:
+    """Генерирует ответы на несколько запросов (GenerationRequest) одним вызовом model.generate.
+
+    Блокирующая, выполняется в потоке InferenceWorker. Возвращает очищенные
+    ответы в том же порядке, что и requests. on_text запроса, если задан,
+    вызывается из этого же потока с уже видимой частью ответа по мере
+    генерации. Для чатов с сохраненным KV-кэшем заново считаются только
+    токены, которых не было в прошлом промпте, для остальных - все, кроме
+    общего системного префикса; при генерации с черновиком промпт считается
+    целиком. Все запросы батча должны использовать один и тот же адаптер
+    (InferenceWorker группирует их по адаптеру).
+    """
+    adapter = requests[0].adapter
+    if any(request.adapter != adapter for request in requests):
+        raise ValueError("В одном батче запросы к разным адаптерам")
+    if adapter is not None and adapter not in adapters:
+        raise ValueError(f"LoRA адаптер '{adapter}' не подключен")
+    logging.info(f"Генерация ответа (батч из {len(requests)}, адаптер {adapter or 'нет'})...")
+
+    profile = generation_profile
+    token_ids = [request.token_ids or tokenize_prompt(request.prompt) for request in requests]
+    speculative = _use_draft(len(requests))
+    if speculative:
+        # generate копирует переданный кэш основной модели в черновик, а размеры его состояния
+        # внимания другие: с черновиком промпт считается целиком
+        cached = [(0, None) for _ in requests]
+    else:
+        cached = [_cached_prefix(request, ids) for request, ids in zip(requests, token_ids)]
+    reused = sum(length for length, _ in cached)
+    if reused:
+        logging.info(f"KV-кэш: переиспользовано {reused} из {sum(map(len, token_ids))} токенов промптов.")
+    input_ids, attention_mask, past = _build_batch_inputs(token_ids, cached, profile.pad_token_id)
+
+    try:
+        output, timer, finished_at = _generate(requests, input_ids, attention_mask, past, adapter, speculative)
+    except Exception as e:
+        if not speculative:
+            raise
+        # Черновик не должен ломать ответы: отключаем его и генерируем как обычно
+        _disable_draft(e)
+        speculative = False
+        output, timer, finished_at = _generate(requests, input_ids, attention_mask, past, adapter, speculative)
+
+    # Сгенерированная часть у всех строк начинается сразу после общей длины входа;
+    # ответ строки обрезается по стопу уже на уровне токенов
+    new_tokens = output.sequences[:, input_ids.shape[1]:].tolist()
+    lengths = [profile.answer_length(row) for row in new_tokens]
+    if kv_cache is not None:
+        _store_kv_caches(requests, token_ids, attention_mask,
+                         [row[:with_stop] for row, (_, with_stop) in zip(new_tokens, lengths)], output.past_key_values)
+    if timer is not None:
+        _record_generation_metrics(timer, finished_at, sum(with_stop for _, with_stop in lengths))
+    if speculative:
+        _record_draft_acceptance(_main_calls.calls, _draft_calls.calls, lengths[0][1])
+    with metrics.span(metrics.postprocess_seconds):
+        raw_responses = tokenizer.batch_decode([row[:length] for row, (length, _) in zip(new_tokens, lengths)],
+                                               skip_special_tokens=True)
+        return [clean_response(raw_response) for raw_response in raw_responses]
@@ -1,112 +1,53 @@
-from aiogram import Bot, Dispatcher, F
-from aiogram.filters.command import Command
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters.command import Command, CommandObject
 from aiogram.types import ReplyKeyboardRemove, KeyboardButton, Message, ReplyKeyboardMarkup
-from config import BOT_TOKEN
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from backend import LocalBackend, ModelNotReady
+from config import (ADMIN_IDS, BOT_MODE, BOT_TOKEN, INFERENCE_SERVER_URL, INFERENCE_TIMEOUT,
+                    MESSAGE_COALESCE_WINDOW, METRICS_ENABLED, METRICS_PORT, RAG_MIN_SCORE, RAG_TOP_K, RATE_LIMIT_BURST, RATE_LIMIT_PER_MINUTE,
+                    RESPONSE_CACHE_SIMILARITY, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RULES_INDEX_DIR,
+                    STREAM_EDIT_INTERVAL, STREAMING_REPLIES, TELEGRAM_API_URL, WEBHOOK_HOST, WEBHOOK_PATH,
+                    WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL)
+from inference import InferenceQueueFull, RequestSuperseded
+from inference_client import RemoteBackend
+from model_loader import FAILED, READY
+from response_cache import ResponseCache, is_rules_question
+from rules_index import RulesIndex
+from streaming import StreamingReply
+from throttling import MessageCoalescer, RateLimitMiddleware
+import metrics
 import logging
 import asyncio
-import json
-import os  # Добавим os для работы с путями
-import torch  # Добавим torch
-from peft import PeftModel
-from transformers import (AutoModelForCausalLM, AutoTokenizer,
-                          BitsAndBytesConfig, pipeline)
-from huggingface_hub import login # Добавим login
 
 
 logging.basicConfig(level=logging.INFO)
-bot = Bot(token=BOT_TOKEN)
+metrics.enabled = METRICS_ENABLED
+bot = Bot(token=BOT_TOKEN,
+          session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None)
 dp = Dispatcher()
-
-# --- Авторизация в Hugging Face Hub ---
-try:
-    hf_token = os.getenv("HF_TOKEN")
-    if not hf_token:
-        logging.warning("Переменная окружения HF_TOKEN не установлена. Загрузка некоторых моделей может не работать.")
-    else:
-        login(token=hf_token)
-        logging.info("Успешная авторизация в Hugging Face Hub.")
-except Exception as e:
-    logging.error(f"Ошибка авторизации в Hugging Face Hub: {e}")
-
-# --- Конфигурация модели ---
-base_model_name = "IlyaGusev/saiga_mistral_7b_lora"
-# Используем относительный путь, предполагая запуск из корня проекта
-adapter_path = "AI-part/saiga_mistral_dnd_lora_colab"
-
-# Глобальные переменные для модели и генератора
-llm_pipeline = None
-# Словарь для хранения истории диалогов (ключ: chat_id, значение: список сообщений)
-conversation_history = {}
-MAX_HISTORY_TURNS = 5 # Хранить примерно 5 последних пар "вопрос-ответ"
-
-# --- Функция загрузки модели ---
-async def load_llm():
-    """Загружает базовую модель, адаптер и создает pipeline."""
-    global llm_pipeline
-    if llm_pipeline:
-        logging.info("Модель уже загружена.")
-        return
-
-    logging.info("Начало загрузки LLM...")
-    try:
-        # Конфигурация для 4-битной загрузки (Возвращено)
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.bfloat16,
-            bnb_4bit_use_double_quant=False,
-        )
-
-        logging.info(f"Загрузка базовой модели: {base_model_name}")
-        # Возвращен параметр quantization_config=bnb_config
-        # Убран параметр offload_folder
-        model = AutoModelForCausalLM.from_pretrained(
-            base_model_name,
-            quantization_config=bnb_config, # <-- Возвращено
-            device_map="auto",  # Автоматический выбор устройства (GPU/CPU)
-            # offload_folder="offload", # <-- Убрано
-            trust_remote_code=True,
-            torch_dtype=torch.bfloat16 # Оставляем, т.к. используется в bnb_config
-        )
-        logging.info("Базовая модель загружена.")
-
-        tokenizer = AutoTokenizer.from_pretrained(base_model_name, trust_remote_code=True)
-        tokenizer.pad_token = tokenizer.eos_token # Установка pad_token
-        tokenizer.padding_side = "right"
-        logging.info("Токенизатор загружен.")
-
-        # --- Загрузка адаптера D&D (ВРЕМЕННО ОТКЛЮЧЕНО ДЛЯ ТЕСТА) ---
-        # Проверяем и загружаем адаптер, используя абсолютный путь
-        # if os.path.exists(absolute_adapter_path) and os.path.isdir(absolute_adapter_path):
-        #     logging.info(f"Загрузка LoRA адаптера из: {absolute_adapter_path}")
-        #     model = PeftModel.from_pretrained(model, absolute_adapter_path) # <-- Используем абсолютный путь
-        #     logging.info("LoRA адаптер применен.")
-        #     # Опционально: слияние адаптера для ускорения инференса (Закомментировано по запросу)
-        #     # try:
-        #     #     logging.info("Попытка слияния адаптера...")
-        #     #     model = model.merge_and_unload()
-        #     #     logging.info("Адаптер успешно слит с базовой моделью.")
-        #     # except Exception as merge_exc:
-        #     #     logging.warning(f"Не удалось слить адаптер: {merge_exc}. Используем модель без слияния.")
-        # else:
-        #     logging.warning(f"Папка с адаптером не найдена по пути: {absolute_adapter_path}. Используется базовая модель Saiga.") # Используем абсолютный путь в логе
-        logging.info("ЗАГРУЗКА АДАПТЕРА D&D ОТКЛЮЧЕНА. Используется базовая модель Saiga.") # Добавим лог
-        # ----------------------------------------------------------------
-
-        # Создаем pipeline для генерации текста
-        # Pipeline будет использовать модель БЕЗ D&D адаптера
-        llm_pipeline = pipeline(
-            "text-generation",
-            model=model,
-            tokenizer=tokenizer,
-            torch_dtype=torch.bfloat16, # Тип данных для вычислений
-            device_map="auto"
-        )
-        logging.info("Pipeline для генерации текста создан.")
-
-    except Exception as e:
-        logging.error(f"Ошибка при загрузке LLM: {e}", exc_info=True)
-        llm_pipeline = None # Оставляем None в случае ошибки
+# Сообщения, на которые отвечает модель. Роутер подключается после команд и кнопок,
+# и только его сообщения ограничены по частоте: один игрок не должен забивать
+# очередь генерации, а /start или /mode генерацию не запускают
+llm_router = Router()
+llm_router.message.middleware(RateLimitMiddleware(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST, exempt=ADMIN_IDS))
+dp.include_router(llm_router)
+# Модель, история диалогов и очередь генерации: в этом процессе или на отдельном сервере инференса
+backend = RemoteBackend(INFERENCE_SERVER_URL, INFERENCE_TIMEOUT) if INFERENCE_SERVER_URL else LocalBackend()
+# Выдержки из правил для промпта; индекс загружается при первом поиске
+rules_index = RulesIndex(RULES_INDEX_DIR) if RAG_TOP_K else None
+# Готовые ответы на частые вопросы о правилах
+response_cache = (ResponseCache(RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, similarity=RESPONSE_CACHE_SIMILARITY)
+                  if RESPONSE_CACHE_SIZE else None)
+message_coalescer = MessageCoalescer(MESSAGE_COALESCE_WINDOW)
+
+
+@dp.update.outer_middleware()
+async def measure_update(handler, event, data):
+    with metrics.span(metrics.update_seconds):
+        return await handler(event, data)
 
 
 @dp.message(Command("start"))
@@ -117,6 +58,44 @@ async def process_start_command(msg: Message):
     await msg.reply("Здарова, го в днд", reply_markup=keyboard)
 
 
+@dp.message(Command("mode"))
+async def process_mode_command(msg: Message, command: CommandObject):
+    """/mode - показать режимы, /mode <имя> - отвечать в этом чате выбранным адаптером."""
+    try:
+        modes = await backend.modes()
+        mode = (command.args or "").strip()
+        if not mode:
+            current = await backend.get_mode(msg.chat.id)
+            await msg.reply(f"Текущий режим: {current}\nДоступные режимы: {', '.join(modes)}")
+            return
+        if mode not in modes:
+            await msg.reply(f"Нет такого режима. Доступные режимы: {', '.join(modes)}")
+            return
+        await backend.set_mode(msg.chat.id, mode)
+    except ModelNotReady:
+        await msg.reply("Модель еще не загружена, режим можно будет выбрать чуть позже.")
+        return
+    await msg.reply(f"Режим переключен: {mode}")
+
+
+@dp.message(Command("reload_adapters"))
+async def process_reload_adapters_command(msg: Message, command: CommandObject):
+    """/reload_adapters [имена] - заново читает веса LoRA адаптеров с диска (только для админов)."""
+    if msg.from_user.id not in ADMIN_IDS:
+        return
+    names = (command.args or "").split() or None
+    try:
+        reloaded = await backend.reload_adapters(names)
+    except ModelNotReady:
+        await msg.reply("Модель еще не загружена.")
+        return
+    except Exception as e:
+        logging.error(f"Ошибка перезагрузки LoRA адаптеров: {e}", exc_info=True)
+        await msg.reply(f"Не удалось перезагрузить адаптеры: {e}")
+        return
+    await msg.reply(f"Перезагружены адаптеры: {', '.join(reloaded) or 'нет'}")
+
+
 @dp.message(F.text.lower() == "создать персонажа")
 async def with_puree(msg: Message):
     await msg.reply("Создадим же легенду Фаэруна", reply_markup=ReplyKeyboardRemove())
@@ -126,136 +105,164 @@ async def without_puree(msg: Message):
     await msg.reply("Ладно, будешь играть за орка", reply_markup=ReplyKeyboardRemove())
 
 
-@dp.message(F.text)
+@llm_router.message(F.text)
 async def handle_text_message(msg: Message):
     """Обрабатывает текстовые сообщения с помощью LLM."""
-    if not llm_pipeline:
-        await msg.answer("Извините, Мастер сейчас размышляет над сюжетом (модель загружается или не загружена). Попробуйте позже.")
+    state = (await backend.status())["model"]
+    if state != READY:
+        if state == FAILED:
+            await msg.answer("Извините, Мастер сегодня не в форме (модель не загрузилась). Попробуйте позже.")
+        else:
+            await msg.answer("Извините, Мастер сейчас размышляет над сюжетом (модель загружается). Попробуйте позже.")
         return
 
     user_text = msg.text
     logging.info(f"Получен текст от {msg.from_user.id}: {user_text}")
 
-    # --- Работа с историей (Временно отключено для теста) ---
+    # --- Работа с историей ---
     chat_id = msg.chat.id
-    history = conversation_history.get(chat_id, [])
-    # Добавляем текущее сообщение пользователя в историю
-    history.append({"role": "user", "content": user_text})
-
-    # --- Формирование промпта (формат Saiga) ---
-    # Шаблоны из документации Saiga
-    message_template = "<s>{role}\n{content}</s>"
-    response_template = "<s>bot\n" # Маркер начала ответа бота
-    system_prompt_content = "Ты — ИИ-ассистент, который ведет игру в Dungeons & Dragons 5-й редакции. Ты - мастер этой игры, именно ты должен генерировать конкретных персонажей и конкретные ситуации. Отвечай на вопросы о правилах, самой игре, генерируй описания и помогай с игровыми ситуациями. "
-
-    # Собираем промпт
-    prompt_parts = []
-    # Добавляем системный промпт в правильном формате
-    prompt_parts.append(message_template.format(role="system", content=system_prompt_content))
-
-    # Добавляем последние сообщения из истории (пропуская системный, если он там был бы)
-    # Берем последние N * 2 сообщений (N пар user/bot)
-    recent_history = history[-(MAX_HISTORY_TURNS * 2):]
-    for message in recent_history:
-        prompt_parts.append(message_template.format(**message)) # Передаем весь словарь message
-
-    # Добавляем маркер для ответа бота
-    prompt_parts.append(response_template)
-    prompt = "".join(prompt_parts) # Соединяем без дополнительных переносов строки
-    logging.info(f"--- Полный промпт ---\n{prompt}\n--------------------") # Изменим лог для отладки
+    # Добавляем текущее сообщение пользователя в историю (она сама обрезается по бюджету токенов)
+    await backend.append(chat_id, "user", user_text)
+
+    # --- Кэш ответов ---
+    # Общий вопрос о правилах отвечается без истории диалога, поэтому ответ можно переиспользовать
+    standalone = response_cache is not None and is_rules_question(user_text)
+    if standalone:
+        adapter = await backend.chat_adapter(chat_id)
+        cached_response = response_cache.get(user_text, namespace=adapter)
+        if cached_response is not None:
+            with metrics.span(metrics.telegram_send_seconds):
+                await msg.answer(cached_response)
+            await backend.append(chat_id, "bot", cached_response)
+            return
+    elif not await message_coalescer.latest(chat_id):
+        # Пока Мастер отвечал, следом пришло еще сообщение; его обработчик ответит на оба
+        logging.info(f"Сообщение в чате {chat_id} склеено со следующим.")
+        return
+
+    # --- Поиск по правилам ---
+    rules = []
+    if rules_index is not None:
+        found = rules_index.search(user_text, RAG_TOP_K, min_score=RAG_MIN_SCORE)
+        rules = [passage for _, passage in found]
+        if found:
+            logging.info(f"Найдено выдержек из правил: {len(found)} (оценки {', '.join(f'{score:.1f}' for score, _ in found)})")
+
+    # В потоковом режиме сразу отправляем заглушку и дописываем в нее ответ по мере генерации
+    stream = StreamingReply(msg, "Мастер размышляет…", STREAM_EDIT_INTERVAL) if STREAMING_REPLIES else None
+
+    async def reply(text: str):
+        with metrics.span(metrics.telegram_send_seconds):
+            if stream is not None and stream.reply is not None:
+                await stream.finish(text)
+            else:
+                await msg.answer(text)
 
     try:
-        # Используем pipeline для генерации
-        logging.info("Генерация ответа...")
-        # Настройте параметры генерации по необходимости
-
-        # --- Определяем правильный ID стоп-токена ---
-        stop_token = "<|im_end|>"
-        try:
-            stop_token_id = llm_pipeline.tokenizer.convert_tokens_to_ids(stop_token)
-            logging.info(f"Используем ID токена '{stop_token}' ({stop_token_id}) как EOS.")
-        except KeyError:
-            stop_token_id = llm_pipeline.tokenizer.eos_token_id # Fallback на стандартный
-            logging.warning(f"Токен '{stop_token}' не найден, используем стандартный eos_token_id ({stop_token_id}) как EOS.")
-        # Стандартный EOS ID для padding
-        pad_token_id = llm_pipeline.tokenizer.eos_token_id
-        if pad_token_id is None: # На случай если у токенизатора совсем нет eos_token
-            pad_token_id = llm_pipeline.tokenizer.pad_token_id
-        # ----------------------------------------------
-
-        sequences = llm_pipeline(
-            prompt,
-            max_new_tokens=350,       # Максимальная длина нового текста
-            do_sample=True,          # Включаем сэмплирование обратно
-            temperature=0.7,        # Снижаем температуру еще немного
-            top_p=0.95,             # Возвращаем top_p
-            num_return_sequences=1,   # Генерировать одну последовательность
-            eos_token_id=stop_token_id, # <-- Используем ID для <|im_end|>
-            pad_token_id=pad_token_id   # Используем стандартный для padding
-        )
-
-        # Извлекаем сгенерированный текст из результата pipeline
-        raw_response = sequences[0]['generated_text']
-
-        # --- Извлекаем ТОЛЬКО сгенерированную часть ---
-        generated_response = "" # Инициализируем
-        # Важно: т.к. pipeline возвращает и промпт, и ответ,
-        # а мы знаем точный формат промпта, ищем начало ответа ПОСЛЕ промпта.
-        if raw_response.startswith(prompt):
-            generated_response = raw_response[len(prompt):].strip()
-        else:
-            # Fallback, если что-то пошло не так
-            generated_response = raw_response # Берем все, очистка ниже должна помочь
-            logging.warning("Вывод модели не начинался с промпта. Используется сырой вывод.")
-
-        # Логируем ответ ДО финальной очистки
-        logging.info(f"Ответ модели до очистки спец.токенов: {generated_response}")
-
-        # --- Улучшенная очистка ответа ---
-        # 1. Убираем все после первого </s> или <|im_end|>
-        #    (Saiga может использовать и то, и другое, возьмем то, что раньше)
-        stop_tokens = ["</s>", "<|im_end|>"]
-        first_stop_pos = -1
-        for token in stop_tokens:
-            pos = generated_response.find(token)
-            if pos != -1:
-                if first_stop_pos == -1 or pos < first_stop_pos:
-                    first_stop_pos = pos
-
-        if first_stop_pos != -1:
-            generated_response = generated_response[:first_stop_pos].strip()
-
-        # 2. Дополнительно убираем стандартный eos_token, если он вдруг остался
-        if llm_pipeline.tokenizer.eos_token and generated_response.endswith(llm_pipeline.tokenizer.eos_token):
-             generated_response = generated_response[:-len(llm_pipeline.tokenizer.eos_token)].strip()
-
-        # 3. Убираем слово "bot" из конца строки, если оно там есть
-        if generated_response.endswith(" bot"):
-            generated_response = generated_response[:-len(" bot")]
-
-        logging.info(f"Очищенный ответ: {generated_response}")
+        on_text = None
+        if stream is not None:
+            await stream.start()
+            on_text = stream.update
+        # Ответ сам добавляется в историю чата
+        with message_coalescer.busy(chat_id):
+            generated_response = await backend.generate(chat_id, rules=rules, standalone=standalone, on_text=on_text)
+
         if not generated_response: # Если ответ пустой после очистки
-            await msg.answer("Мастер задумался и не смог сформулировать ответ...")
+            await reply("Мастер задумался и не смог сформулировать ответ...")
         else:
-            await msg.answer(generated_response)
-            # Добавляем ответ бота в историю (Временно отключено, т.к. история не используется)
-            history.append({"role": "bot", "content": generated_response})
-            conversation_history[chat_id] = history[-(MAX_HISTORY_TURNS * 2):]
-
+            await reply(generated_response)
+            if standalone:
+                response_cache.put(user_text, generated_response, namespace=adapter)
+
+    except RequestSuperseded:
+        logging.info(f"Запрос чата {chat_id} вытеснен более новым сообщением.")
+        if stream is not None:
+            await stream.discard()
+    except InferenceQueueFull:
+        logging.warning(f"Очередь инференса заполнена, запрос от {chat_id} отклонен.")
+        await reply("Мастер сейчас занят другими игроками. Подождите немного и попробуйте снова.")
+    except asyncio.TimeoutError:
+        logging.warning(f"Превышено время ожидания ответа модели ({INFERENCE_TIMEOUT} с) для {chat_id}.")
+        await reply("Мастер слишком долго думал и потерял мысль. Попробуйте еще раз.")
     except Exception as e:
         logging.error(f"Ошибка во время генерации ответа: {e}", exc_info=True)
-        await msg.answer("Упс! Кажется, вдохновение покинуло Мастера (ошибка генерации).")
+        await reply("Упс! Кажется, вдохновение покинуло Мастера (ошибка генерации).")
+
+
+async def healthcheck(request: web.Request) -> web.Response:
+    """Готовность экземпляра для балансировщика: 200, только когда модель загружена и сервер инференса доступен."""
+    status = await backend.status()
+    return web.json_response(status, status=200 if status["model"] == READY else 503)
+
+
+async def livecheck(request: web.Request) -> web.Response:
+    """Жив ли экземпляр: 200 и во время загрузки модели, чтобы его не перезапускали, 503 - модель не загрузилась."""
+    status = await backend.status()
+    return web.json_response(status, status=503 if status["model"] == FAILED else 200)
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Метрики в текстовом формате Prometheus."""
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def serve_metrics():
+    """В режиме polling поднимает /metrics, /healthz и /livez на METRICS_PORT."""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.router.add_get("/healthz", healthcheck)
+    app.router.add_get("/livez", livecheck)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, METRICS_PORT).start()
+    logging.info(f"Метрики доступны на {WEBHOOK_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+
+async def run_webhook():
+    """Принимает обновления на aiohttp сервере вместо long polling.
+
+    SimpleRequestHandler проверяет секретный заголовок и сразу отвечает 200,
+    а обновление обрабатывается в фоновой задаче, поэтому Telegram не ждет
+    генерации и не шлет обновление повторно.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=True,
+                         secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", healthcheck)
+    app.router.add_get("/livez", livecheck)
+    app.router.add_get("/metrics", metrics_endpoint)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logging.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+            logging.info(f"Вебхук зарегистрирован в Telegram: {WEBHOOK_URL}{WEBHOOK_PATH}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main():
-    # Загружаем модель перед стартом бота
-    await load_llm()
-    if not llm_pipeline:
-        logging.warning("LLM не загружена! Бот будет работать с ограниченной функциональностью (без ответов LLM).")
-
-    # Запускаем polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Модель загружается в фоновом потоке, бот отвечает на команды сразу после старта
+    await backend.start()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            metrics_runner = await serve_metrics() if METRICS_PORT else None
+            try:
+                # Запускаем polling
+                await bot.delete_webhook(drop_pending_updates=True)
+                await dp.start_polling(bot)
+            finally:
+                if metrics_runner is not None:
+                    await metrics_runner.cleanup()
+    finally:
+        await backend.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+import contextlib
+import threading
+import time
+
+# Границы корзин гистограмм по умолчанию (в секундах)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+# Для коротких этапов вроде сборки промпта и токенизации
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# Замеры этапов через span() и замер prefill/декодирования; выключается METRICS_ENABLED.
+# Счетчики и остальные гистограммы считаются всегда - они дешевые
+enabled = True
+# Все созданные метрики в порядке создания, для render()
+_registry = []
+
+
+class Histogram:
+    """Простая потокобезопасная гистограмма длительностей."""
+
+    def __init__(self, name: str, description: str, buckets=DEFAULT_BUCKETS, unit: str = "с"):
+        self.name = name
+        self.description = description
+        self.unit = unit
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def summary(self) -> str:
+        unit = f" {self.unit}" if self.unit else ""
+        return f"{self.name}: n={self.count}, среднее={self.mean:.3f}{unit}, макс={self.max:.3f}{unit}"
+
+    def render(self) -> list:
+        with self._lock:
+            bucket_counts, count, total = list(self.bucket_counts), self.count, self.sum
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class Counter:
+    """Простой потокобезопасный счетчик событий."""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def summary(self) -> str:
+        return f"{self.name}: {self.value}"
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Gauge:
+    """Текущее значение величины (память, скорость генерации)."""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0.0
+        _registry.append(self)
+
+    def set(self, value: float):
+        self.value = value
+
+    def summary(self) -> str:
+        return f"{self.name}: {self.value}"
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+class _Span:
+    __slots__ = ("histogram", "started_at")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started_at)
+
+
+_disabled_span = contextlib.nullcontext()
+
+
+def span(histogram: Histogram):
+    """Контекстный менеджер, записывающий длительность блока в histogram (если замеры включены).
+
+    Работает и вокруг await: в гистограмму попадает полное время блока.
+    """
+    return _Span(histogram) if enabled else _disabled_span
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus (для эндпоинта /metrics)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Метрики очереди инференса
+queue_wait_seconds = Histogram("llm_queue_wait_seconds", "Время ожидания запроса в очереди инференса")
+generation_seconds = Histogram("llm_generation_seconds", "Время генерации одного батча моделью")
+time_to_first_text_seconds = Histogram("llm_time_to_first_text_seconds",
+                                       "Время от запроса до появления первого текста ответа у игрока")
+batch_size = Histogram("llm_batch_size", "Количество запросов в батче генерации", buckets=(1, 2, 4, 8, 16, 32, 64), unit="")
+
+# Этапы обработки сообщения
+update_seconds = Histogram("bot_update_seconds", "Полное время обработки обновления Telegram")
+prompt_build_seconds = Histogram("llm_prompt_build_seconds", "Сборка промпта из истории чата", buckets=FAST_BUCKETS)
+tokenize_seconds = Histogram("llm_tokenize_seconds", "Токенизация одного сообщения истории", buckets=FAST_BUCKETS)
+prefill_seconds = Histogram("llm_prefill_seconds", "Обработка промптов батча до первого нового токена")
+decode_seconds = Histogram("llm_decode_seconds", "Генерация остальных токенов батча после первого")
+postprocess_seconds = Histogram("llm_postprocess_seconds", "Декодирование и очистка ответов батча",
+                                buckets=FAST_BUCKETS)
+telegram_send_seconds = Histogram("telegram_send_seconds", "Отправка или правка сообщения в Telegram")
+
+# Метрики генерации
+generated_tokens = Counter("llm_generated_tokens_total", "Сгенерированные токены (до стоп-токена)")
+tokens_per_second = Gauge("llm_tokens_per_second", "Скорость генерации последнего батча, токенов в секунду")
+gpu_memory_allocated_bytes = Gauge("gpu_memory_allocated_bytes", "Память GPU, занятая тензорами")
+gpu_memory_reserved_bytes = Gauge("gpu_memory_reserved_bytes", "Память GPU, зарезервированная аллокатором PyTorch")
+gpu_memory_peak_bytes = Gauge("gpu_memory_peak_bytes", "Пик памяти GPU, занятой тензорами, с запуска")
+kv_cache_bytes = Gauge("llm_kv_cache_bytes", "Память под KV-кэш диалогов")
+
+# Метрики спекулятивного декодирования
+draft_tokens = Counter("llm_draft_tokens_total", "Токены, предложенные моделью-черновиком")
+draft_accepted_tokens = Counter("llm_draft_accepted_tokens_total", "Токены черновика, принятые основной моделью")
+draft_acceptance_rate = Gauge("llm_draft_acceptance_rate", "Скользящая доля принятых токенов черновика")
+speculative_fallbacks = Counter("llm_speculative_fallbacks_total",
+                                "Генерации без черновика при включенном спекулятивном декодировании")
+
+# Метрики кэша ответов
+response_cache_exact_hits = Counter("response_cache_exact_hits_total", "Ответы из кэша по точному совпадению вопроса")
+response_cache_similar_hits = Counter("response_cache_similar_hits_total", "Ответы из кэша по похожему вопросу")
+response_cache_misses = Counter("response_cache_misses_total", "Вопросы, ответ на которые пришлось генерировать")
@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+
+NOT_STARTED = "not_started"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelLoader:
+    """Загружает LLM в фоновом потоке, пока бот уже отвечает на остальные сообщения.
+
+    Модуль llm (а вместе с ним torch, transformers и peft) импортируется
+    только в этом потоке, поэтому запуск бота не ждет ни импорта тяжелых
+    библиотек, ни загрузки весов. Пока загрузка идет, раз в
+    progress_interval секунд в лог пишется, сколько она уже длится.
+    """
+
+    def __init__(self, progress_interval: float = 30):
+        self.progress_interval = progress_interval
+        self.state = NOT_STARTED
+        self.error = None
+        # Модуль llm, доступен после перехода в состояние READY
+        self.llm = None
+        self._thread = None
+        self._started_at = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.state = LOADING
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._load, name="llm-loader", daemon=True)
+        self._thread.start()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at if self._started_at else 0.0
+
+    def _report_progress(self, done: threading.Event):
+        while not done.wait(self.progress_interval):
+            logging.info(f"Модель все еще загружается ({self.elapsed():.0f} с)...")
+
+    def _load(self):
+        done = threading.Event()
+        threading.Thread(target=self._report_progress, args=(done,), name="llm-loader-progress", daemon=True).start()
+        try:
+            logging.info("Фоновая загрузка LLM: импорт torch/transformers...")
+            import llm
+            logging.info(f"Библиотеки импортированы за {self.elapsed():.1f} с.")
+            llm.load_llm()
+            if not llm.is_loaded():
+                raise RuntimeError("load_llm не загрузила модель (подробности в логе выше)")
+            self.llm = llm
+            self.state = READY
+            logging.info(f"LLM готова к работе через {self.elapsed():.1f} с после начала загрузки.")
+        except Exception as e:
+            self.error = e
+            self.state = FAILED
+            logging.error(f"LLM не загружена! Бот будет работать без ответов LLM. Причина: {e}", exc_info=True)
+        finally:
+            done.set()
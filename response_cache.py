@@ -0,0 +1,177 @@
+import logging
+import random
+import re
+import time
+import zlib
+from collections import OrderedDict
+
+import metrics
+from rules_index import tokenize
+
+# Начала вопросов о правилах, ответ на которые не зависит от истории диалога
+RULES_QUESTION_PREFIXES = (
+    "как работает", "как работают", "что такое", "что значит", "что означает", "что дает",
+    "что делает", "сколько", "можно ли", "как считается", "как считать", "как рассчитать",
+    "чем отличается", "по правилам",
+)
+# Длинные сообщения почти всегда описывают игровую ситуацию, а не общий вопрос
+MAX_QUESTION_LENGTH = 200
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+_SPACES_RE = re.compile(r"\s+")
+_NUMBER_RE = re.compile(r"\d+")
+# Параметры MinHash: NUM_HASHES значений подписи, разбитых на BANDS полос для LSH
+NUM_HASHES = 32
+BANDS = 8
+_PRIME = (1 << 61) - 1
+_rng = random.Random(12345)
+_HASH_PARAMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+
+def normalize_question(text: str) -> str:
+    """Вопрос без регистра, пунктуации и лишних пробелов - ключ точного совпадения."""
+    text = _PUNCTUATION_RE.sub(" ", text.lower().replace("ё", "е"))
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def is_rules_question(text: str) -> bool:
+    """Похоже ли сообщение на общий вопрос о правилах, не зависящий от истории диалога."""
+    if len(text) > MAX_QUESTION_LENGTH:
+        return False
+    return normalize_question(text).startswith(RULES_QUESTION_PREFIXES)
+
+
+def shingles(text: str) -> frozenset:
+    """Символьные триграммы основ слов: словоформы одного слова дают почти те же триграммы."""
+    result = set()
+    for term in tokenize(text):
+        term = f" {term} "
+        result.update(term[i:i + 3] for i in range(len(term) - 2))
+    return frozenset(result)
+
+
+def numbers(text: str) -> frozenset:
+    return frozenset(_NUMBER_RE.findall(text))
+
+
+def minhash(terms: frozenset) -> tuple:
+    hashes = [zlib.crc32(term.encode("utf-8")) for term in terms]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _HASH_PARAMS)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class _Entry:
+    __slots__ = ("answer", "terms", "numbers", "bands", "created_at")
+
+    def __init__(self, answer: str, terms: frozenset, numbers: frozenset, bands: list, created_at: float):
+        self.answer = answer
+        self.terms = terms
+        self.numbers = numbers
+        self.bands = bands
+        self.created_at = created_at
+
+
+class ResponseCache:
+    """Кэш готовых ответов на повторяющиеся вопросы о правилах.
+
+    Поиск в два этапа: сначала по точному совпадению нормализованного
+    текста вопроса, затем по похожему вопросу - с мерой Жаккара по
+    триграммам основ слов не ниже similarity и теми же числами (ответ про
+    заклинание 3 и 5 уровня разный). Кандидаты на похожесть находятся через
+    MinHash-подписи, разбитые на полосы (LSH), поэтому поиск не перебирает
+    весь кэш. namespace разделяет ответы разных режимов (LoRA адаптеров).
+    Записи старше ttl секунд не отдаются, сверх max_entries вытесняются
+    самые давно использованные (LRU).
+    """
+
+    def __init__(self, max_entries: int, ttl: float, similarity: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        # (namespace, номер полосы, значения полосы) -> ключи записей
+        self._buckets = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        hits = metrics.response_cache_exact_hits.value + metrics.response_cache_similar_hits.value
+        total = hits + metrics.response_cache_misses.value
+        return hits / total if total else 0.0
+
+    def get(self, question: str, namespace=None):
+        """Ответ на такой же или похожий вопрос или None."""
+        now = time.monotonic()
+        key = (namespace, normalize_question(question))
+        entry = self._entries.get(key)
+        if entry is not None and not self._expired(key, entry, now):
+            self._entries.move_to_end(key)
+            metrics.response_cache_exact_hits.inc()
+            logging.info(f"Кэш ответов: точное совпадение (доля попаданий {self.hit_rate:.0%}).")
+            return entry.answer
+
+        terms = shingles(question)
+        question_numbers = numbers(question)
+        best_key, best_similarity = None, 0.0
+        if terms:
+            for candidate_key in self._candidates(namespace, self._bands(terms)):
+                candidate = self._entries[candidate_key]
+                similarity = jaccard(terms, candidate.terms)
+                if similarity >= self.similarity and similarity > best_similarity \
+                        and candidate.numbers == question_numbers \
+                        and not self._expired(candidate_key, candidate, now):
+                    best_key, best_similarity = candidate_key, similarity
+        if best_key is not None:
+            self._entries.move_to_end(best_key)
+            metrics.response_cache_similar_hits.inc()
+            logging.info(f"Кэш ответов: похожий вопрос \"{best_key[1]}\" (сходство {best_similarity:.2f}, "
+                         f"доля попаданий {self.hit_rate:.0%}).")
+            return self._entries[best_key].answer
+
+        metrics.response_cache_misses.inc()
+        return None
+
+    def put(self, question: str, answer: str, namespace=None):
+        key = (namespace, normalize_question(question))
+        self._remove(key)
+        terms = shingles(question)
+        bands = self._bands(terms) if terms else []
+        self._entries[key] = _Entry(answer, terms, numbers(question), bands, time.monotonic())
+        for band in bands:
+            self._buckets.setdefault((namespace, *band), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _bands(self, terms: frozenset) -> list:
+        signature = minhash(terms)
+        rows = NUM_HASHES // BANDS
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def _candidates(self, namespace, bands: list) -> set:
+        candidates = set()
+        for band in bands:
+            candidates |= self._buckets.get((namespace, *band), set())
+        return candidates
+
+    def _expired(self, key, entry: _Entry, now: float) -> bool:
+        if now - entry.created_at < self.ttl:
+            return False
+        self._remove(key)
+        return True
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in entry.bands:
+            bucket_key = (key[0], *band)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[bucket_key]
@@ -0,0 +1,244 @@
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+INDEX_MANIFEST = "index.json"
+INDEX_VERSION = 2
+
+_WORD_RE = re.compile(r"\w+")
+# Перенос слова из PDF ("от- дых") и мягкий перенос внутри слова
+_HYPHENATION_RE = re.compile(r"(?<=\w)-\s+(?=[а-яё])|\xad")
+# Служебные слова и обороты вопросов: есть почти в каждом фрагменте или в каждом вопросе,
+# поэтому только мешают ранжированию ("что такое", "как работает")
+STOP_WORDS = frozenset("""
+    а без более бы был была были было быть в вам вас весь во вот все всё всего всех вы где да даже для до его ее её
+    если есть еще ещё же за здесь и из или им их к как какая какие каким какое какой кем ко когда кого ком который
+    которая которое которые которых кто ли либо меня мне много может можно мой мы на над надо нам нас не него нее
+    нет ни них но ну нужно о об объясни он она они оно от по под подскажи пожалуйста после при про раз расскажи
+    с сам свой свою себе себя со так также такие такое такой там тебе тебя то того тоже только том тот ты у уже
+    хотя чем через что чтобы чье чья эта эти это этого этом этот я
+    сколько работает работают делает делают означает значит происходит проходит считается определяется нужен нужна
+""".split())
+# Окончания, которые отбрасываются при нормализации слов (самые длинные проверяются первыми)
+_SUFFIXES = sorted((
+    "иями", "ями", "ами", "ией", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ов", "ев", "ам", "ям",
+    "ах", "ях", "ом", "ем", "ую", "юю",
+), key=len, reverse=True)
+# Глагольные окончания отбрасываются, только если основа остается длиннее: иначе
+# "ракете" превратилась бы в "рак"
+_VERB_SUFFIXES = sorted((
+    "ается", "яется", "аются", "яются", "ются", "ется", "ится", "ться", "тся",
+    "овать", "уете", "ует", "уют", "аете", "яете", "ает", "яет", "еет", "ают", "яют", "еют", "ете", "ите", "ешь", "ишь",
+    "ать", "ять", "еть", "ить", "ала", "яла", "ало", "яло", "али", "яли",
+), key=len, reverse=True)
+_TRAILING = "аяоеёыиуюйь"
+_CONSONANTS = "бвгджзклмнпрстфхцчшщ"
+
+
+def normalize_word(word: str) -> str:
+    """Грубая основа слова: без окончания и конечных гласных ("заклинания" -> "заклинан").
+
+    Беглая гласная перед конечной к убирается, чтобы "спасбросок" и
+    "спасброски" давали одну основу "спасброск".
+    """
+    word = word.lower().replace("ё", "е")
+    for suffix in _VERB_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            word = word[:-len(suffix)]
+            break
+    else:
+        for suffix in _SUFFIXES:
+            # "отдых" - не прилагательное с окончанием "ых"
+            min_stem = 4 if suffix in ("ых", "их") else 3
+            if word.endswith(suffix) and len(word) - len(suffix) >= min_stem:
+                word = word[:-len(suffix)]
+                break
+    stem = word.rstrip(_TRAILING)
+    if len(stem) >= 5 and stem[-2:] in ("ок", "ек") and stem[-3] in _CONSONANTS:
+        stem = stem[:-2] + "к"
+    return stem if len(stem) >= 3 else word
+
+
+def tokenize(text: str) -> list:
+    """Термы текста для BM25; стоп-слова и слова короче двух символов отбрасываются."""
+    words = _WORD_RE.findall(_HYPHENATION_RE.sub("", text.lower()))
+    return [normalize_word(word) for word in words if len(word) >= 2 and word not in STOP_WORDS]
+
+
+def split_into_chunks(text: str, chunk_chars: int) -> list:
+    """Режет текст на фрагменты примерно по chunk_chars символов по границам строк."""
+    chunks, current, size = [], [], 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        # Слишком длинная строка режется по пробелам
+        while len(line) > chunk_chars:
+            cut = line.rfind(" ", 0, chunk_chars)
+            if cut <= 0:
+                cut = chunk_chars
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.append(line[:cut].strip())
+            line = line[cut:].strip()
+        if current and size + len(line) > chunk_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def build_index(sources: list, output: str, chunk_chars: int = 800, k1: float = 1.5, b: float = 0.75) -> dict:
+    """Строит BM25 индекс по текстовым файлам sources и сохраняет его в папку output.
+
+    Вес каждого вхождения терма (idf * нормированная частота) считается
+    заранее, поэтому при поиске остается сложить веса из списков вхождений
+    термов запроса. Все массивы лежат в .npy файлах и при загрузке
+    отображаются в память, а не читаются целиком.
+    """
+    passages = []
+    for source in sources:
+        with open(source, encoding="utf-8") as f:
+            passages.extend(split_into_chunks(f.read(), chunk_chars))
+    if not passages:
+        raise ValueError("В источниках нет текста для индекса")
+
+    term_ids = {}
+    postings = []  # Для каждого терма: список (номер фрагмента, частота)
+    lengths = np.zeros(len(passages), dtype=np.float32)
+    for doc_id, passage in enumerate(passages):
+        terms = tokenize(passage)
+        lengths[doc_id] = len(terms)
+        for term, tf in Counter(terms).items():
+            term_id = term_ids.setdefault(term, len(term_ids))
+            if term_id == len(postings):
+                postings.append([])
+            postings[term_id].append((doc_id, tf))
+
+    n = len(passages)
+    avg_length = float(lengths.mean()) or 1.0
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(term_postings) for term_postings in postings])
+    doc_ids = np.empty(offsets[-1], dtype=np.int32)
+    weights = np.empty(offsets[-1], dtype=np.float32)
+    for term_id, term_postings in enumerate(postings):
+        start, end = offsets[term_id], offsets[term_id + 1]
+        idf = math.log(1 + (n - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+        ids = np.fromiter((doc_id for doc_id, _ in term_postings), dtype=np.int32, count=end - start)
+        tf = np.fromiter((tf for _, tf in term_postings), dtype=np.float32, count=end - start)
+        doc_ids[start:end] = ids
+        weights[start:end] = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[ids] / avg_length))
+
+    encoded = [passage.encode("utf-8") for passage in passages]
+    passage_offsets = np.zeros(n + 1, dtype=np.int64)
+    passage_offsets[1:] = np.cumsum([len(passage) for passage in encoded])
+
+    manifest = {
+        "version": INDEX_VERSION,
+        "sources": sources,
+        "chunk_chars": chunk_chars,
+        "k1": k1,
+        "b": b,
+        "passages": n,
+        "terms": term_ids,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    parent = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=parent) as work_dir:
+        staging = os.path.join(work_dir, "index")
+        os.makedirs(staging)
+        np.save(os.path.join(staging, "offsets.npy"), offsets)
+        np.save(os.path.join(staging, "doc_ids.npy"), doc_ids)
+        np.save(os.path.join(staging, "weights.npy"), weights)
+        np.save(os.path.join(staging, "passage_offsets.npy"), passage_offsets)
+        with open(os.path.join(staging, "passages.bin"), "wb") as f:
+            f.writelines(encoded)
+        with open(os.path.join(staging, INDEX_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        # Как и чекпоинт модели, старый индекс заменяется только готовым новым
+        if os.path.exists(output):
+            shutil.rmtree(output)
+        os.replace(staging, output)
+    return manifest
+
+
+class RulesIndex:
+    """Поиск фрагментов правил по BM25 индексу, собранному build_rules_index.py.
+
+    Индекс загружается при первом поиске: массивы отображаются в память
+    (np.load с mmap_mode), в память читается только словарь термов. Если
+    индекса нет, search() всегда возвращает пустой список.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._loaded = False
+        self._terms = None
+        self._offsets = None
+        self._doc_ids = None
+        self._weights = None
+        self._passage_offsets = None
+        self._passages = None
+
+    def _load(self) -> bool:
+        if self._loaded:
+            return self._terms is not None
+        self._loaded = True
+        manifest_path = os.path.join(self.path, INDEX_MANIFEST)
+        if not os.path.isfile(manifest_path):
+            logging.warning(f"Индекс правил не найден ({self.path}), ответы без выдержек из правил. "
+                            f"Соберите его: python build_rules_index.py")
+            return False
+        started_at = time.perf_counter()
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != INDEX_VERSION:
+            logging.warning(f"Индекс правил {self.path} собран другой версией, пересоберите его.")
+            return False
+        self._offsets = self._map("offsets.npy")
+        self._doc_ids = self._map("doc_ids.npy")
+        self._weights = self._map("weights.npy")
+        self._passage_offsets = self._map("passage_offsets.npy")
+        self._passages = np.memmap(os.path.join(self.path, "passages.bin"), dtype=np.uint8, mode="r")
+        self._terms = manifest["terms"]
+        logging.info(f"Индекс правил загружен за {(time.perf_counter() - started_at) * 1000:.0f} мс: "
+                     f"{manifest['passages']} фрагментов, {len(self._terms)} термов.")
+        return True
+
+    def _map(self, name: str):
+        return np.load(os.path.join(self.path, name), mmap_mode="r")
+
+    def passage(self, doc_id: int) -> str:
+        start, end = self._passage_offsets[doc_id], self._passage_offsets[doc_id + 1]
+        return self._passages[start:end].tobytes().decode("utf-8")
+
+    def search(self, query: str, k: int, min_score: float = 0.0) -> list:
+        """До k самых подходящих фрагментов с оценкой выше min_score: список пар (оценка, текст)."""
+        if k <= 0 or not self._load():
+            return []
+        term_ids = {self._terms[term] for term in tokenize(query) if term in self._terms}
+        if not term_ids:
+            return []
+        ranges = [(self._offsets[term_id], self._offsets[term_id + 1]) for term_id in term_ids]
+        doc_ids = np.concatenate([self._doc_ids[start:end] for start, end in ranges])
+        weights = np.concatenate([self._weights[start:end] for start, end in ranges])
+        scores = np.bincount(doc_ids, weights=weights, minlength=len(self._passage_offsets) - 1)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[doc_id]), self.passage(doc_id)) for doc_id in top if scores[doc_id] > min_score]
@@ -0,0 +1,232 @@
+import logging
+import sqlite3
+import threading
+import time
+
+
+class SessionBackend:
+    """Постоянное хранилище сообщений диалогов и выбранных в чатах режимов.
+
+    append() и save_mode() вызываются из обработчиков сообщений и не должны
+    ждать диска; load() и load_mode() вызываются один раз для чата, когда
+    его истории нет в памяти.
+    """
+
+    def load(self, chat_id, limit: int) -> list:
+        """Последние limit сообщений чата в виде пар (роль, текст) от старых к новым."""
+        raise NotImplementedError
+
+    def append(self, chat_id, role: str, content: str):
+        raise NotImplementedError
+
+    def delete(self, chat_id):
+        """Удаляет историю сообщений чата; выбранный режим остается."""
+        raise NotImplementedError
+
+    def load_mode(self, chat_id):
+        """Режим, выбранный в чате через /mode; None - не выбирался."""
+        raise NotImplementedError
+
+    def save_mode(self, chat_id, mode):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Хранит сообщения в локальной SQLite базе с отложенной пакетной записью.
+
+    append() только кладет сообщение в буфер в памяти. Фоновый поток раз в
+    flush_interval секунд (или сразу, когда в буфере набралось flush_batch
+    сообщений) записывает весь буфер одной транзакцией. База работает в
+    режиме WAL с synchronous=NORMAL, поэтому fsync на каждую транзакцию не
+    делается. При аварийном завершении теряются не больше flush_interval
+    секунд последних сообщений. Режимы чатов буферизуются и пишутся так же.
+
+    База не растет без конца: при записи у чата остаются только последние
+    keep_messages сообщений (больше load() все равно не читает), а раз в
+    prune_interval секунд удаляются чаты без новых сообщений дольше
+    retention секунд (None - хранить всегда) вместе с их режимами.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, flush_batch: int = 500, keep_messages: int = 200,
+                 retention: float = None, prune_interval: float = 3600):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.keep_messages = keep_messages
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._pruned_at = 0.0
+        self._buffer = []
+        # Режимы, еще не записанные на диск: chat_id -> режим
+        self._modes = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        # Запись идет из фонового потока, чтение - из event loop, поэтому соединений два
+        self._writer = self._connect()
+        self._writer.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS messages_chat_id ON messages (chat_id, id);
+            CREATE TABLE IF NOT EXISTS chat_modes (
+                chat_id INTEGER PRIMARY KEY,
+                mode TEXT,
+                updated_at REAL NOT NULL
+            );
+        """)
+        columns = {row[1] for row in self._writer.execute("PRAGMA table_info(messages)")}
+        if "created_at" not in columns:
+            # База от версии без времени сообщений: старые сообщения считаются только что записанными
+            self._writer.execute("ALTER TABLE messages ADD COLUMN created_at REAL")
+            self._writer.execute("UPDATE messages SET created_at = ?", (time.time(),))
+        self._reader = self._connect()
+        self._thread = threading.Thread(target=self._flush_loop, name="session-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def load(self, chat_id, limit: int) -> list:
+        rows = self._reader.execute(
+            "SELECT role, content FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+            (chat_id, limit),
+        ).fetchall()
+        rows.reverse()
+        # Изменения, еще не дошедшие до диска, тоже относятся к истории
+        with self._lock:
+            for buffered_chat_id, role, content, _ in self._buffer:
+                if buffered_chat_id != chat_id:
+                    continue
+                if role is None: # История чата удалена
+                    rows = []
+                else:
+                    rows.append((role, content))
+        return rows[-limit:]
+
+    def append(self, chat_id, role: str, content: str):
+        with self._lock:
+            self._buffer.append((chat_id, role, content, time.time()))
+            if len(self._buffer) >= self.flush_batch:
+                self._wakeup.set()
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._buffer = [item for item in self._buffer if item[0] != chat_id]
+            # Удаление тоже отправляется писателю, чтобы не ждать диска здесь
+            self._buffer.append((chat_id, None, None, None))
+        self._wakeup.set()
+
+    def load_mode(self, chat_id):
+        with self._lock:
+            if chat_id in self._modes:
+                return self._modes[chat_id]
+        row = self._reader.execute("SELECT mode FROM chat_modes WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0] if row else None
+
+    def save_mode(self, chat_id, mode):
+        with self._lock:
+            self._modes[chat_id] = mode
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            modes, self._modes = self._modes, {}
+        if not batch and not modes:
+            return
+        try:
+            self._writer.execute("BEGIN")
+            appended = set()
+            for chat_id, role, content, created_at in batch:
+                if role is None:
+                    self._writer.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+                    appended.discard(chat_id)
+                else:
+                    self._writer.execute("INSERT INTO messages (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                                         (chat_id, role, content, created_at))
+                    appended.add(chat_id)
+            now = time.time()
+            for chat_id, mode in modes.items():
+                self._writer.execute("INSERT OR REPLACE INTO chat_modes (chat_id, mode, updated_at) VALUES (?, ?, ?)",
+                                     (chat_id, mode, now))
+            # Сообщения старше последних keep_messages уже никогда не загрузятся
+            for chat_id in appended:
+                self._writer.execute(
+                    "DELETE FROM messages WHERE chat_id = ? AND id <= "
+                    "(SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (chat_id, chat_id, self.keep_messages))
+            self._writer.execute("COMMIT")
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка записи истории диалогов в {self.path}: {e}", exc_info=True)
+            if self._writer.in_transaction:
+                self._writer.execute("ROLLBACK")
+            # Возвращаем несохраненные сообщения в начало буфера до следующей попытки
+            with self._lock:
+                self._buffer[:0] = batch
+                for chat_id, mode in modes.items():
+                    self._modes.setdefault(chat_id, mode)
+
+    def prune(self, now: float = None) -> int:
+        """Удаляет чаты без новых сообщений дольше retention секунд; возвращает число удаленных сообщений."""
+        if self.retention is None:
+            return 0
+        cutoff = (time.time() if now is None else now) - self.retention
+        try:
+            self._writer.execute("BEGIN")
+            deleted = self._writer.execute(
+                "DELETE FROM messages WHERE chat_id IN "
+                "(SELECT chat_id FROM messages GROUP BY chat_id HAVING MAX(created_at) < ?)",
+                (cutoff,)).rowcount
+            # Режим забывается вместе с историей, если и его не меняли дольше retention
+            self._writer.execute(
+                "DELETE FROM chat_modes WHERE updated_at < ? AND chat_id NOT IN "
+                "(SELECT chat_id FROM messages WHERE created_at >= ?)",
+                (cutoff, cutoff))
+            self._writer.execute("COMMIT")
+        except sqlite3.Error as e:
+            if self._writer.in_transaction:
+                self._writer.execute("ROLLBACK")
+            logging.error(f"Ошибка удаления старых диалогов из {self.path}: {e}", exc_info=True)
+            return 0
+        if deleted:
+            logging.info(f"Из {self.path} удалено {deleted} сообщений неактивных чатов.")
+        return deleted
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.monotonic() - self._pruned_at >= self.prune_interval:
+                self._pruned_at = time.monotonic()
+                self.prune()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        self._writer.close()
+        self._reader.close()
+
+
+def create_session_backend(name: str, path: str, flush_interval: float, keep_messages: int = 200,
+                           retention: float = None):
+    """Создает хранилище истории по имени из конфига; None - хранить только в памяти."""
+    if not name or name == "memory":
+        return None
+    if name == "sqlite":
+        logging.info(f"История диалогов сохраняется в SQLite: {path}")
+        return SQLiteSessionBackend(path, flush_interval=flush_interval, keep_messages=keep_messages,
+                                    retention=retention)
+    raise ValueError(f"Неизвестное хранилище истории диалогов: {name}")
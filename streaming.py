@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+import metrics
+
+# Telegram не принимает сообщения длиннее 4096 символов
+MAX_MESSAGE_LENGTH = 4096
+# Сколько раз повторять правку, если Telegram просит подождать
+MAX_EDIT_ATTEMPTS = 3
+
+
+class StreamingReply:
+    """Показывает ответ модели по мере генерации, редактируя одно сообщение.
+
+    update() вызывается на каждый новый фрагмент текста, но само сообщение
+    редактируется не чаще раза в edit_interval секунд, чтобы не упираться
+    в лимиты Telegram на редактирование.
+    """
+
+    def __init__(self, msg: Message, placeholder: str, edit_interval: float):
+        self.msg = msg
+        self.placeholder = placeholder
+        self.edit_interval = edit_interval
+        self.reply = None
+        self._text = ""
+        self._shown_text = ""
+        self._changed = asyncio.Event()
+        self._editor_task = None
+        self._started_at = time.perf_counter()
+        self._first_text_seen = False
+
+    async def start(self):
+        """Отправляет сообщение-заглушку, которое затем будет редактироваться."""
+        self.reply = await self.msg.answer(self.placeholder)
+        self._editor_task = asyncio.create_task(self._editor())
+
+    def update(self, text: str):
+        if text and not self._first_text_seen:
+            self._first_text_seen = True
+            metrics.time_to_first_text_seconds.observe(time.perf_counter() - self._started_at)
+        self._text = text
+        self._changed.set()
+
+    async def finish(self, text: str):
+        """Останавливает промежуточные правки и показывает окончательный текст.
+
+        Если отредактировать заглушку не удалось, ответ отправляется новым сообщением.
+        """
+        await self._stop_editor()
+        if not await self._edit(text):
+            await self.msg.answer(text[:MAX_MESSAGE_LENGTH])
+
+    async def discard(self):
+        """Останавливает правки и удаляет сообщение-заглушку (ответ даст другой запрос)."""
+        await self._stop_editor()
+        if self.reply is not None:
+            try:
+                await self.reply.delete()
+            except TelegramBadRequest as e:
+                logging.warning(f"Не удалось удалить сообщение: {e}")
+
+    async def _stop_editor(self):
+        if self._editor_task is not None:
+            self._editor_task.cancel()
+            try:
+                await self._editor_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # Промежуточные правки не должны мешать окончательному ответу
+                logging.warning(f"Ошибка при промежуточной правке сообщения: {e}")
+            self._editor_task = None
+
+    async def _editor(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            if self._text:
+                await self._edit(self._text + " …")
+            await asyncio.sleep(self.edit_interval)
+
+    async def _edit(self, text: str) -> bool:
+        """Показывает text в сообщении; возвращает False, если отредактировать не удалось."""
+        text = text[:MAX_MESSAGE_LENGTH]
+        if text == self._shown_text:
+            return True
+        for attempt in range(MAX_EDIT_ATTEMPTS):
+            try:
+                await self.reply.edit_text(text)
+                self._shown_text = text
+                return True
+            except TelegramRetryAfter as e:
+                logging.warning(f"Telegram просит подождать {e.retry_after} с перед правкой сообщения.")
+                if attempt + 1 < MAX_EDIT_ATTEMPTS:
+                    await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    self._shown_text = text
+                    return True
+                logging.warning(f"Не удалось отредактировать сообщение: {e}")
+                return False
+            except Exception as e:
+                logging.warning(f"Ошибка при правке сообщения: {e}")
+                return False
+        return False
@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Скрипты AI-part импортируют друг друга по имени модуля
+sys.path.insert(0, os.path.join(ROOT, "AI-part"))
+
+# config.py читает config.json из текущей папки при импорте: тесты запускаются
+# в пустой временной папке с настройками по умолчанию и без файла sessions.db проекта
+_workdir = tempfile.mkdtemp(prefix="tg_bot_tests_")
+with open(os.path.join(_workdir, "config.json"), "w") as f:
+    json.dump({"BOT_TOKEN": "42:TEST", "SESSION_BACKEND": "memory"}, f)
+os.chdir(_workdir)
+
+
+import pytest
+
+RULES_TEXT = os.path.join(ROOT, "AI-part", "free_dnd_rules.txt")
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """Крошечная случайная Mistral с BPE токенизатором, обученным на тексте правил.
+
+    Ответы бессмысленны, но детерминированы при жадной генерации: этого
+    достаточно, чтобы сравнивать пути генерации между собой.
+    """
+    torch = pytest.importorskip("torch")
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import MistralConfig, MistralForCausalLM, PreTrainedTokenizerFast
+
+    path = str(tmp_path_factory.mktemp("tiny_model"))
+    bpe = Tokenizer(models.BPE(unk_token="<unk>"))
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train([RULES_TEXT], trainers.BpeTrainer(vocab_size=1000,
+                                                special_tokens=["<unk>", "<s>", "</s>", "<|im_end|>"]))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe, unk_token="<unk>", bos_token="<s>", eos_token="</s>",
+                                        additional_special_tokens=["<|im_end|>"],
+                                        model_input_names=["input_ids", "attention_mask"])
+    tokenizer.save_pretrained(path)
+    torch.manual_seed(0)
+    config = MistralConfig(vocab_size=len(tokenizer), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                           num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=4096,
+                           bos_token_id=1, eos_token_id=2)
+    MistralForCausalLM(config).save_pretrained(path)
+    return path
+
+
+@pytest.fixture
+def tiny_llm(tiny_model_dir):
+    """Модуль llm с крошечной моделью, жадной генерацией и без KV-кэша чатов."""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    import llm
+
+    llm.tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    llm.tokenizer.pad_token = llm.tokenizer.eos_token
+    llm.tokenizer.padding_side = "left"
+    llm.model = AutoModelForCausalLM.from_pretrained(tiny_model_dir).eval()
+    llm.adapters.clear()
+    llm.kv_cache = None
+    llm.draft_model = None
+    llm.prepare_generation()
+    llm.generation_profile.sampling = {"do_sample": False, "min_new_tokens": 8}
+    llm.generation_profile.max_new_tokens = 16
+    yield llm
+    llm.model = llm.tokenizer = llm.kv_cache = None
+
+
+@pytest.fixture
+def fake_llm_server():
+    """Запускает AI-part/fake_llm_server.py в отдельном потоке со своим event loop.
+
+    start(rpm, error_rate, period, empty_rate) -> (адрес сервера, функция чтения /stats);
+    серверы останавливаются в конце теста.
+    """
+    import asyncio
+    import threading
+    import urllib.request
+
+    from aiohttp import web
+
+    from fake_llm_server import make_app
+
+    servers = []
+
+    def start(rpm: int = 1000, error_rate: float = 0.0, period: float = 60, empty_rate: float = 0.0):
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(make_app(rpm, error_rate, latency=0.01, period=period, empty_rate=empty_rate))
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        loop.run_until_complete(site.start())
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        servers.append((loop, thread, runner))
+        url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+        def stats() -> dict:
+            with urllib.request.urlopen(url + "/stats") as response:
+                return json.load(response)
+
+        return url, stats
+
+    yield start
+    for loop, thread, runner in servers:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
@@ -0,0 +1,19 @@
+from conversation import Turn
+from inference import GenerationRequest
+
+
+def make_request(llm, *messages, chat_id=None):
+    turns = [Turn(role, content, llm.tokenize_message(role, content)) for role, content in messages]
+    prompt, token_ids = llm.build_prompt(turns)
+    return GenerationRequest(prompt, token_ids=token_ids, chat_id=chat_id)
+
+
+def test_batched_request_matches_single(tiny_llm):
+    short = make_request(tiny_llm, ("user", "Как работает преимущество?"))
+    long = make_request(tiny_llm, ("user", "Я захожу в таверну и осматриваюсь."),
+                        ("bot", "В углу сидит старый дварф."), ("user", "Подхожу к нему и спрашиваю о слухах."))
+    alone = [tiny_llm.generate_batch([request])[0] for request in (short, long)]
+    assert all(alone)
+    # Промпты разной длины: короткий дополняется паддингом слева
+    assert tiny_llm.generate_batch([short, long]) == alone
+    assert tiny_llm.generate_batch([long, short]) == alone[::-1]
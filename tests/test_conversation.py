@@ -0,0 +1,72 @@
+import conversation
+from conversation import ConversationStore
+
+
+def words(role, content):
+    # Один токен на слово, чтобы бюджет было легко считать
+    return list(range(len(content.split())))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_store(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(conversation.time, "monotonic", clock)
+    params = {"token_budget": 10, "max_chats": 100, "idle_ttl": 3600}
+    params.update(kwargs)
+    return ConversationStore(words, **params), clock
+
+
+def test_history_trimmed_to_token_budget(monkeypatch):
+    store, _ = make_store(monkeypatch)
+    store.append(1, "user", "раз два три")
+    store.append(1, "bot", "четыре пять шесть")
+    store.append(1, "user", "семь восемь девять")
+    assert [turn.content for turn in store.history(1)] == [
+        "раз два три", "четыре пять шесть", "семь восемь девять"]
+    # 12 токенов больше бюджета - удаляется самое старое сообщение
+    store.append(1, "bot", "десять одиннадцать")
+    assert [turn.content for turn in store.history(1)] == [
+        "четыре пять шесть", "семь восемь девять", "десять одиннадцать"]
+    assert store._chats[1].tokens == 8
+
+
+def test_last_message_kept_even_over_budget(monkeypatch):
+    store, _ = make_store(monkeypatch, token_budget=3)
+    store.append(1, "user", "коротко")
+    store.append(1, "user", "очень длинное сообщение больше всего бюджета")
+    assert [turn.content for turn in store.history(1)] == ["очень длинное сообщение больше всего бюджета"]
+
+
+def test_least_recently_used_chat_evicted(monkeypatch):
+    store, clock = make_store(monkeypatch, max_chats=2)
+    store.append(1, "user", "первый")
+    clock.now += 1
+    store.append(2, "user", "второй")
+    clock.now += 1
+    # Обращение к первому чату делает давним второй
+    assert store.history(1)
+    clock.now += 1
+    store.append(3, "user", "третий")
+    assert len(store) == 2
+    assert store.history(2) == []
+    assert [turn.content for turn in store.history(1)] == ["первый"]
+    assert [turn.content for turn in store.history(3)] == ["третий"]
+
+
+def test_idle_chats_expire(monkeypatch):
+    store, clock = make_store(monkeypatch, idle_ttl=60)
+    store.append(1, "user", "давний")
+    clock.now += 30
+    store.append(2, "user", "недавний")
+    clock.now += 40
+    # Первый чат простаивает 70 секунд, второй - 40
+    assert store.history(1) == []
+    assert [turn.content for turn in store.history(2)] == ["недавний"]
+    assert len(store) == 1
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import re
+import threading
+
+import pytest
+from aiohttp import web
+
+from crawler import Crawler, assemble
+from page_cache import PageCache, write_atomic
+
+PAGES = 40
+_LINK_RE = re.compile(r'href="([^"]+)"')
+_MAIN_RE = re.compile(r"<main>(.*?)</main>", re.S)
+
+
+def page_links(n: int) -> list:
+    return [child for child in (2 * n + 1, 2 * n + 2) if child < PAGES]
+
+
+def make_site():
+    """Сайт-двоичное дерево из PAGES страниц. Четные страницы отдают ETag и 304,
+    нечетные условные запросы не поддерживают, но отдают Last-Modified, который
+    меняется вместе со stats["generation"]; на каждой седьмой нет основного текста."""
+    stats = {"requests": 0, "not_modified": 0, "generation": 0}
+    first_requests = asyncio.Event()
+
+    async def page(request):
+        n = int(request.match_info["n"])
+        stats["requests"] += 1
+        if stats["requests"] >= 10:
+            first_requests.set()
+        # Немного задержки, чтобы загрузчики работали одновременно
+        await asyncio.sleep(0.005 * (n % 3))
+        etag = f'"v{n}"'
+        if n % 2 == 0 and request.headers.get("If-None-Match") == etag:
+            stats["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        links = "".join(f'<a href="/page/{child}#top">{child}</a>' for child in page_links(n))
+        links += '<a href="https://example.com/">внешняя</a>'
+        body = "" if n % 7 == 3 else f"<main>Страница {n}</main>"
+        html = f"<html><body>{body}{links}</body></html>"
+        headers = {"ETag": etag} if n % 2 == 0 else {"Last-Modified": last_modified(stats["generation"])}
+        return web.Response(text=html, content_type="text/html", headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/page/{n}", page)
+    return app, stats, first_requests
+
+
+def last_modified(generation: int) -> str:
+    return f"Mon, {generation + 1:02d} Jan 2024 00:00:00 GMT"
+
+
+def extract(url, html):
+    match = _MAIN_RE.search(html)
+    return (match.group(1) if match else None), [url.split("/page/")[0] + link if link.startswith("/") else link
+                                                  for link in _LINK_RE.findall(html)]
+
+
+def bfs_order() -> list:
+    order, queue = [], [0]
+    while queue:
+        n = queue.pop(0)
+        order.append(n)
+        queue.extend(page_links(n))
+    return order
+
+
+async def start_site():
+    app, stats, first_requests = make_site()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", stats, first_requests
+
+
+def make_crawler(base_url, records_path, **kwargs):
+    return Crawler([base_url + "/page/0"], extract, lambda url: url.startswith(base_url), records_path,
+                   concurrency=4, per_host=3, delay=0, **kwargs)
+
+
+def read_records(path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def expected_records(base_url) -> list:
+    return [{"n": order, "url": f"{base_url}/page/{n}", "text": f"Страница {n}"}
+            for order, n in enumerate(bfs_order()) if n % 7 != 3]
+
+
+def test_crawl_writes_pages_in_discovery_order(tmp_path):
+    async def scenario():
+        runner, base_url, stats, _ = await start_site()
+        try:
+            crawler = make_crawler(base_url, str(tmp_path / "pages.jsonl"))
+            written = await crawler.run()
+            return base_url, stats, crawler, written
+        finally:
+            await runner.cleanup()
+
+    base_url, stats, crawler, written = asyncio.run(scenario())
+    expected = expected_records(base_url)
+    assert read_records(tmp_path / "pages.jsonl") == expected
+    assert written == len(expected)
+    # Каждая страница загружается один раз, несмотря на якоря
+    assert stats["requests"] == PAGES
+    assert crawler.stats["downloaded"] == PAGES
+    assert not (tmp_path / "pages.jsonl.checkpoint").exists()
+    assert assemble(str(tmp_path / "pages.jsonl"), str(tmp_path / "pages.txt")) == len(expected)
+    assert (tmp_path / "pages.txt").read_text(encoding="utf-8") == "\n\n".join(r["text"] for r in expected)
+
+
+def test_recrawl_uses_cache(tmp_path):
+    cache = PageCache(str(tmp_path / "cache"))
+
+    async def scenario():
+        runner, base_url, stats, _ = await start_site()
+        try:
+            await make_crawler(base_url, str(tmp_path / "first.jsonl"), cache=cache).run()
+            stats["requests"] = 0
+            stats["generation"] = 1
+            crawler = make_crawler(base_url, str(tmp_path / "second.jsonl"), cache=cache)
+            await crawler.run()
+            return base_url, stats, crawler
+        finally:
+            await runner.cleanup()
+
+    base_url, stats, crawler = asyncio.run(scenario())
+    # Четные страницы отвечают 304, нечетные приходят заново, но с тем же телом
+    assert crawler.stats == {"downloaded": 0, "not_modified": PAGES // 2, "unchanged": PAGES // 2,
+                             "from_cache": 0}
+    assert stats["not_modified"] == PAGES // 2
+    assert read_records(tmp_path / "second.jsonl") == expected_records(base_url)
+    # У неизменившихся страниц в кэше обновлены заголовки ответа
+    assert cache.get(base_url + "/page/1")["last_modified"] == last_modified(1)
+    assert cache.get(base_url + "/page/2")["etag"] == '"v2"'
+
+    # Без сети обход идет по ссылкам из кэша и дает тот же результат
+    offline = make_crawler(base_url, str(tmp_path / "offline.jsonl"), cache=cache, offline=True)
+    asyncio.run(offline.run())
+    assert offline.stats["from_cache"] == PAGES
+    assert read_records(tmp_path / "offline.jsonl") == expected_records(base_url)
+
+
+def test_interrupted_crawl_resumes(tmp_path):
+    records_path = str(tmp_path / "pages.jsonl")
+
+    async def scenario():
+        runner, base_url, stats, first_requests = await start_site()
+        try:
+            task = asyncio.create_task(make_crawler(base_url, records_path, checkpoint_interval=0).run())
+            await first_requests.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            interrupted_at = stats["requests"]
+            assert (tmp_path / "pages.jsonl.checkpoint").exists()
+            assert 0 < len(read_records(records_path)) < len(expected_records(base_url))
+            crawler = make_crawler(base_url, records_path)
+            await crawler.run()
+            return base_url, stats, interrupted_at
+        finally:
+            await runner.cleanup()
+
+    base_url, stats, interrupted_at = asyncio.run(scenario())
+    assert interrupted_at < PAGES
+    assert read_records(records_path) == expected_records(base_url)
+    # Заново загружаются только страницы, которые не успели записаться до прерывания
+    assert stats["requests"] < interrupted_at + PAGES
+
+
+def test_write_atomic_concurrent_writers(tmp_path):
+    path = str(tmp_path / "record.json")
+    payloads = [bytes([n]) * 100000 for n in range(8)]
+    threads = [threading.Thread(target=write_atomic, args=(path, payload)) for payload in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with open(path, "rb") as f:
+        assert f.read() in payloads
+    # Временные файлы не остаются
+    assert [p.name for p in tmp_path.iterdir()] == ["record.json"]
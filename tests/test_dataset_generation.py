@@ -0,0 +1,113 @@
+import functools
+import sys
+
+import pytest
+
+import creating_dataset
+from dataset_runner import Manifest, Runner
+
+CHUNKS = 8
+EXAMPLES_PER_CHUNK = 4  # Столько примеров отвечает fake_llm_server
+
+
+def write_chunks(path, chunks):
+    path.write_text("\n\n".join(chunks), encoding="utf-8")
+
+
+def make_chunks():
+    return [f"Правило {n}: персонаж совершает проверку характеристики, бросая к20 и добавляя модификатор. "
+            f"Сложность проверки определяет Мастер." for n in range(CHUNKS)]
+
+
+@pytest.fixture
+def run_generation(tmp_path, monkeypatch):
+    # Короткие паузы между повторами, чтобы тест не ждал секундами
+    monkeypatch.setattr(creating_dataset, "Runner", functools.partial(Runner, base_delay=0.05, max_delay=0.2))
+
+    def run(base_url, max_retries=10):
+        monkeypatch.setattr(sys, "argv", [
+            "creating_dataset.py", "--input", str(tmp_path / "rules.txt"), "--output", str(tmp_path / "dataset.jsonl"),
+            "--backend", "openai", "--base-url", base_url, "--model", "fake", "--rpm", "6000",
+            "--concurrency", "4", "--max-retries", str(max_retries)])
+        creating_dataset.main()
+        return (tmp_path / "dataset.jsonl").read_text(encoding="utf-8")
+
+    return run
+
+
+def test_rerun_regenerates_only_changed_entries(tmp_path, monkeypatch, fake_llm_server, run_generation):
+    chunks = make_chunks()
+    write_chunks(tmp_path / "rules.txt", chunks)
+    # Первый запуск упирается в квоту (4 запроса в секунду), но обрабатывает все фрагменты
+    url, stats = fake_llm_server(rpm=4, period=1)
+    dataset = run_generation(url)
+    assert stats()["rate_limited"] > 0
+    assert stats()["ok"] == CHUNKS
+    assert len(dataset.splitlines()) == CHUNKS * EXAMPLES_PER_CHUNK
+
+    url, stats = fake_llm_server()
+    # Повторный запуск не обращается к API и собирает тот же датасет
+    assert run_generation(url) == dataset
+    assert stats()["requests"] == 0
+
+    # Изменился один фрагмент - запрос только для него, остальные примеры на месте
+    chunks[3] = chunks[3].replace("Правило 3", "Новое правило 3")
+    write_chunks(tmp_path / "rules.txt", chunks)
+    changed = run_generation(url)
+    assert stats()["requests"] == 1
+    assert "Новое правило 3" in changed
+    assert len(changed.splitlines()) == CHUNKS * EXAMPLES_PER_CHUNK
+    assert len(set(changed.splitlines()) & set(dataset.splitlines())) == (CHUNKS - 1) * EXAMPLES_PER_CHUNK
+
+    # Другая версия промпта делает устаревшими все записи
+    monkeypatch.setattr(creating_dataset, "PROMPT_VERSION", "changed")
+    run_generation(url)
+    assert stats()["requests"] == 1 + CHUNKS
+
+
+def test_failed_chunks_are_retried_on_next_run(tmp_path, fake_llm_server, run_generation):
+    write_chunks(tmp_path / "rules.txt", make_chunks())
+    # Сервер всегда отвечает 503: фрагменты остаются в манифесте с ошибкой
+    url, _ = fake_llm_server(error_rate=1.0)
+    assert run_generation(url, max_retries=1) == ""
+    manifest = Manifest(str(tmp_path / "dataset.manifest.jsonl"))
+    assert {entry["status"] for entry in manifest.entries.values()} == {"failed"}
+
+    url, stats = fake_llm_server()
+    dataset = run_generation(url)
+    assert stats()["requests"] == CHUNKS
+    assert len(dataset.splitlines()) == CHUNKS * EXAMPLES_PER_CHUNK
+
+
+def test_empty_responses_are_retried_on_next_run(tmp_path, fake_llm_server, run_generation, capsys):
+    write_chunks(tmp_path / "rules.txt", make_chunks())
+    # Модель отвечает пустым текстом, как при блокировке: это не готовый фрагмент
+    url, stats = fake_llm_server(empty_rate=1.0)
+    assert run_generation(url) == ""
+    assert stats()["empty"] == CHUNKS
+    manifest = Manifest(str(tmp_path / "dataset.manifest.jsonl"))
+    assert {entry["status"] for entry in manifest.entries.values()} == {"empty"}
+
+    capsys.readouterr()
+    url, stats = fake_llm_server()
+    dataset = run_generation(url)
+    assert f"после ответа без примеров {CHUNKS}" in capsys.readouterr().out
+    assert stats()["requests"] == CHUNKS
+    assert len(dataset.splitlines()) == CHUNKS * EXAMPLES_PER_CHUNK
+
+
+def test_manifest_drops_torn_line_and_keeps_last_entry(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    manifest = Manifest(path)
+    key = Manifest.key("текст", "fake", "v1")
+    manifest.record(key, "failed", error="HTTP 503")
+    manifest.record(key, "ok", [{"instruction": "в", "output": "о"}])
+    manifest.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "оборванная')
+
+    manifest = Manifest(path)
+    assert manifest.status(key) == "ok"
+    assert manifest.status(Manifest.key("текст", "fake", "v2")) is None
+    with open(path, encoding="utf-8") as f:
+        assert f.read().endswith("\n")
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+
+from dataset_runner import OpenAICompatibleBackend, RetryableError, Runner, TokenBucket
+
+PROMPTS = [f"--- ТЕКСТ НАЧАЛО ---\nПравило {n}" for n in range(8)]
+
+
+def make_runner(url, **kwargs):
+    # Короткие паузы между повторами, чтобы тест не ждал секундами
+    return Runner(OpenAICompatibleBackend(url, "fake"), requests_per_minute=6000, concurrency=4,
+                  base_delay=0.05, max_delay=0.2, **kwargs)
+
+
+def test_runner_retries_rate_limits_and_errors(fake_llm_server):
+    # Квота 4 запроса в секунду и 20% ответов 503
+    url, stats = fake_llm_server(rpm=4, error_rate=0.2, period=1)
+    runner = make_runner(url, max_retries=10)
+    answers = {}
+
+    async def handle(prompt):
+        answers[prompt] = await runner.generate(prompt)
+
+    asyncio.run(runner.run(PROMPTS, handle))
+    server = stats()
+    assert len(answers) == len(PROMPTS)
+    assert all("Правило" in answer for answer in answers.values())
+    assert server["rate_limited"] > 0
+    assert server["ok"] == len(PROMPTS)
+    assert runner.stats == {"requests": server["requests"], "retries": server["rate_limited"] + server["errors"],
+                            "failed": 0}
+    assert server["max_in_flight"] <= 4
+
+
+def test_runner_gives_up_after_max_retries(fake_llm_server):
+    url, stats = fake_llm_server(error_rate=1.0)
+    runner = make_runner(url, max_retries=2)
+    failed = []
+
+    async def handle(prompt):
+        try:
+            await runner.generate(prompt)
+        except RetryableError:
+            failed.append(prompt)
+            raise
+
+    asyncio.run(runner.run(PROMPTS[:2], handle))
+    assert sorted(failed) == PROMPTS[:2]
+    assert stats()["errors"] == 2 * 3
+    assert runner.stats["failed"] == 2
+
+
+def test_client_errors_are_not_retried(fake_llm_server):
+    url, stats = fake_llm_server()
+    runner = make_runner(url, max_retries=5)
+    runner.backend.url = url + "/v1/missing"
+
+    async def generate():
+        try:
+            await runner.generate(PROMPTS[0])
+        finally:
+            await runner.backend.close()
+
+    with pytest.raises(RuntimeError, match="HTTP 404"):
+        asyncio.run(generate())
+    assert runner.stats["requests"] == 1
+
+
+def test_token_bucket_limits_rate():
+    async def acquire(bucket, times):
+        started_at = time.monotonic()
+        for _ in range(times):
+            await bucket.acquire()
+        return time.monotonic() - started_at
+
+    # 600 в минуту - раз в 0.1 с; первые burst разрешений выдаются сразу
+    assert asyncio.run(acquire(TokenBucket(600, burst=3), 3)) < 0.05
+    elapsed = asyncio.run(acquire(TokenBucket(600, burst=1), 5))
+    assert 0.35 <= elapsed < 1.0
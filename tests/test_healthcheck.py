@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from model_loader import FAILED, LOADING, READY
+
+
+class StatusBackend:
+    def __init__(self, state):
+        self.state = state
+
+    async def status(self):
+        return {"model": self.state, "pending": 0}
+
+
+# Состояние модели -> (ответ /healthz, ответ /livez); "unavailable" - сервер инференса недоступен
+@pytest.mark.parametrize("state, ready, alive", [
+    (READY, 200, 200),
+    (LOADING, 503, 200),
+    ("unavailable", 503, 200),
+    (FAILED, 503, 503),
+])
+def test_health_endpoints(monkeypatch, state, ready, alive):
+    import main
+
+    monkeypatch.setattr(main, "backend", StatusBackend(state))
+    assert asyncio.run(main.healthcheck(None)).status == ready
+    assert asyncio.run(main.livecheck(None)).status == alive
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+
+import pytest
+
+from inference import GenerationRequest, InferenceQueueFull, InferenceWorker, RequestSuperseded
+
+
+class FakeModel:
+    """generate_batch без модели: отвечает текстом промпта и запоминает батчи.
+
+    Запрос с промптом "занять" держит поток генерации, пока тест не вызовет release().
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.busy = threading.Event()
+        self._gate = threading.Event()
+
+    def generate_batch(self, requests):
+        self.batches.append([(request.prompt, request.adapter) for request in requests])
+        if any(request.prompt == "занять" for request in requests):
+            self.busy.set()
+            self._gate.wait(5)
+        return [request.prompt for request in requests]
+
+    def release(self):
+        self._gate.set()
+
+
+async def occupy(worker, model):
+    """Ставит запрос, занимающий модель, и ждет начала его генерации."""
+    task = asyncio.create_task(worker.submit(GenerationRequest("занять")))
+    await asyncio.get_running_loop().run_in_executor(None, model.busy.wait, 5)
+    return task
+
+
+def make_worker(model, **kwargs):
+    params = {"max_queue_size": 10, "timeout": 5, "max_batch_size": 8, "batch_window": 0}
+    params.update(kwargs)
+    worker = InferenceWorker(model.generate_batch, **params)
+    worker.start()
+    return worker
+
+
+def test_queue_full():
+    model = FakeModel()
+
+    async def scenario():
+        worker = make_worker(model, max_queue_size=2)
+        busy = await occupy(worker, model)
+        queued = asyncio.create_task(worker.submit(GenerationRequest("второй")))
+        await asyncio.sleep(0)
+        with pytest.raises(InferenceQueueFull):
+            await worker.submit(GenerationRequest("третий"))
+        assert worker.pending == 2
+        model.release()
+        results = await busy, await queued
+        worker.shutdown()
+        return results, worker.pending
+
+    assert asyncio.run(scenario()) == (("занять", "второй"), 0)
+
+
+def test_queued_request_superseded_by_same_key():
+    model = FakeModel()
+
+    async def scenario():
+        worker = make_worker(model)
+        busy = await occupy(worker, model)
+        old = asyncio.create_task(worker.submit(GenerationRequest("старое"), key=1))
+        other = asyncio.create_task(worker.submit(GenerationRequest("другой чат"), key=2))
+        await asyncio.sleep(0)
+        new = asyncio.create_task(worker.submit(GenerationRequest("новое"), key=1))
+        await asyncio.sleep(0)
+        with pytest.raises(RequestSuperseded):
+            await old
+        assert worker.pending == 3
+        model.release()
+        results = await busy, await other, await new
+        worker.shutdown()
+        return results, worker.pending
+
+    assert asyncio.run(scenario()) == (("занять", "другой чат", "новое"), 0)
+    assert [prompt for batch in model.batches for prompt, _ in batch] == ["занять", "другой чат", "новое"]
+
+
+def test_timed_out_requests_are_skipped():
+    model = FakeModel()
+
+    async def scenario():
+        # Запас, чтобы планировщик успел взять первый запрос даже на загруженной машине
+        worker = make_worker(model, timeout=0.3)
+        busy = await occupy(worker, model)
+        with pytest.raises(asyncio.TimeoutError):
+            await worker.submit(GenerationRequest("не дождался"))
+        with pytest.raises(asyncio.TimeoutError):
+            await busy
+        model.release()
+        # Планировщик доходит до снятого запроса и только списывает его
+        for _ in range(100):
+            if worker.pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        pending = worker.pending
+        worker.shutdown()
+        return pending
+
+    assert asyncio.run(scenario()) == 0
+    assert model.batches == [[("занять", None)]]
+
+
+def test_batches_grouped_by_adapter_in_queue_order():
+    model = FakeModel()
+    requests = [("A1", "a"), ("B1", "b"), ("A2", "a"), ("B2", "b"), ("A3", "a"), ("базовая", None)]
+
+    async def scenario():
+        worker = make_worker(model, max_batch_size=2)
+        busy = await occupy(worker, model)
+        tasks = [asyncio.create_task(worker.submit(GenerationRequest(prompt, adapter=adapter)))
+                 for prompt, adapter in requests]
+        await asyncio.sleep(0)
+        model.release()
+        results = [await busy] + [await task for task in tasks]
+        worker.shutdown()
+        return results
+
+    assert asyncio.run(scenario()) == ["занять"] + [prompt for prompt, _ in requests]
+    # Батч собирается по адаптеру первого запроса очереди; остальные сохраняют свое место
+    assert model.batches[1:] == [
+        [("A1", "a"), ("A2", "a")],
+        [("B1", "b"), ("B2", "b")],
+        [("A3", "a")],
+        [("базовая", None)],
+    ]
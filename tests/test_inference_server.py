@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from inference_server import create_app
+
+
+class RecordingBackend:
+    """LocalBackend без модели: запоминает добавленные сообщения и режимы."""
+
+    def __init__(self):
+        self.messages = []
+        self.modes_set = []
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def append(self, chat_id, role, content):
+        self.messages.append((chat_id, role, content))
+
+    async def set_mode(self, chat_id, mode):
+        if mode != "dm":
+            raise ValueError(f"Неизвестный режим: {mode}")
+        self.modes_set.append((chat_id, mode))
+
+    async def generate(self, chat_id, rules=None, standalone=False, on_text=None):
+        return "ответ"
+
+
+def request(backend, method, path, **kwargs):
+    async def scenario():
+        async with TestClient(TestServer(create_app(backend))) as client:
+            response = await client.request(method, path, **kwargs)
+            return response.status, await response.json()
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("POST", "/chats/1/messages", {"role": "user"}),
+    ("POST", "/chats/1/messages", {"role": "user", "content": 5}),
+    ("POST", "/chats/1/messages", ["user", "привет"]),
+    ("POST", "/chats/x/messages", {"role": "user", "content": "привет"}),
+    ("PUT", "/chats/1/mode", {}),
+    ("PUT", "/chats/1/mode", {"mode": "нет такого"}),
+    ("POST", "/chats/1/generate", "не объект"),
+])
+def test_malformed_requests_are_bad_requests(method, path, body):
+    backend = RecordingBackend()
+    status, data = request(backend, method, path, json=body)
+    assert status == 400
+    assert data["error"] == "bad_request"
+    assert backend.messages == [] and backend.modes_set == []
+
+
+def test_invalid_json_is_bad_request():
+    status, data = request(RecordingBackend(), "POST", "/chats/1/messages", data=b"{",
+                           headers={"Content-Type": "application/json"})
+    assert (status, data["error"]) == (400, "bad_request")
+
+
+def test_valid_requests():
+    backend = RecordingBackend()
+    assert request(backend, "POST", "/chats/1/messages", json={"role": "user", "content": "привет"}) == (200, {})
+    assert request(backend, "PUT", "/chats/1/mode", json={"mode": "dm"}) == (200, {})
+    assert request(backend, "POST", "/chats/1/generate", json={}) == (200, {"response": "ответ"})
+    assert backend.messages == [(1, "user", "привет")]
+    assert backend.modes_set == [(1, "dm")]
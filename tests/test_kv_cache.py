@@ -0,0 +1,40 @@
+from conversation import Turn
+from inference import GenerationRequest
+from kv_cache import KVCacheStore
+
+
+def make_request(llm, messages, chat_id=None):
+    turns = [Turn(role, content, llm.tokenize_message(role, content)) for role, content in messages]
+    prompt, token_ids = llm.build_prompt(turns)
+    return GenerationRequest(prompt, token_ids=token_ids, chat_id=chat_id)
+
+
+def test_cached_turn_matches_uncached(tiny_llm):
+    llm = tiny_llm
+    first = [("user", "Я захожу в таверну и осматриваюсь.")]
+    answer = llm.generate_batch([make_request(llm, first)])[0]
+    second = first + [("bot", answer), ("user", "Подхожу к трактирщику.")]
+    uncached = llm.generate_batch([make_request(llm, second)])[0]
+
+    llm.kv_cache = KVCacheStore(max_bytes=2 ** 30)
+    assert llm.generate_batch([make_request(llm, first, chat_id=1)])[0] == answer
+    request = make_request(llm, second, chat_id=1)
+    reused, _ = llm.kv_cache.get((1, None), request.token_ids)
+    # Переиспользуется весь первый ход вместе с ответом, а не только системный префикс
+    assert reused > len(llm.system_prefix_ids) + len(llm.tokenize_message("user", first[0][1]))
+    assert llm.generate_batch([request])[0] == uncached
+
+
+def test_cached_and_fresh_rows_in_one_batch(tiny_llm):
+    llm = tiny_llm
+    first = [("user", "Атакую гоблина мечом!")]
+    answer = llm.generate_batch([make_request(llm, first)])[0]
+    second = first + [("bot", answer), ("user", "Добиваю его.")]
+    other = [("user", "Что такое спасбросок?")]
+    expected = [llm.generate_batch([make_request(llm, messages)])[0] for messages in (second, other)]
+
+    llm.kv_cache = KVCacheStore(max_bytes=2 ** 30)
+    llm.generate_batch([make_request(llm, first, chat_id=1)])
+    # Строка с кэшем чата и строка только с системным префиксом в одном батче
+    batch = [make_request(llm, second, chat_id=1), make_request(llm, other, chat_id=2)]
+    assert llm.generate_batch(batch) == expected
@@ -0,0 +1,62 @@
+from response_cache import ResponseCache, is_rules_question
+
+
+def make_cache(**kwargs):
+    params = {"max_entries": 100, "ttl": 3600, "similarity": 0.75}
+    params.update(kwargs)
+    return ResponseCache(**params)
+
+
+def test_exact_match_ignores_case_and_punctuation():
+    cache = make_cache()
+    cache.put("Как работает преимущество?", "Бросаете два к20 и берете больший.")
+    assert cache.get("как работает  преимущество") == "Бросаете два к20 и берете больший."
+
+
+def test_similar_question_matches():
+    cache = make_cache()
+    cache.put("Как работает преимущество?", "ответ про преимущество")
+    cache.put("Как работают спасброски?", "ответ про спасброски")
+    # Другие словоформы и служебные слова
+    assert cache.get("что такое преимущество") == "ответ про преимущество"
+    assert cache.get("как работает спасбросок") == "ответ про спасброски"
+    assert cache.get("как работает помеха") is None
+
+
+def test_numbers_must_be_equal():
+    cache = make_cache()
+    cache.put("Сколько ячеек заклинаний у волшебника 3 уровня?", "ответ для 3 уровня")
+    assert cache.get("сколько ячеек заклинаний у волшебника 5 уровня") is None
+    assert cache.get("Сколько ячеек заклинаний у волшебника 3-го уровня") == "ответ для 3 уровня"
+    assert cache.get("сколько ячеек заклинаний у волшебника") is None
+
+
+def test_namespaces_are_separate():
+    cache = make_cache()
+    cache.put("Что такое спасбросок?", "ответ мастера", namespace="dm")
+    assert cache.get("Что такое спасбросок?", namespace="rules") is None
+    assert cache.get("Что такое спасбросок?", namespace="dm") == "ответ мастера"
+
+
+def test_expired_and_evicted_entries_are_dropped():
+    cache = make_cache(ttl=0)
+    cache.put("Что такое спасбросок?", "ответ")
+    assert cache.get("Что такое спасбросок?") is None
+    assert len(cache) == 0
+
+    cache = make_cache(max_entries=2)
+    cache.put("Что такое спасбросок?", "1")
+    cache.put("Что такое инициатива?", "2")
+    cache.get("Что такое спасбросок?")
+    cache.put("Что такое захват?", "3")
+    assert len(cache) == 2
+    # Вытесняется давно использованный вопрос, а не первый добавленный
+    assert cache.get("Что такое инициатива?") is None
+    assert cache.get("Что такое спасбросок?") == "1"
+
+
+def test_is_rules_question():
+    assert is_rules_question("Как работает преимущество?")
+    assert is_rules_question("Сколько хитов у гоблина")
+    assert not is_rules_question("Я атакую гоблина мечом!")
+    assert not is_rules_question("Что такое " + "очень " * 50 + "длинный вопрос")
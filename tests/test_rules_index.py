@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from build_rules_index import DEFAULT_SOURCES
+from config import RAG_MIN_SCORE, RAG_TOP_K
+from rules_index import RulesIndex, build_index, normalize_word, tokenize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Типичный вопрос о правилах -> начало фрагмента, который должен найтись
+CANONICAL_QUESTIONS = [
+    ("Как работает преимущество?", "ПРЕИМУЩЕСТВО И ПОМЕХА"),
+    ("как работает помеха", "ПРЕИМУЩЕСТВО И ПОМЕХА"),
+    ("что такое спасбросок", "Спасброски отражают вашу попытку"),
+    ("Сколько хитов восстанавливает короткий отдых", "В конце короткого отдыха персонаж"),
+    ("что такое длинный отдых", "Длинный отдых - это долгий период"),
+    ("что такое бонус мастерства", "У персонажей есть бонус мастерства"),
+    ("критическое попадание", "КРИТИЧЕСКИЕ ПОПАДАНИЯ"),
+    ("спасброски от смерти", "Если вы получаете урон, когда у вас уже 0 хитов"),
+    ("как работает захват", "Цель вашего захвата"),
+    ("как определяется инициатива", "Значение Инициативы персонажа"),
+    ("что делает действие засада", "ЗАСАДА Если вы совершаете действие Засада"),
+]
+
+
+@pytest.fixture(scope="module")
+def rules_index(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("rules_index") / "index")
+    build_index([os.path.join(ROOT, source) for source in DEFAULT_SOURCES], path)
+    return RulesIndex(path)
+
+
+@pytest.mark.parametrize("question, expected", CANONICAL_QUESTIONS)
+def test_canonical_question_finds_passage(rules_index, question, expected):
+    found = rules_index.search(question, RAG_TOP_K, min_score=RAG_MIN_SCORE)
+    assert any(expected in passage for _, passage in found), [passage[:80] for _, passage in found]
+
+
+def test_word_forms_share_stem():
+    for forms in (["спасбросок", "спасброски", "спасброска", "спасбросков", "спасброску"],
+                  ["отдых", "отдыха", "отдыхе"],
+                  ["работает", "работаете", "работать"],
+                  ["заклинание", "заклинания", "заклинаний"]):
+        assert len({normalize_word(word) for word in forms}) == 1, forms
+
+
+def test_stop_words_and_hyphenation():
+    assert tokenize("Что такое спасбросок?") == ["спасброск"]
+    # Переносы из PDF склеиваются
+    assert tokenize("Потраченные Кости восстанав- ливаются, от- дых") == tokenize("Потраченные Кости восстанавливаются, отдых")
@@ -0,0 +1,130 @@
+import sqlite3
+import time
+
+from conversation import ConversationStore
+from sessions import SQLiteSessionBackend
+
+
+def open_backend(path, **kwargs):
+    # Фоновый поток не пишет сам: сброс на диск вызывается в тесте явно
+    return SQLiteSessionBackend(str(path), flush_interval=3600, **kwargs)
+
+
+def stored_rows(path, chat_id):
+    with sqlite3.connect(str(path)) as connection:
+        return connection.execute("SELECT role, content FROM messages WHERE chat_id = ? ORDER BY id",
+                                  (chat_id,)).fetchall()
+
+
+def test_history_survives_reopen(tmp_path):
+    path = tmp_path / "sessions.db"
+    backend = open_backend(path)
+    backend.append(1, "user", "Привет")
+    backend.append(1, "bot", "Здравствуй, путник")
+    # До сброса на диск сообщения видны из буфера
+    assert stored_rows(path, 1) == []
+    assert backend.load(1, 10) == [("user", "Привет"), ("bot", "Здравствуй, путник")]
+    backend.flush()
+    assert stored_rows(path, 1) == [("user", "Привет"), ("bot", "Здравствуй, путник")]
+    backend.append(1, "user", "Что дальше?")
+    backend.append(2, "user", "Другой чат")
+    backend.close()
+
+    backend = open_backend(path)
+    assert backend.load(1, 10) == [("user", "Привет"), ("bot", "Здравствуй, путник"), ("user", "Что дальше?")]
+    assert backend.load(1, 1) == [("user", "Что дальше?")]
+    assert backend.load(2, 10) == [("user", "Другой чат")]
+    backend.close()
+
+
+def test_delete_is_persisted(tmp_path):
+    path = tmp_path / "sessions.db"
+    backend = open_backend(path)
+    backend.append(1, "user", "Старое")
+    backend.flush()
+    backend.delete(1)
+    backend.append(1, "user", "Новое")
+    assert backend.load(1, 10) == [("user", "Новое")]
+    backend.close()
+
+    backend = open_backend(path)
+    assert backend.load(1, 10) == [("user", "Новое")]
+    backend.close()
+
+
+def test_flush_keeps_last_messages(tmp_path):
+    path = tmp_path / "sessions.db"
+    backend = open_backend(path, keep_messages=3)
+    for n in range(5):
+        backend.append(1, "user", f"Сообщение {n}")
+    backend.append(2, "user", "Соседний чат")
+    backend.flush()
+    backend.append(1, "user", "Сообщение 5")
+    backend.flush()
+    assert [content for _, content in stored_rows(path, 1)] == ["Сообщение 3", "Сообщение 4", "Сообщение 5"]
+    assert stored_rows(path, 2) == [("user", "Соседний чат")]
+    backend.close()
+
+
+def test_prune_removes_idle_chats(tmp_path, monkeypatch):
+    path = tmp_path / "sessions.db"
+    backend = open_backend(path, retention=100)
+    backend.append(1, "user", "Давно")
+    backend.append(2, "user", "Давно")
+    backend.flush()
+    later = time.time() + 150
+    # Чат 2 продолжил разговор позже, чат 1 молчит дольше retention
+    monkeypatch.setattr(time, "time", lambda: later - 50)
+    backend.append(2, "user", "Недавно")
+    backend.flush()
+    monkeypatch.undo()
+    assert backend.prune(now=later) == 1
+    assert stored_rows(path, 1) == []
+    assert stored_rows(path, 2) == [("user", "Давно"), ("user", "Недавно")]
+    backend.close()
+
+
+def test_prune_disabled_without_retention(tmp_path):
+    path = tmp_path / "sessions.db"
+    backend = open_backend(path)
+    backend.append(1, "user", "Навсегда")
+    backend.flush()
+    assert backend.prune(now=time.time() + 10 ** 9) == 0
+    assert stored_rows(path, 1) == [("user", "Навсегда")]
+    backend.close()
+
+
+def test_mode_survives_reopen_and_delete(tmp_path):
+    path = tmp_path / "sessions.db"
+    backend = open_backend(path)
+    backend.save_mode(1, "dm")
+    assert backend.load_mode(1) == "dm"
+    backend.append(1, "user", "Привет")
+    backend.delete(1)
+    backend.close()
+
+    backend = open_backend(path)
+    assert backend.load_mode(1) == "dm"
+    assert backend.load_mode(2) is None
+    assert backend.load(1, 10) == []
+    backend.close()
+
+
+def test_store_restores_mode_after_restart_and_eviction(tmp_path):
+    path = tmp_path / "sessions.db"
+    store = ConversationStore(lambda role, content: [len(content)], token_budget=100, max_chats=1, idle_ttl=3600,
+                              backend=open_backend(path))
+    store.set_mode(1, "rules")
+    # Второй чат вытесняет первый из памяти (max_chats=1)
+    store.append(2, "user", "Привет")
+    assert len(store) == 1
+    assert store.get_mode(1) == "rules"
+    store.close()
+
+    store = ConversationStore(lambda role, content: [len(content)], token_budget=100, max_chats=10, idle_ttl=3600,
+                              backend=open_backend(path))
+    assert store.get_mode(1) == "rules"
+    assert store.get_mode(2) is None
+    store.clear(1)
+    assert store.get_mode(1) == "rules"
+    store.close()
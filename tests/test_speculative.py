@@ -0,0 +1,76 @@
+import shutil
+
+import pytest
+
+import metrics
+from conversation import Turn
+from inference import GenerationRequest
+from kv_cache import KVCacheStore
+
+MESSAGES = [("user", "Я захожу в таверну и осматриваюсь.")]
+
+
+@pytest.fixture(scope="session")
+def tiny_draft_dir(tiny_model_dir, tmp_path_factory):
+    """Модель меньше основной с тем же токенизатором: у нее другие размеры состояния внимания."""
+    import torch
+    from transformers import AutoConfig, MistralForCausalLM
+
+    path = str(tmp_path_factory.mktemp("tiny_draft"))
+    shutil.copytree(tiny_model_dir, path, dirs_exist_ok=True, ignore=shutil.ignore_patterns("*.safetensors", "*.bin"))
+    config = AutoConfig.from_pretrained(tiny_model_dir)
+    config.num_hidden_layers, config.hidden_size, config.intermediate_size = 1, 32, 64
+    config.num_key_value_heads = 1
+    torch.manual_seed(1)
+    MistralForCausalLM(config).save_pretrained(path)
+    return path
+
+
+@pytest.fixture
+def llm_with_draft(tiny_llm, tiny_draft_dir, monkeypatch):
+    """tiny_llm с черновиком, который не пропускается из-за низкой доли принятых токенов."""
+    monkeypatch.setattr(tiny_llm, "DRAFT_MIN_ACCEPTANCE", 0)
+    monkeypatch.setattr(tiny_llm, "_draft_acceptance", None)
+    yield tiny_llm
+    tiny_llm.draft_model = None
+
+
+def make_request(llm, messages, chat_id=None):
+    turns = [Turn(role, content, llm.tokenize_message(role, content)) for role, content in messages]
+    prompt, token_ids = llm.build_prompt(turns)
+    return GenerationRequest(prompt, token_ids=token_ids, chat_id=chat_id)
+
+
+def test_greedy_output_same_with_draft(llm_with_draft, tiny_draft_dir):
+    llm = llm_with_draft
+    expected = llm.generate_batch([make_request(llm, MESSAGES)])[0]
+
+    assert llm.load_draft_model(tiny_draft_dir)
+    proposed = metrics.draft_tokens.value
+    assert llm.generate_batch([make_request(llm, MESSAGES)])[0] == expected
+    # Черновик действительно работал и не был отключен из-за ошибки
+    assert metrics.draft_tokens.value > proposed
+    assert llm.draft_model is not None
+
+
+def test_draft_with_chat_kv_cache(llm_with_draft, tiny_draft_dir):
+    llm = llm_with_draft
+    answer = llm.generate_batch([make_request(llm, MESSAGES)])[0]
+    second = MESSAGES + [("bot", answer), ("user", "Подхожу к трактирщику.")]
+    expected = llm.generate_batch([make_request(llm, second)])[0]
+    third = second + [("bot", expected), ("user", "Спрашиваю о слухах.")]
+    expected_third = llm.generate_batch([make_request(llm, third)])[0]
+
+    llm.kv_cache = KVCacheStore(max_bytes=2 ** 30)
+    assert llm.load_draft_model(tiny_draft_dir)
+    proposed = metrics.draft_tokens.value
+    assert llm.generate_batch([make_request(llm, MESSAGES, chat_id=1)])[0] == answer
+    assert llm.generate_batch([make_request(llm, second, chat_id=1)])[0] == expected
+    assert metrics.draft_tokens.value > proposed
+    assert llm.draft_model is not None
+    # Кэш, сохраненный после генерации с черновиком, годится для обычной генерации
+    llm.draft_model = None
+    request = make_request(llm, third, chat_id=1)
+    reused, _ = llm.kv_cache.get((1, None), request.token_ids)
+    assert reused >= len(make_request(llm, second).token_ids)
+    assert llm.generate_batch([request])[0] == expected_third
@@ -0,0 +1,59 @@
+import torch
+
+from conversation import Turn
+from inference import GenerationRequest
+
+
+def make_request(llm, question):
+    turns = [Turn("user", question, llm.tokenize_message("user", question))]
+    prompt, token_ids = llm.build_prompt(turns)
+    return GenerationRequest(prompt, token_ids=token_ids)
+
+
+def test_stop_on_sequences_per_row():
+    from llm import StopOnSequences
+
+    stop = StopOnSequences([torch.tensor([5, 6]), torch.tensor([9])], prompt_length=2)
+    input_ids = torch.tensor([
+        [1, 2, 3, 5, 6],  # закончилась первой последовательностью
+        [1, 2, 3, 4, 9],  # второй
+        [1, 2, 5, 6, 7],  # последовательность была раньше, но строка ею не заканчивается
+    ])
+    assert stop(input_ids, None).tolist() == [True, True, False]
+    # Последовательность, начавшаяся еще в промпте, не считается
+    assert stop(torch.tensor([[1, 5, 6]]), None).tolist() == [False]
+    prompt_stop = StopOnSequences([torch.tensor([5, 6])], prompt_length=2)
+    assert prompt_stop(torch.tensor([[1, 5, 6]]), None).tolist() == [False]
+
+
+def greedy_tokens(llm, request) -> list:
+    """Новые токены жадной генерации без KV-кэша и без обрезки ответа."""
+    ids = torch.tensor([request.token_ids])
+    with torch.no_grad():
+        output = llm.model.generate(input_ids=ids, attention_mask=torch.ones_like(ids),
+                                    **llm.generation_profile.generate_kwargs(ids.shape[1]))
+    return output[0, ids.shape[1]:].tolist()
+
+
+def test_rows_stop_independently_and_stop_text_is_cut(tiny_llm):
+    llm = tiny_llm
+    profile = llm.generation_profile
+    first, second = make_request(llm, "Атакую гоблина мечом!"), make_request(llm, "Что такое спасбросок?")
+    expected_second = llm.generate_batch([second])[0]
+
+    # Стоп-последовательность - пара токенов, которая есть только в ответе на первый запрос
+    first_tokens, second_tokens = greedy_tokens(llm, first), greedy_tokens(llm, second)
+    split = next(n for n, (a, b) in enumerate(zip(first_tokens, second_tokens)) if a != b)
+    stop = first_tokens[split:split + 2]
+    assert len(stop) == 2 and split > 0
+    assert all(second_tokens[n:n + 2] != stop for n in range(len(second_tokens)))
+    profile.stop_sequences.append(torch.tensor(stop))
+    profile._stop_sequence_lists.append(stop)
+    assert profile.answer_length(first_tokens) == (split, split + 2)
+
+    first_reply, second_reply = llm.generate_batch([first, second])
+    # Первая строка остановилась на стопе, а вторая в том же батче генерировалась дальше
+    assert first_reply == llm.clean_response(llm.tokenizer.decode(first_tokens[:split], skip_special_tokens=True))
+    assert llm.tokenizer.decode(stop, skip_special_tokens=True).strip() not in first_reply
+    assert second_reply == expected_second
+    assert len(second_reply) > len(first_reply)
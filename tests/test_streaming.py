@@ -0,0 +1,78 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import EditMessageText
+
+import streaming
+from streaming import StreamingReply
+
+METHOD = EditMessageText(text="x", chat_id=1, message_id=1)
+
+
+class FakeReply:
+    def __init__(self, errors):
+        # Ошибки, которые по очереди выбросит edit_text; затем правки проходят
+        self.errors = list(errors)
+        self.edits = []
+
+    async def edit_text(self, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.edits.append(text)
+
+    async def delete(self):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, reply):
+        self.reply = reply
+        self.answers = []
+
+    async def answer(self, text):
+        self.answers.append(text)
+        return self.reply
+
+
+def run_reply(errors, updates=("частичный",), final="готово"):
+    msg = FakeMessage(FakeReply(errors))
+
+    async def scenario():
+        stream = StreamingReply(msg, "…", edit_interval=0)
+        await stream.start()
+        for text in updates:
+            stream.update(text)
+            await asyncio.sleep(0.01)
+        await stream.finish(final)
+
+    asyncio.run(scenario())
+    return msg
+
+
+def test_final_text_is_edited_into_placeholder():
+    msg = run_reply([])
+    assert msg.answers == ["…"]
+    assert msg.reply.edits[-1] == "готово"
+
+
+def test_editor_network_error_does_not_break_finish():
+    msg = run_reply([TelegramNetworkError(METHOD, "connection reset")])
+    assert msg.reply.edits[-1] == "готово"
+
+
+def test_failed_final_edit_falls_back_to_new_message():
+    msg = run_reply([TelegramNetworkError(METHOD, "connection reset")], updates=())
+    assert msg.answers == ["…", "готово"]
+
+
+def test_retry_after_is_bounded(monkeypatch):
+    errors = [TelegramRetryAfter(METHOD, "flood", retry_after=0) for _ in range(10)]
+    msg = run_reply(errors, updates=())
+    # Правка сдалась после MAX_EDIT_ATTEMPTS попыток, ответ ушел новым сообщением
+    assert len(msg.reply.errors) == 10 - streaming.MAX_EDIT_ATTEMPTS
+    assert msg.answers == ["…", "готово"]
+
+
+def test_not_modified_is_not_a_failure():
+    msg = run_reply([TelegramBadRequest(METHOD, "Bad Request: message is not modified")], updates=())
+    assert msg.answers == ["…"]
@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import time
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update, User
+
+from config import RATE_LIMIT_BURST
+from model_loader import FAILED
+from throttling import MessageCoalescer, TokenBucket
+
+
+class FakeSession(BaseSession):
+    """Сессия бота без сети: запоминает вызванные методы API."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class FailedBackend:
+    async def status(self):
+        return {"model": FAILED, "pending": 0}
+
+
+def make_update(n: int, user_id: int, text: str) -> Update:
+    return Update(update_id=n, message=Message(
+        message_id=n, date=datetime.datetime.now(), text=text,
+        chat=Chat(id=user_id, type="private"), from_user=User(id=user_id, is_bot=False, first_name="Игрок")))
+
+
+def test_token_bucket():
+    bucket = TokenBucket(capacity=2, rate=100)
+    assert bucket.consume() and bucket.consume()
+    assert not bucket.consume()
+    time.sleep(0.02)
+    assert bucket.consume()
+
+
+def test_rate_limit_applies_only_to_llm_messages(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "backend", FailedBackend())
+    session = FakeSession()
+    bot = Bot("42:TEST", session=session)
+
+    async def feed(user_id, texts):
+        session.requests.clear()
+        for n, text in enumerate(texts):
+            await main.dp.feed_update(bot, make_update(n, user_id, text))
+        return [request.text for request in session.requests if isinstance(request, SendMessage)]
+
+    # Команды не расходуют лимит
+    replies = asyncio.run(feed(101, ["/start"] * (RATE_LIMIT_BURST * 2)))
+    assert len(replies) == RATE_LIMIT_BURST * 2
+    # Сообщения модели: burst ответов, одно предупреждение, остальные отброшены
+    replies = asyncio.run(feed(102, ["Привет"] * (RATE_LIMIT_BURST * 2)))
+    assert len(replies) == RATE_LIMIT_BURST + 1
+    assert replies[-1].startswith("Не так быстро")
+
+
+def test_coalescer_does_not_delay_idle_chat():
+    coalescer = MessageCoalescer(window=0.5)
+    started_at = time.monotonic()
+    assert asyncio.run(coalescer.latest(1))
+    assert time.monotonic() - started_at < 0.1
+
+
+def test_coalescer_merges_messages_while_busy():
+    coalescer = MessageCoalescer(window=0.05)
+
+    async def scenario():
+        with coalescer.busy(1):
+            first = asyncio.create_task(coalescer.latest(1))
+            await asyncio.sleep(0.01)
+            second = asyncio.create_task(coalescer.latest(1))
+            # Другой чат свободен и не ждет
+            assert await coalescer.latest(2)
+            return await first, await second
+
+    assert asyncio.run(scenario()) == (False, True)
+    assert coalescer._busy == {}
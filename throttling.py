@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+
+class TokenBucket:
+    """Корзина токенов: capacity сообщений подряд, затем rate сообщений в секунду."""
+    __slots__ = ("capacity", "rate", "tokens", "updated_at", "warned")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        # Предупреждение о лимите показывается один раз, пока лимит не отпустит
+        self.warned = False
+
+    def consume(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Ограничивает частоту сообщений каждого пользователя корзиной токенов.
+
+    Подключается внутренним middleware (router.message.middleware) к
+    роутеру с обработчиками, которые обращаются к модели, чтобы команды и
+    кнопки не расходовали лимит.
+
+    Пользователь может отправить burst сообщений подряд, дальше -
+    per_minute сообщений в минуту. Сообщения сверх лимита не обрабатываются,
+    а пользователь один раз получает предупреждение. Корзины хранятся для
+    max_users последних пользователей. Пользователи из exempt не ограничиваются.
+    """
+
+    def __init__(self, per_minute: float, burst: int, exempt=(), max_users: int = 100000):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.exempt = set(exempt)
+        self.max_users = max_users
+        self._buckets = OrderedDict()
+
+    async def __call__(self, handler, event: Message, data: dict):
+        user = event.from_user
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+        bucket = self._buckets.get(user.id)
+        if bucket is None:
+            bucket = self._buckets[user.id] = TokenBucket(self.burst, self.per_minute / 60)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user.id)
+
+        if not bucket.consume():
+            logging.info(f"Сообщение от {user.id} отброшено лимитом частоты.")
+            if not bucket.warned:
+                bucket.warned = True
+                await event.answer("Не так быстро, путник! Мастер не успевает за тобой. Подожди немного.")
+            return None
+        bucket.warned = False
+        return await handler(event, data)
+
+
+class MessageCoalescer:
+    """Склеивает быстро идущие подряд сообщения одного чата в одну генерацию.
+
+    latest() сообщает, осталось ли сообщение последним в чате. Ждать
+    приходится, только пока чат занят (генерация идет внутри busy()):
+    тогда latest() ждет window секунд, и если за это время пришло
+    следующее сообщение, ответ на оба даст его обработчик - история чата
+    уже содержит оба сообщения. Сообщение в свободный чат обрабатывается
+    сразу.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._latest = {}
+        # Чат -> число его запросов в очереди или в генерации
+        self._busy = {}
+
+    async def latest(self, chat_id) -> bool:
+        marker = object()
+        self._latest[chat_id] = marker
+        if self.window > 0 and self._busy.get(chat_id):
+            await asyncio.sleep(self.window)
+        if self._latest.get(chat_id) is not marker:
+            return False
+        del self._latest[chat_id]
+        return True
+
+    @contextmanager
+    def busy(self, chat_id):
+        self._busy[chat_id] = self._busy.get(chat_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._busy[chat_id] -= 1
+            if not self._busy[chat_id]:
+                del self._busy[chat_id]